@@ -12,11 +12,20 @@ DEFAULT_ARG_VALS = {
     'default_ratio': [8, 8],
     'valid_time': 8,
     'ec2_max': 768,
+    'run_concurrency': 32,
+    'run_log_max_bytes': 100 * 1024 * 1024,
+    'run_log_backups': 5,
+    'run_tail_lines': 50,
+    'tail': 100,
+    'poll_interval': 10,
+    'terminate_timeout': 600,
+    'cleanup_concurrency': 8,
+    'cleanup_grace': 60,
+    'cleanup_interval': 300,
+    'state_timeout': 600,
+    'batch_concurrency': 4,
     'spot_strategy': 'price-capacity-optimized'
 }
 
 # Required arguments for each Forge job
 REQUIRED_ARGS = {}
-
-# additional admin-created configs
-ADDITIONAL_KEYS = []
@@ -0,0 +1,333 @@
+"""Python API to run Forge jobs in-process, with typed results and errors instead of exit statuses.
+
+Examples
+--------
+>>>from forge import api
+>>>config = api.load_config(yaml='jobs/etl.yaml', forge_env='dev')
+>>>created = api.create(config)
+>>>created.ips
+>>>api.run(config)
+>>>api.destroy(config).cost
+"""
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Optional
+
+from . import DEFAULT_ARG_VALS, REQUIRED_ARGS
+from . import create as create_job
+from . import engine as engine_job
+from . import run as run_job
+from .common import SharedClientSession, ec2_ip
+from .configuration import Configuration
+from .context import JobContext, context_details
+from .destroy import destroy_with_cost, fleet_names, get_fleet_ids
+from .exceptions import ConfigurationError, ExitHandlerException, JobError
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Instance:
+    """an EC2 instance of a Forge fleet"""
+    id: str
+    ip: Optional[str]
+    state: Optional[str]
+    instance_type: Optional[str] = None
+    az: Optional[str] = None
+    launch_time: Optional[datetime] = None
+
+
+@dataclass
+class Fleet:
+    """a Forge fleet and its instances"""
+    name: str
+    market: str
+    fleet_ids: list[str] = field(default_factory=list)
+    instances: list[Instance] = field(default_factory=list)
+
+    @property
+    def ips(self):
+        """list: private IPs of the running instances"""
+        return [i.ip for i in self.instances if i.state == 'running' and i.ip]
+
+
+@dataclass
+class CreateResult:
+    """the result of create"""
+    fleets: list[Fleet]
+    seconds: float
+
+    @property
+    def ips(self):
+        """list: private IPs of the running instances of all fleets"""
+        return [ip for fleet in self.fleets for ip in fleet.ips]
+
+
+@dataclass
+class DestroyResult:
+    """the result of destroy, with the cost of the instances that were running"""
+    fleets: list[Fleet]
+    seconds: float
+    cost: Optional[float] = None
+    on_demand_cost: Optional[float] = None
+    hours: float = 0
+    breakdown: Optional[dict] = None
+
+
+@dataclass
+class RunResult:
+    """the result of run or engine
+
+    destroyed is set when destroy_after_success destroyed the fleets after the job.
+    """
+    status: int
+    seconds: float
+    fleets: list[Fleet] = field(default_factory=list)
+    destroyed: Optional[DestroyResult] = None
+
+
+class _ErrorRecorder(logging.Handler):
+    """keeps the last error logged by Forge in the calling thread, to use as the message of a JobError"""
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.thread = threading.get_ident()
+        self.message = None
+
+    def emit(self, record):
+        if record.thread == self.thread:
+            self.message = record.getMessage()
+
+
+def load_config(**options):
+    """load a Forge config the same way the CLI does
+
+    Parameters
+    ----------
+    options
+        The CLI options, e.g. yaml, forge_env, config_dir, name or ram
+
+    Returns
+    -------
+    Configuration
+        Forge configuration data
+
+    Raises
+    ------
+    ConfigurationError
+        If a config file is missing or an option is invalid
+    """
+    recorder = _ErrorRecorder()
+    logging.getLogger('forge').addHandler(recorder)
+    try:
+        config = Configuration.load_config(options)
+    except SystemExit:
+        raise ConfigurationError(recorder.message or 'Could not load the config') from None
+    except ValueError as e:
+        raise ConfigurationError(str(e)) from e
+    finally:
+        logging.getLogger('forge').removeHandler(recorder)
+
+    config.log_level = config.log_level or DEFAULT_ARG_VALS['log_level']
+    return config
+
+
+def _prepare(job, config: Configuration):
+    """check the options of a job and give it a boto3 session for its profile and region
+
+    The session is kept on the config instead of replacing the default session, so jobs running at the same time with
+    other profiles or regions do not change each other's session.
+    """
+    # The jobs check config.job, e.g. engine only retries after errors when it is set
+    config.job = job
+    if missing := [requisite for requisite in REQUIRED_ARGS[job] if not config[requisite]]:
+        raise ConfigurationError(f'Missing required options for job "{job}": {", ".join(missing)}')
+
+    session = config.aws_session
+    if session is None or (session.profile_name, session.region_name) != (config.aws_profile or 'default',
+                                                                           config.region):
+        config.aws_session = SharedClientSession(profile_name=config.aws_profile, region_name=config.region)
+    if not config.validate_aws_permissions():
+        raise ConfigurationError('Missing or invalid AWS credentials')
+
+    if config.job_context is None:
+        config.job_context = JobContext()
+
+
+def _call(job, func, config: Configuration):
+    """call a job function, turning its exits into a JobError"""
+    recorder = _ErrorRecorder()
+    logging.getLogger('forge').addHandler(recorder)
+    try:
+        return func(config) or 0
+    except SystemExit as e:
+        status = e.code if isinstance(e.code, int) else 1
+        raise JobError(job, status, recorder.message) from None
+    except ExitHandlerException as e:
+        raise JobError(job, 1, recorder.message) from e
+    finally:
+        logging.getLogger('forge').removeHandler(recorder)
+
+
+def _fleets(config: Configuration, n_list=None):
+    """get the fleets of a job, from the job context when possible"""
+    market = config.market or DEFAULT_ARG_VALS['market']
+
+    fleets = []
+    for n in n_list or fleet_names(config):
+        details = context_details(n, config)
+        if details is None:
+            details = ec2_ip(n, config)
+            if any(d.get('id') for d in details):
+                config.job_context.set_fleet(n, details)
+
+        fleets.append(Fleet(
+            name=n,
+            market=market[-1] if 'cluster-worker' in n else market[0],
+            fleet_ids=get_fleet_ids(details),
+            instances=[Instance(d['id'], d.get('ip'), d.get('state'), d.get('instance_type'), d.get('az'),
+                                d.get('launch_time')) for d in details if d.get('id')],
+        ))
+    return fleets
+
+
+def _destroy(config: Configuration):
+    """destroy the fleets of a job that passed _prepare"""
+    start = time.monotonic()
+    fleets = _fleets(config)
+
+    status, breakdown = _call('destroy', destroy_with_cost, config)
+    result = DestroyResult(
+        fleets=fleets,
+        seconds=time.monotonic() - start,
+        cost=breakdown and breakdown['cost'],
+        on_demand_cost=breakdown and breakdown['on_demand_cost'],
+        hours=breakdown['hours'] if breakdown else 0,
+        breakdown=breakdown,
+    )
+    if status:
+        raise JobError('destroy', status, 'Some fleets could not be destroyed', result=result)
+    return result
+
+
+def _finish(job, status, config: Configuration, start, check):
+    """build the result of run or engine, destroying the fleets after success like the CLI does"""
+    result = RunResult(status=status, seconds=0, fleets=_fleets(config))
+
+    if not status and config.destroy_after_success and not config.detach:
+        logger.info('destroy_after_success parameter True, running forge destroy...')
+        result.destroyed = _destroy(config)
+
+    result.seconds = time.monotonic() - start
+    if check and status:
+        raise JobError(job, status, result=result)
+    return result
+
+
+def create(config: Configuration):
+    """create the fleets of a job
+
+    Parameters
+    ----------
+    config : Configuration
+        Forge configuration data
+
+    Returns
+    -------
+    CreateResult
+        The fleets, with the IDs and IPs of their instances
+
+    Raises
+    ------
+    ConfigurationError
+        If the config is missing options or the AWS credentials are invalid
+    JobError
+        If the fleets could not be created
+    """
+    _prepare('create', config)
+    start = time.monotonic()
+    _call('create', create_job.create, config)
+    return CreateResult(fleets=_fleets(config), seconds=time.monotonic() - start)
+
+
+def run(config: Configuration, check=True):
+    """run run_cmd on the fleets of a job
+
+    Parameters
+    ----------
+    config : Configuration
+        Forge configuration data
+    check : bool, default=True
+        Raise a JobError if the command fails
+
+    Returns
+    -------
+    RunResult
+        The status of the command and the fleets it ran on
+
+    Raises
+    ------
+    ConfigurationError
+        If the config is missing options or the AWS credentials are invalid
+    JobError
+        If the command could not be run, or failed and check is set
+    """
+    _prepare('run', config)
+    start = time.monotonic()
+    status = _call('run', run_job.run, config)
+    return _finish('run', status, config, start, check)
+
+
+def engine(config: Configuration, check=True):
+    """create the fleets of a job, copy the user content to them, and run run_cmd
+
+    Parameters
+    ----------
+    config : Configuration
+        Forge configuration data
+    check : bool, default=True
+        Raise a JobError if the job fails
+
+    Returns
+    -------
+    RunResult
+        The status of the job and its fleets
+
+    Raises
+    ------
+    ConfigurationError
+        If the config is missing options or the AWS credentials are invalid
+    JobError
+        If the job could not be run, or failed and check is set
+    """
+    _prepare('engine', config)
+    start = time.monotonic()
+    status = _call('engine', engine_job.engine, config)
+    return _finish('engine', status, config, start, check)
+
+
+def destroy(config: Configuration):
+    """destroy the fleets of a job
+
+    Parameters
+    ----------
+    config : Configuration
+        Forge configuration data
+
+    Returns
+    -------
+    DestroyResult
+        The destroyed fleets and the cost of their running instances
+
+    Raises
+    ------
+    ConfigurationError
+        If the config is missing options or the AWS credentials are invalid
+    JobError
+        If some fleets could not be destroyed
+    """
+    _prepare('destroy', config)
+    return _destroy(config)
@@ -0,0 +1,215 @@
+"""Run many engine jobs from one file, at the same time, in one process."""
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import yaml
+
+from . import DEFAULT_ARG_VALS
+from . import engine  # noqa: F401  Sets the REQUIRED_ARGS of engine jobs
+from .common import SharedClientSession
+from .configuration import Configuration, YamlLoader
+from .main import execute
+from .parser import positive_int_arg
+
+logger = logging.getLogger(__name__)
+
+# Clients created once up front and shared by the job threads, as creating clients is not thread-safe
+WARM_CLIENTS = ('ec2', 'pricing', 'secretsmanager')
+
+
+def cli_batch(subparsers):
+    """adds batch parser to subparser
+
+    Parameters
+    ----------
+    subparsers : argparse.ArgumentParser
+        Argument parser for Forge.main
+    """
+    parser = subparsers.add_parser('batch', description='Run the engine for each job in a jobs file')
+
+    parser.add_argument('jobs_file', help='YAML file with a list of jobs.')
+    parser.add_argument('--concurrency', type=positive_int_arg, dest='batch_concurrency',
+                        help='Maximum number of jobs run at the same time. Default is 4.')
+    parser.add_argument('--summary', dest='batch_summary', help='Write the status of each job to this JSON file.')
+    parser.add_argument('--forge_env', '--forge-env', help='Environment of the jobs that do not set one.')
+    parser.add_argument('--config_dir', '--config-dir', help='Config directory of the jobs that do not set one.')
+    parser.add_argument(
+        '--log_level', '--log-level', choices={'DEBUG', 'INFO', 'WARNING', 'ERROR'},
+        default='INFO', type=str.upper, help='Override logging level.'
+    )
+
+
+def load_jobs(path, defaults=None):
+    """read the job specs of a jobs file
+
+    The file is either a list of jobs, or a mapping with a ``jobs`` list and optional ``defaults`` and
+    ``concurrency``. Each job has the same options as a user yaml, and can point to one with ``yaml``, relative to
+    the jobs file.
+
+    Parameters
+    ----------
+    path : str
+        Path of the jobs file
+    defaults : dict, optional
+        Options of every job, overridden by the file defaults and the job itself
+
+    Returns
+    -------
+    jobs : list
+        The CLI config of each job
+    concurrency : int or None
+        The concurrency set in the file
+    """
+    with open(path, 'r') as f:
+        spec = yaml.load(f, Loader=YamlLoader) or {}
+
+    if isinstance(spec, list):
+        spec = {'jobs': spec}
+    if not isinstance(spec.get('jobs'), list):
+        raise ValueError(f'{path} must contain a list of jobs')
+
+    base_dir = os.path.dirname(os.path.realpath(path))
+    defaults = {**(defaults or {}), **spec.get('defaults', {})}
+
+    jobs = []
+    for i, job in enumerate(spec['jobs']):
+        if not isinstance(job, dict):
+            raise ValueError(f'Job {i + 1} in {path} must be a mapping of options')
+        job = {**defaults, **job, 'job': 'engine'}
+        if job.get('yaml'):
+            job['yaml'] = os.path.realpath(os.path.join(base_dir, job['yaml']))
+        jobs.append(job)
+
+    return jobs, spec.get('concurrency')
+
+
+def run_job(config: Configuration):
+    """run the engine for one job of a batch
+
+    Parameters
+    ----------
+    config : Configuration
+        Forge configuration data of the job
+
+    Returns
+    -------
+    dict
+        The name, status and run time of the job, and the error if it failed
+    """
+    start = time.monotonic()
+    result = {'name': config.name, 'status': 1, 'error': None}
+    logger.info('Starting job %s', config.name)
+    try:
+        result['status'] = execute(config) or 0
+    except SystemExit as e:
+        result['status'] = e.code if isinstance(e.code, int) else 1
+    except Exception as e:  # pylint: disable=broad-except
+        logger.exception('Job %s failed', config.name)
+        result['error'] = f'{type(e).__name__}: {e}'
+
+    result['seconds'] = round(time.monotonic() - start, 1)
+    logger.log(logging.INFO if result['status'] == 0 else logging.ERROR, 'Job %s %s after %.0fs', config.name,
+               'succeeded' if result['status'] == 0 else f'failed with status {result["status"]}', result['seconds'])
+    return result
+
+
+def format_summary(results):
+    """format the results of a batch as a table
+
+    Parameters
+    ----------
+    results : list
+        Results from run_job
+
+    Returns
+    -------
+    str
+        The summary table
+    """
+    lines = [('job', 'status', 'seconds')]
+    lines += [(str(r['name']), 'ok' if r['status'] == 0 else f"failed ({r['status']})", f"{r['seconds']:.0f}")
+              for r in results]
+    widths = [max(len(line[i]) for line in lines) for i in range(3)]
+    return '\n'.join('  '.join(v.ljust(w) if i == 0 else v.rjust(w) for i, (v, w) in enumerate(zip(line, widths)))
+                     for line in lines)
+
+
+def batch(args):
+    """run the engine for each job of a jobs file, up to batch_concurrency at a time
+
+    All configs are loaded and checked before any job starts. The jobs share the boto3 session and its clients, the
+    AWS credentials check, and the pricing and config caches, so they must use the same AWS profile and region.
+    Their run output is never sent to the terminal directly, each line is prefixed with the instance IP instead.
+
+    Parameters
+    ----------
+    args : dict
+        Parsed batch arguments
+
+    Returns
+    -------
+    int
+        0 if all jobs succeeded
+    """
+    defaults = {k: args[k] for k in ('forge_env', 'config_dir', 'log_level') if args.get(k)}
+    try:
+        jobs, file_concurrency = load_jobs(args['jobs_file'], defaults)
+    except (OSError, ValueError, yaml.YAMLError) as e:
+        logger.error('Could not read jobs file: %s', e)
+        return 1
+
+    if not jobs:
+        logger.info('No jobs to run.')
+        return 0
+
+    configs = []
+    for job in jobs:
+        config = Configuration.load_config(job)
+        config.log_level = config.log_level or DEFAULT_ARG_VALS['log_level']
+        if not config.validate_job_args():
+            logger.error('Job %s is invalid, no jobs were started.', job.get('name') or job.get('yaml'))
+            return 1
+        # Jobs running at the same time cannot share the terminal
+        config.run_prefix_output = True
+        configs.append(config)
+
+    sessions = {(c.aws_profile, c.region) for c in configs}
+    if len(sessions) > 1:
+        logger.error('All jobs of a batch must use the same AWS profile and region, found %s',
+                     ', '.join(f'{p or "default"}/{r}' for p, r in sorted(sessions, key=str)))
+        return 1
+
+    names = [c.name for c in configs]
+    if duplicates := sorted({n for n in names if names.count(n) > 1}):
+        logger.error('Job names must be unique, found %s more than once', ', '.join(duplicates))
+        return 1
+
+    if not configs[0].validate_aws_permissions():
+        return 1
+
+    profile, region = sessions.pop()
+    session = SharedClientSession(profile_name=profile, region_name=region)
+    for service in WARM_CLIENTS:
+        session.client(service)
+    for config in configs:
+        config.aws_session = session
+
+    concurrency = args.get('batch_concurrency') or file_concurrency or DEFAULT_ARG_VALS['batch_concurrency']
+    logger.info('Running %d job(s), %d at a time.', len(configs), concurrency)
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(configs))) as executor:
+        results = list(executor.map(run_job, configs))
+
+    failed = [r for r in results if r['status'] != 0]
+    sys.stdout.write(format_summary(results) + '\n')
+    logger.info('%d of %d job(s) succeeded.', len(results) - len(failed), len(results))
+
+    if path := args.get('batch_summary'):
+        with open(path, 'w') as f:
+            json.dump({'jobs': results, 'succeeded': len(results) - len(failed), 'failed': len(failed)}, f, indent=2)
+        logger.info('Summary written to %s', path)
+
+    return 1 if failed else 0
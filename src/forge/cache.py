@@ -0,0 +1,305 @@
+"""Caches of compiled Forge configurations and AWS identity checks, so repeat invocations skip that work."""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+
+from . import __version__
+
+logger = logging.getLogger(__name__)
+
+CONFIG_CACHE_DIR = 'config-cache'
+CONFIG_CACHE_MAX_ENTRIES = 256
+# Set to 0 to always parse the YAML files
+CONFIG_CACHE_ENV = 'FORGE_CONFIG_CACHE'
+
+IDENTITY_CACHE_FILE = 'identity-cache.json'
+IDENTITY_CACHE_TTL = 900
+# Seconds a successful identity check is trusted for, set to 0 to always check
+IDENTITY_CACHE_TTL_ENV = 'FORGE_IDENTITY_CACHE_TTL'
+
+
+class LogRecorder(logging.Handler):
+    """records the messages logged while a config is compiled, to log them again when it is read from the cache"""
+
+    def __init__(self):
+        super().__init__(logging.DEBUG)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append([record.levelno, record.getMessage()])
+
+
+def config_cache_enabled():
+    """check if the config cache is enabled
+
+    Returns
+    -------
+    bool
+        False if FORGE_CONFIG_CACHE is set to 0, false, or no
+    """
+    return os.environ.get(CONFIG_CACHE_ENV, '1').lower() not in {'0', 'false', 'no'}
+
+
+def _sha256(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def file_fingerprint(path):
+    """get the path, modification time, size and content hash of a config file
+
+    Parameters
+    ----------
+    path : str
+        Path of the file
+
+    Returns
+    -------
+    dict or None
+        The file fingerprint, or None if the file does not exist
+    """
+    try:
+        stat = os.stat(path)
+        return {'path': os.path.realpath(path), 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size,
+                'sha256': _sha256(path)}
+    except OSError:
+        return None
+
+
+def _unchanged(fingerprint):
+    try:
+        stat = os.stat(fingerprint['path'])
+    except OSError:
+        return False
+    if stat.st_mtime_ns == fingerprint['mtime_ns'] and stat.st_size == fingerprint['size']:
+        return True
+    # Touched or rewritten, only the content matters
+    try:
+        return _sha256(fingerprint['path']) == fingerprint['sha256']
+    except OSError:
+        return False
+
+
+def config_cache_key(cli_config, user):
+    """get the cache key of a config from its CLI arguments
+
+    Parameters
+    ----------
+    cli_config : dict
+        The CLI arguments, without the unset ones
+    user : str
+        The local user name
+
+    Returns
+    -------
+    str
+        The cache key
+    """
+    key = json.dumps([__version__, os.getcwd(), user, cli_config], sort_keys=True, default=repr)
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def get_state_dir(*parts):
+    """gets a folder inside Forge's local state directory, creating it if needed
+
+    The state directory is `$FORGE_STATE_DIR` if set, otherwise `$XDG_STATE_HOME/forge` or `~/.local/state/forge`.
+
+    Parameters
+    ----------
+    parts : str
+        Sub-folders of the state directory
+
+    Returns
+    -------
+    str
+        Full path to the folder
+    """
+    base = os.environ.get('FORGE_STATE_DIR')
+    if not base:
+        xdg_state = os.environ.get('XDG_STATE_HOME') or os.path.join(os.path.expanduser('~'), '.local', 'state')
+        base = os.path.join(xdg_state, 'forge')
+
+    path = os.path.join(base, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def read_config_cache(key):
+    """read a compiled config from the cache if none of its input files changed
+
+    Parameters
+    ----------
+    key : str
+        The cache key from config_cache_key
+
+    Returns
+    -------
+    dict or None
+        The cache entry, or None if there is no valid entry
+    """
+    path = os.path.join(get_state_dir(CONFIG_CACHE_DIR), f'{key}.json')
+    try:
+        with open(path) as f:
+            entry = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.debug('Ignoring unreadable config cache entry %s: %s', path, e)
+        return None
+
+    if not all(_unchanged(fingerprint) for fingerprint in entry.get('inputs', [])):
+        logger.debug('Config files changed since %s was cached', key)
+        return None
+
+    logger.debug('Using cached config %s', key)
+    return entry
+
+
+def write_config_cache(key, entry):
+    """write a compiled config to the cache
+
+    Errors are logged and ignored, the cache is only an optimization. Entries that JSON cannot store as they are,
+    e.g. with tuples, are not cached.
+
+    Parameters
+    ----------
+    key : str
+        The cache key from config_cache_key
+    entry : dict
+        The compiled config, with the fingerprints of its input files
+    """
+    try:
+        text = json.dumps(entry)
+        if json.loads(text) != entry:
+            logger.debug('Not caching config %s, it does not round-trip through JSON', key)
+            return
+
+        cache_dir = get_state_dir(CONFIG_CACHE_DIR)
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        os.replace(tmp, os.path.join(cache_dir, f'{key}.json'))
+        _prune(cache_dir)
+    except (OSError, TypeError, ValueError) as e:
+        logger.debug('Could not cache config %s: %s', key, e)
+
+
+def _prune(cache_dir):
+    # Entries of older versions were pickled
+    for name in os.listdir(cache_dir):
+        if name.endswith('.pickle'):
+            try:
+                os.remove(os.path.join(cache_dir, name))
+            except OSError:
+                pass
+
+    entries = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir) if name.endswith('.json')]
+    if len(entries) <= CONFIG_CACHE_MAX_ENTRIES:
+        return
+    entries.sort(key=os.path.getmtime)
+    for path in entries[:len(entries) - CONFIG_CACHE_MAX_ENTRIES]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def credential_fingerprint(profile, credentials):
+    """get a fingerprint of AWS credentials that does not reveal them
+
+    Parameters
+    ----------
+    profile : str or None
+        The AWS profile the credentials are from
+    credentials : botocore.credentials.Credentials
+        The credentials of the session
+
+    Returns
+    -------
+    str
+        A hash of the profile and credentials
+    """
+    frozen = credentials.get_frozen_credentials()
+    key = json.dumps([profile, frozen.access_key, frozen.secret_key, frozen.token])
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def _identity_ttl():
+    try:
+        return int(os.environ.get(IDENTITY_CACHE_TTL_ENV, IDENTITY_CACHE_TTL))
+    except ValueError:
+        return IDENTITY_CACHE_TTL
+
+
+def _read_identities(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def cached_identity(fingerprint, now=None):
+    """get the identity of credentials checked less than the TTL ago
+
+    Parameters
+    ----------
+    fingerprint : str
+        The credential fingerprint from credential_fingerprint
+    now : float, optional
+        The current time in seconds since the epoch
+
+    Returns
+    -------
+    dict or None
+        The cached account and ARN, or None if the credentials must be checked
+    """
+    ttl = _identity_ttl()
+    if ttl <= 0:
+        return None
+
+    now = now or time.time()
+    identity = _read_identities(os.path.join(get_state_dir(), IDENTITY_CACHE_FILE)).get(fingerprint)
+    if identity and 0 <= now - identity.get('checked_at', 0) < ttl:
+        logger.debug('Using the identity checked %ds ago', now - identity['checked_at'])
+        return identity
+    return None
+
+
+def cache_identity(fingerprint, identity, now=None):
+    """remember a successful identity check
+
+    Errors are logged and ignored, the cache is only an optimization.
+
+    Parameters
+    ----------
+    fingerprint : str
+        The credential fingerprint from credential_fingerprint
+    identity : dict
+        The response of sts.get_caller_identity
+    now : float, optional
+        The current time in seconds since the epoch
+    """
+    ttl = _identity_ttl()
+    if ttl <= 0:
+        return
+
+    now = now or time.time()
+    try:
+        cache_dir = get_state_dir()
+        os.makedirs(cache_dir, exist_ok=True)
+        path = os.path.join(cache_dir, IDENTITY_CACHE_FILE)
+
+        identities = {k: v for k, v in _read_identities(path).items() if now - v.get('checked_at', 0) < ttl}
+        identities[fingerprint] = {'account': identity.get('Account'), 'arn': identity.get('Arn'), 'checked_at': now}
+
+        fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(identities, f)
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.debug('Could not cache the identity check: %s', e)
@@ -1,15 +1,38 @@
 """cleanup expired instances"""
 import logging
-from datetime import datetime, timezone
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 
 import boto3
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
 
-from . import REQUIRED_ARGS
+from . import DEFAULT_ARG_VALS, REQUIRED_ARGS
 from .configuration import Configuration
-from .parser import add_basic_args, add_general_args, add_env_args, add_job_args, add_action_args
+from .destroy import FLEET_DELETE_BATCH_SIZE
+from .parser import (add_basic_args, add_general_args, add_env_args, add_job_args, add_action_args, nonnegative_int_arg,
+                     positive_int_arg)
 
 logger = logging.getLogger(__name__)
 
+REQUIRED_ARGS['cleanup'] = {'forge_env'}
+
+VALID_UNTIL_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+FIRST_YEAR = 2000
+FLEET_STATES = ['submitted', 'active', 'modifying', 'deleted_running']
+INSTANCE_STATES = ['pending', 'running', 'stopping', 'stopped']
+TEMPLATE_BATCH_SIZE = 200
+TERMINATE_BATCH_SIZE = 100
+# Spread daemon passes by up to this fraction of the interval so replicas do not scan at the same time
+DAEMON_JITTER = 0.1
+# Rebuild the daemon template index from scratch this often, to forget templates deleted by others
+FULL_SCAN_INTERVAL = timedelta(hours=6)
+
+# Back off and retry when the EC2 API throttles the deletes
+CLIENT_CONFIG = Config(retries={'mode': 'adaptive', 'max_attempts': 10})
+
 
 def cli_cleanup(subparsers):
     """adds cleanup parser to subparser
@@ -26,11 +49,402 @@ def cli_cleanup(subparsers):
     add_action_args(parser, suppress=True)
     add_env_args(parser)
 
-    REQUIRED_ARGS['cleanup'] = {'forge_env'}
+    parser.add_argument('--dry_run', '--dry-run', action='store_true', default=None,
+                        help='Report what would be deleted without deleting anything.')
+    parser.add_argument('--cleanup_concurrency', '--cleanup-concurrency', type=positive_int_arg,
+                        help='Maximum number of deletes sent at the same time. Default is 8.')
+    parser.add_argument('--cleanup_grace', '--cleanup-grace', type=nonnegative_int_arg,
+                        help='Minutes a fleet or instance must have existed before it can be swept. Default is 60.')
+    parser.add_argument('--daemon', action='store_true', dest='cleanup_daemon', default=None,
+                        help='Keep running and clean up every interval seconds.')
+    parser.add_argument('--interval', type=positive_int_arg, dest='cleanup_interval',
+                        help='Seconds between cleanups with --daemon. Default is 300.')
+
+
+def expired_patterns(now):
+    """builds valid_until tag filter values that match every time before now
+
+    The values use wildcards per year, month, day and hour, so AWS only returns templates that expired, plus the ones
+    that expire later in the current hour, which are checked locally.
+
+    Parameters
+    ----------
+    now : datetime
+        The current time in UTC
+
+    Returns
+    -------
+    list
+        Filter values for the valid_until tag
+    """
+    patterns = [f'{year}-*' for year in range(FIRST_YEAR, now.year)]
+    patterns += [f'{now:%Y}-{month:02d}-*' for month in range(1, now.month)]
+    patterns += [f'{now:%Y-%m}-{day:02d}T*' for day in range(1, now.day)]
+    patterns += [f'{now:%Y-%m-%d}T{hour:02d}:*' for hour in range(now.hour)]
+    patterns.append(f'{now:%Y-%m-%dT%H}:*')
+    return patterns
+
+
+def find_expired_templates(client, now):
+    """finds the launch templates with a valid_until tag before now
+
+    Parameters
+    ----------
+    client : Boto3.client
+        The client used to get the templates
+    now : datetime
+        The current time in UTC
+
+    Returns
+    -------
+    list
+        A list of tuples of (name, id, valid_until) of the expired templates
+    """
+    filters = [{'Name': 'tag:valid_until', 'Values': expired_patterns(now)}]
+    templates = []
+
+    for page in client.get_paginator('describe_launch_templates').paginate(Filters=filters):
+        templates += [(template['LaunchTemplateName'], template['LaunchTemplateId'], tag['Value'])
+                      for template in page['LaunchTemplates'] if 'Tags' in template
+                      for tag in template['Tags'] if tag['Key'] == 'valid_until']
+
+    return _expired(templates, now)
+
+
+def _expired(templates, now):
+    expired = []
+    for name, tid, valid_until in templates:
+        try:
+            valid_until_time = datetime.strptime(valid_until, VALID_UNTIL_FORMAT).replace(tzinfo=timezone.utc)
+        except ValueError:
+            logger.warning('Template %s (%s) has an invalid valid_until tag: %s', name, tid, valid_until)
+            continue
+        if now > valid_until_time:
+            expired.append((name, tid, valid_until))
+
+    return expired
+
+
+def created_patterns(since, now):
+    """builds create-time filter values that match every hour from since to now
+
+    Parameters
+    ----------
+    since : datetime
+        Start of the period in UTC
+    now : datetime
+        End of the period in UTC
+
+    Returns
+    -------
+    list
+        Filter values for the create-time of launch templates
+    """
+    hour = since.replace(minute=0, second=0, microsecond=0)
+    patterns = []
+    while hour <= now:
+        patterns.append(f'{hour:%Y-%m-%dT%H}:*')
+        hour += timedelta(hours=1)
+    return patterns
+
+
+class TemplateIndex:
+    """launch templates with a valid_until tag, kept between the passes of the cleanup daemon
+
+    The first scan lists every template, and later scans only the ones created since the previous scan. The index is
+    rebuilt every FULL_SCAN_INTERVAL to drop templates that were deleted by something else.
+    """
+
+    def __init__(self):
+        self.templates = {}
+        self.scanned_at = None
+        self.full_scan_at = None
+
+    def refresh(self, client, now):
+        """adds the templates created since the last scan, or rescans all templates when due
+
+        Parameters
+        ----------
+        client : Boto3.client
+            The client used to get the templates
+        now : datetime
+            The current time in UTC
+        """
+        filters = [{'Name': 'tag-key', 'Values': ['valid_until']}]
+        full = self.full_scan_at is None or now - self.full_scan_at >= FULL_SCAN_INTERVAL
+        if full:
+            self.templates = {}
+            self.full_scan_at = now
+        else:
+            filters.append({'Name': 'create-time', 'Values': created_patterns(self.scanned_at, now)})
+
+        found = 0
+        for page in client.get_paginator('describe_launch_templates').paginate(Filters=filters):
+            for template in page['LaunchTemplates']:
+                for tag in template.get('Tags', []):
+                    if tag['Key'] == 'valid_until':
+                        self.templates[template['LaunchTemplateId']] = (template['LaunchTemplateName'], tag['Value'])
+                        found += 1
+
+        self.scanned_at = now
+        logger.debug('%s scan found %d template(s), %d indexed', 'Full' if full else 'Incremental', found,
+                     len(self.templates))
+
+    def expired(self, now):
+        """gets the indexed templates with a valid_until tag before now
+
+        Parameters
+        ----------
+        now : datetime
+            The current time in UTC
+
+        Returns
+        -------
+        list
+            A list of tuples of (name, id, valid_until) of the expired templates
+        """
+        return _expired([(name, tid, valid_until) for tid, (name, valid_until) in self.templates.items()], now)
+
+    def expiry(self):
+        """gets the valid_until time of each indexed template by name
+
+        Returns
+        -------
+        dict
+            The valid_until time of each template, or None if its tag is invalid
+        """
+        expiry = {}
+        for name, valid_until in self.templates.values():
+            try:
+                expiry[name] = datetime.strptime(valid_until, VALID_UNTIL_FORMAT).replace(tzinfo=timezone.utc)
+            except ValueError:
+                expiry[name] = None
+        return expiry
+
+    def discard(self, tid):
+        """forgets a deleted template
+
+        Parameters
+        ----------
+        tid : str
+            Template ID
+        """
+        self.templates.pop(tid, None)
+
+
+def delete_template(client, name, tid):
+    """deletes one launch template
+
+    Parameters
+    ----------
+    client : Boto3.client
+        The client used to delete the template
+    name : str
+        Template name
+    tid : str
+        Template ID
+
+    Returns
+    -------
+    bool
+        True if the template was deleted
+    """
+    try:
+        response = client.delete_launch_template(LaunchTemplateId=tid)
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') == 'InvalidLaunchTemplateId.NotFound':
+            logger.debug('Template %s (%s) was already deleted', name, tid)
+            return True
+        logger.error('Could not delete template %s (%s): %s', name, tid, e)
+        return False
+
+    logger.debug('Response is: %s', response)
+    logger.info('Destroyed template %s (%s)', name, tid)
+    return True
+
+
+def _tags(resource):
+    return {tag['Key']: tag['Value'] for tag in resource.get('Tags', [])}
+
+
+def find_forge_fleets(client):
+    """finds the fleets created by Forge that are not fully deleted
+
+    Parameters
+    ----------
+    client : Boto3.client
+        The client used to get the fleets
+
+    Returns
+    -------
+    list
+        A dictionary per fleet with its id, forge-name, state, create time and launch template names
+    """
+    fleets = []
+    filters = [{'Name': 'fleet-state', 'Values': FLEET_STATES}]
+    for page in client.get_paginator('describe_fleets').paginate(Filters=filters):
+        for fleet in page.get('Fleets', []):
+            name = _tags(fleet).get('forge-name')
+            if not name:
+                continue
+            fleets.append({
+                'id': fleet['FleetId'],
+                'name': name,
+                'state': fleet.get('FleetState'),
+                'create_time': fleet.get('CreateTime'),
+                'templates': [c['LaunchTemplateSpecification'].get('LaunchTemplateName')
+                              for c in fleet.get('LaunchTemplateConfigs', [])
+                              if c.get('LaunchTemplateSpecification', {}).get('LaunchTemplateName')],
+            })
+    return fleets
+
+
+def get_template_expiry(client, names):
+    """gets the valid_until time of existing launch templates
+
+    Parameters
+    ----------
+    client : Boto3.client
+        The client used to get the templates
+    names : list
+        Template names to look up
+
+    Returns
+    -------
+    dict
+        The valid_until time of each template that exists, or None if it has no valid tag
+    """
+    names = sorted(set(names))
+    expiry = {}
+    for i in range(0, len(names), TEMPLATE_BATCH_SIZE):
+        filters = [{'Name': 'launch-template-name', 'Values': names[i:i + TEMPLATE_BATCH_SIZE]}]
+        for page in client.get_paginator('describe_launch_templates').paginate(Filters=filters):
+            for template in page['LaunchTemplates']:
+                valid_until = _tags(template).get('valid_until')
+                try:
+                    valid_until = datetime.strptime(valid_until, VALID_UNTIL_FORMAT).replace(tzinfo=timezone.utc)
+                except (TypeError, ValueError):
+                    valid_until = None
+                expiry[template['LaunchTemplateName']] = valid_until
+    return expiry
+
+
+def find_orphans(client, now, grace, expiry=None):
+    """finds Forge fleets and instances that were left behind
+
+    A fleet is orphaned when one of its launch templates is missing or expired. An instance is orphaned when its
+    fleet is not live, e.g. it is deleted or orphaned itself. Instances that were not launched by a fleet, such as
+    instances tagged with forge-name by hand, are never orphans. Fleets and instances younger than grace are skipped.
+
+    Parameters
+    ----------
+    client : Boto3.client
+        The client used to get the fleets and instances
+    now : datetime
+        The current time in UTC
+    grace : timedelta
+        Minimum age of a fleet or instance to be swept
+    expiry : dict, optional
+        Known valid_until times of templates by name, the other templates are looked up
+
+    Returns
+    -------
+    fleets : list
+        The orphaned fleets to delete
+    instances : list
+        A list of tuples of (id, forge-name) of the orphaned instances to terminate
+    """
+    fleets = find_forge_fleets(client)
+    names = [t for fleet in fleets for t in fleet['templates']]
+    known = expiry or {}
+    expiry = {**known, **get_template_expiry(client, [t for t in names if t not in known])}
+    cutoff = now - grace
+
+    orphan_fleets = []
+    live_ids = set()
+    for fleet in fleets:
+        if fleet['state'] == 'deleted_running':
+            continue
+        if fleet['create_time'] and fleet['create_time'] > cutoff:
+            live_ids.add(fleet['id'])
+            continue
+
+        missing = [t for t in fleet['templates'] if t not in expiry]
+        expired = [t for t in fleet['templates'] if expiry.get(t) and expiry[t] < now]
+        if missing or expired or not fleet['templates']:
+            orphan_fleets.append(fleet)
+        else:
+            live_ids.add(fleet['id'])
+
+    deleting_ids = {fleet['id'] for fleet in orphan_fleets}
+    orphan_instances = []
+    filters = [{'Name': 'tag-key', 'Values': ['forge-name']},
+               {'Name': 'instance-state-name', 'Values': INSTANCE_STATES}]
+    for page in client.get_paginator('describe_instances').paginate(Filters=filters):
+        for reservation in page.get('Reservations', []):
+            for instance in reservation.get('Instances', []):
+                tags = _tags(instance)
+                fleet_id = tags.get('aws:ec2:fleet-id')
+                if not fleet_id or fleet_id in live_ids or fleet_id in deleting_ids:
+                    continue
+                if instance.get('LaunchTime') and instance['LaunchTime'] > cutoff:
+                    continue
+                orphan_instances.append((instance['InstanceId'], tags.get('forge-name')))
+
+    return orphan_fleets, orphan_instances
+
+
+def sweep_orphans(client, fleets, instances):
+    """deletes orphaned fleets and terminates orphaned instances in batches
+
+    Parameters
+    ----------
+    client : Boto3.client
+        The client used to delete the fleets and instances
+    fleets : list
+        The orphaned fleets from find_orphans
+    instances : list
+        The orphaned instances from find_orphans
+
+    Returns
+    -------
+    int
+        The number of fleets and instances that could not be removed
+    """
+    failed = 0
+
+    fleet_ids = [fleet['id'] for fleet in fleets]
+    for i in range(0, len(fleet_ids), FLEET_DELETE_BATCH_SIZE):
+        try:
+            response = client.delete_fleets(FleetIds=fleet_ids[i:i + FLEET_DELETE_BATCH_SIZE], TerminateInstances=True)
+        except ClientError as e:
+            logger.error('Could not delete fleets: %s', e)
+            failed += len(fleet_ids[i:i + FLEET_DELETE_BATCH_SIZE])
+            continue
+        for deleted in response.get('SuccessfulFleetDeletions', []):
+            logger.info('Deleted orphaned fleet %s', deleted['FleetId'])
+        for unsuccessful in response.get('UnsuccessfulFleetDeletions', []):
+            logger.error('Could not delete fleet %s: %s', unsuccessful.get('FleetId'),
+                         unsuccessful.get('Error', {}).get('Message', ''))
+            failed += 1
+
+    instance_ids = [ec2_id for ec2_id, _ in instances]
+    for i in range(0, len(instance_ids), TERMINATE_BATCH_SIZE):
+        batch = instance_ids[i:i + TERMINATE_BATCH_SIZE]
+        try:
+            client.terminate_instances(InstanceIds=batch)
+            logger.info('Terminated orphaned instances %s', ', '.join(batch))
+        except ClientError as e:
+            logger.error('Could not terminate instances %s: %s', ', '.join(batch), e)
+            failed += len(batch)
+
+    return failed
 
 
 def cleanup(config: Configuration):
-    """removes all AWS LaunchTemplates that have an expired valid_time tag
+    """removes all AWS LaunchTemplates that have an expired valid_time tag, and orphaned fleets and instances
+
+    With cleanup_daemon, keeps cleaning up every cleanup_interval seconds until interrupted.
 
     Parameters
     ----------
@@ -42,31 +456,109 @@ def cleanup(config: Configuration):
     int
         returns 0 for success
     """
-    client = boto3.client('ec2')
+    client = (config.aws_session or boto3).client('ec2', config=CLIENT_CONFIG)
 
-    describe_args = {'Filters': [{'Name': 'tag-key', 'Values': ['valid_until']}]}
-    templates = []
+    if config.cleanup_daemon:
+        return cleanup_daemon(client, config)
+    return cleanup_pass(client, config)
 
-    while True:
-        response = client.describe_launch_templates(**describe_args)
 
-        templates += [(template['LaunchTemplateName'], template['LaunchTemplateId'], tag['Value'])
-                      for template in response['LaunchTemplates'] if 'Tags' in template
-                      for tag in template['Tags'] if tag['Key'] == 'valid_until']
+def cleanup_daemon(client, config: Configuration):
+    """runs cleanup passes every cleanup_interval seconds, with jitter, until interrupted
 
-        if 'NextToken' not in response:
-            break
+    The EC2 client and the template index are kept between passes, so each pass only lists the templates created
+    since the previous one.
 
-        describe_args['NextToken'] = response['NextToken']
+    Parameters
+    ----------
+    client : Boto3.client
+        The client used for every pass
+    config : Configuration
+        Forge configuration data
 
-    logger.debug('Templates are %s', templates)
+    Returns
+    -------
+    int
+        returns 0 when interrupted
+    """
+    interval = config.cleanup_interval or DEFAULT_ARG_VALS['cleanup_interval']
+    index = TemplateIndex()
+    logger.info('Cleaning up every %d seconds.', interval)
+
+    try:
+        time.sleep(random.uniform(0, interval * DAEMON_JITTER))
+        while True:
+            try:
+                cleanup_pass(client, config, index)
+            except (BotoCoreError, ClientError) as e:
+                logger.error('Cleanup failed, retrying next interval: %s', e)
+            delay = interval * random.uniform(1 - DAEMON_JITTER, 1 + DAEMON_JITTER)
+            logger.debug('Next cleanup in %.0f seconds', delay)
+            time.sleep(delay)
+    except KeyboardInterrupt:
+        logger.info('Cleanup daemon stopped.')
+    return 0
 
+
+def cleanup_pass(client, config: Configuration, index=None):
+    """removes expired templates and orphaned fleets and instances once
+
+    Parameters
+    ----------
+    client : Boto3.client
+        The client used to find and remove the resources
+    config : Configuration
+        Forge configuration data
+    index : TemplateIndex, optional
+        Templates known from previous passes, which is refreshed instead of filtering all templates again
+
+    Returns
+    -------
+    int
+        returns 0 for success
+    """
     now = datetime.now(timezone.utc)
-    for name, tid, valid_until in templates:
-        valid_until = datetime.strptime(valid_until, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
-        if now > valid_until:
-            response = client.delete_launch_template(LaunchTemplateId=tid)
-            logger.debug('Response is: %s', response)
-            logger.info('Destroyed template %s (%s)', name, tid)
 
-    return 0
+    grace = config.cleanup_grace if config.cleanup_grace is not None else DEFAULT_ARG_VALS['cleanup_grace']
+
+    if index is None:
+        templates = find_expired_templates(client, now)
+        expiry = None
+    else:
+        index.refresh(client, now)
+        templates = index.expired(now)
+        expiry = index.expiry()
+    logger.debug('Templates are %s', templates)
+    fleets, instances = find_orphans(client, now, timedelta(minutes=grace), expiry)
+    logger.debug('Orphaned fleets are %s, orphaned instances are %s', fleets, instances)
+
+    if config.dry_run:
+        for name, tid, valid_until in templates:
+            logger.info('Would destroy template %s (%s), valid until %s', name, tid, valid_until)
+        for fleet in fleets:
+            logger.info('Would delete orphaned fleet %s (%s) in state %s', fleet['name'], fleet['id'], fleet['state'])
+        for ec2_id, name in instances:
+            logger.info('Would terminate orphaned instance %s (%s)', ec2_id, name)
+        logger.info('Dry run: %d expired template(s), %d orphaned fleet(s) and %d orphaned instance(s) would be removed.',
+                    len(templates), len(fleets), len(instances))
+        return 0
+
+    failed = sweep_orphans(client, fleets, instances) if fleets or instances else 0
+
+    if not templates:
+        logger.info('No expired templates found.')
+        return 1 if failed else 0
+
+    concurrency = config.cleanup_concurrency or DEFAULT_ARG_VALS['cleanup_concurrency']
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(templates))) as executor:
+        results = list(executor.map(lambda t: delete_template(client, t[0], t[1]), templates))
+
+    if index is not None:
+        for (_, tid, _), deleted in zip(templates, results):
+            if deleted:
+                index.discard(tid)
+
+    failed += results.count(False)
+    logger.info('Destroyed %d of %d expired template(s).', len(templates) - results.count(False), len(templates))
+
+    return 1 if failed else 0
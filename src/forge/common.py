@@ -1,26 +1,40 @@
 """Common functions to most of forge's workings."""
 import base64
 import contextlib
+import functools
 import json
 import logging
 import string
 import tempfile
 import sys
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from numbers import Number
 
 import boto3
-from botocore.exceptions import ClientError, NoCredentialsError
+from botocore.exceptions import ClientError, NoCredentialsError, WaiterError
 
-from . import DEFAULT_ARG_VALS, ADDITIONAL_KEYS
+from . import DEFAULT_ARG_VALS
+from .cache import get_state_dir  # noqa: F401  Part of the common API
 from .configuration import Configuration
 from .exceptions import ExitHandlerException
 
 logger = logging.getLogger(__name__)
 
+STATE_BATCH_SIZE = 1000
+STATE_POLL_DELAY = 15
+STATE_WAITERS = {'stopped': 'instance_stopped', 'running': 'instance_running'}
 
-def check_fleet_id(n, config: Configuration):
+# boto3 sessions created ahead of time by forge serve, by profile and region
+WARM_SESSIONS = {}
+# Decoded PEM keys, by secret ID, region and profile
+PEM_KEYS = {}
+
+
+def check_fleet_id(n, config: Configuration, client=None):
     """get the AWS fleet id for n
 
     Parameters
@@ -29,13 +43,15 @@ def check_fleet_id(n, config: Configuration):
         Fleet name to get ID of
     config : Configuration
         Forge configuration data
+    client : Boto3.client, optional
+        The EC2 client to use. Pass one when calling from several threads, as creating clients is not thread-safe.
 
     Returns
     -------
     list
         A list of fleet IDs for n
     """
-    client = boto3.client('ec2')
+    client = client or (config.aws_session or boto3).client('ec2')
     response = client.describe_tags(
         Filters=[
             {'Name': 'resource-type',
@@ -57,7 +73,132 @@ def check_fleet_id(n, config: Configuration):
     return f_id
 
 
-def ec2_ip(n, config: Configuration):
+def describe_ec2s(client, ec2_ids, fleet_id, filters=None):
+    """describe EC2 instances in batches
+
+    Parameters
+    ----------
+    client : Boto3.client
+        The client used to get the instance data
+    ec2_ids : list
+        The EC2 instance IDs to describe, or None to describe all instances matching filters
+    fleet_id : list
+        The fleet IDs to record in the details
+    filters : list, optional
+        Filters for describe_instances
+
+    Returns
+    -------
+    list
+        A list of dictionaries of the instance details
+    """
+    kwargs = {'Filters': filters} if filters else {}
+    if ec2_ids:
+        kwargs['InstanceIds'] = list(ec2_ids)
+
+    details = []
+    for page in client.get_paginator('describe_instances').paginate(**kwargs):
+        for reservation in page.get('Reservations', []):
+            for i in reservation.get('Instances', []):
+                details.append({
+                    'ip': i.get('PrivateIpAddress'),
+                    'id': i.get('InstanceId'),
+                    'instance_type': i.get('InstanceType'),
+                    'state': i.get('State').get('Name'),
+                    'launch_time': i.get('LaunchTime'),
+                    'fleet_id': fleet_id,
+                    'az': i.get('Placement')['AvailabilityZone']
+                })
+    return details
+
+
+def change_state(client, action, ec2_ids, **kwargs):
+    """sends stop_instances or start_instances requests in batches, at the same time
+
+    Parameters
+    ----------
+    client : Boto3.client
+        The client used to send the requests
+    action : {'stop_instances', 'start_instances'}
+        The EC2 API call to make
+    ec2_ids : list
+        IDs of the instances to stop or start
+    **kwargs
+        Extra arguments of the API call
+
+    Returns
+    -------
+    list
+        IDs of the instances whose request failed
+    """
+    batches = [ec2_ids[i:i + STATE_BATCH_SIZE] for i in range(0, len(ec2_ids), STATE_BATCH_SIZE)]
+
+    def _send(batch):
+        try:
+            response = getattr(client, action)(InstanceIds=batch, **kwargs)
+        except ClientError as e:
+            logger.error('Could not %s %s: %s', action.split('_')[0], ', '.join(batch), e)
+            return batch
+        logger.debug('Response is: %s', response)
+        return []
+
+    if not batches:
+        return []
+    with ThreadPoolExecutor(max_workers=len(batches)) as executor:
+        return [ec2_id for failed in executor.map(_send, batches) for ec2_id in failed]
+
+
+def wait_for_state(client, ec2_ids, state, timeout, status_ok=False):
+    """waits until instances reach a state
+
+    Parameters
+    ----------
+    client : Boto3.client
+        The client used to poll the instances
+    ec2_ids : list
+        IDs of the instances to wait for
+    state : {'stopped', 'running'}
+        The state to wait for
+    timeout : int
+        Seconds to wait in total
+    status_ok : bool, default=False
+        Also wait for the instances to pass their status checks, e.g. after resuming from hibernation
+
+    Returns
+    -------
+    details : list
+        A list of dictionaries of the instance details after waiting, including their current IPs
+    stragglers : list
+        The details of the instances that did not reach the state in time
+    """
+    if not ec2_ids:
+        return [], []
+
+    waiter = client.get_waiter(STATE_WAITERS[state])
+    deadline = time.monotonic() + timeout
+    for i in range(0, len(ec2_ids), STATE_BATCH_SIZE):
+        attempts = max(1, int(deadline - time.monotonic()) // STATE_POLL_DELAY)
+        try:
+            waiter.wait(InstanceIds=ec2_ids[i:i + STATE_BATCH_SIZE],
+                        WaiterConfig={'Delay': STATE_POLL_DELAY, 'MaxAttempts': attempts})
+        except WaiterError:
+            logger.debug('Instances did not reach %s before the waiter gave up', state)
+
+    if status_ok:
+        waiter = client.get_waiter('instance_status_ok')
+        for i in range(0, len(ec2_ids), STATE_BATCH_SIZE):
+            attempts = max(1, int(deadline - time.monotonic()) // STATE_POLL_DELAY)
+            try:
+                waiter.wait(InstanceIds=ec2_ids[i:i + STATE_BATCH_SIZE],
+                            WaiterConfig={'Delay': STATE_POLL_DELAY, 'MaxAttempts': attempts})
+            except WaiterError:
+                logger.warning('Some instances did not pass their status checks after %ds.', timeout)
+
+    details = describe_ec2s(client, ec2_ids, [])
+    return details, [ec2 for ec2 in details if ec2['state'] != state]
+
+
+def ec2_ip(n, config: Configuration, client=None):
     """get AWS EC2 instance details for n
 
     Parameters
@@ -66,55 +207,34 @@ def ec2_ip(n, config: Configuration):
         Fleet name to get the instance details of
     config : Configuration
         Forge configuration data
+    client : Boto3.client, optional
+        The EC2 client to use. Pass one when calling from several threads, as creating clients is not thread-safe.
 
     Returns
     -------
     list
         A list of dictionaries of the instance details in n
     """
-    ec2 = boto3.resource('ec2')
-    client = boto3.client('ec2')
+    client = client or (config.aws_session or boto3).client('ec2')
 
-    running_instances = ec2.instances.filter(Filters=[{
-        'Name': 'instance-state-name',
-        'Values': ['running', 'stopped', 'stopping', 'pending']},
+    fleet_id = check_fleet_id(n, config, client)
+    details = describe_ec2s(client, None, fleet_id, filters=[
+        {'Name': 'instance-state-name',
+         'Values': ['running', 'stopped', 'stopping', 'pending']},
         {'Name': 'tag:forge-name',
          'Values': [n]}])
 
-    ec2s = []
-    for instance in running_instances:
-        ec2s.append(instance.id)
-
-    details = []
-    if len(ec2s) == 0:
+    if len(details) == 0:
         logger.info('No instances running.')
-        x = {
+        details.append({
             'ip': None,
             'id': None,
-            'fleet_id': check_fleet_id(n, config),
+            'fleet_id': fleet_id,
             'state': None
-        }
-        details.append(x)
-        logger.debug('ec2_ip details is %s', details)
-        return details
-    else:
-        reservations = client.describe_instances(InstanceIds=ec2s)
-        group = reservations.get('Reservations')
-        for instances in group:
-            stats = instances.get('Instances')
-            for i in stats:
-                x = {
-                    'ip': i.get('PrivateIpAddress'),
-                    'id': i.get('InstanceId'),
-                    'instance_type': i.get('InstanceType'),
-                    'state': i.get('State').get('Name'),
-                    'launch_time': i.get('LaunchTime'),
-                    'fleet_id': check_fleet_id(n, config),
-                    'az': i.get('Placement')['AvailabilityZone']
-                }
-                details.append(x)
-        logger.debug('ec2_ip details is %s', details)
-        return details
+        })
+
+    logger.debug('ec2_ip details is %s', details)
+    return details
 
 
 def get_ip(details, states):
@@ -164,6 +284,57 @@ def get_nlist(config: Configuration):
     return n_list
 
 
+class SharedClientSession(boto3.session.Session):
+    """a boto3 session that creates each client once and shares it between threads
+
+    Creating clients from one session in several threads at once is not thread-safe, but using the same client is.
+    Set as the aws_session of the jobs of forge.api and batch, jobs running in threads get the shared clients.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._clients = {}
+        self._clients_lock = threading.Lock()
+
+    def client(self, service_name, *args, **kwargs):
+        key = (service_name, repr(args), repr(sorted(kwargs.items())))
+        with self._clients_lock:
+            if key not in self._clients:
+                self._clients[key] = super().client(service_name, *args, **kwargs)
+            return self._clients[key]
+
+
+def setup_default_session(profile, region):
+    """point the default boto3 session at an AWS profile and region
+
+    The current default session is kept if it matches, so its credentials and loaded service models are reused, and
+    a session warmed by forge serve is used if there is one.
+
+    Parameters
+    ----------
+    profile : str or None
+        AWS profile, or None for the default credentials
+    region : str
+        AWS region
+
+    Returns
+    -------
+    boto3.session.Session
+        The default session
+    """
+    session = boto3.DEFAULT_SESSION
+    if session is not None and (session.profile_name, session.region_name) == (profile or 'default', region):
+        return session
+
+    if warm := WARM_SESSIONS.get((profile, region)):
+        boto3.DEFAULT_SESSION = warm
+    elif profile:
+        boto3.setup_default_session(profile_name=profile, region_name=region)
+    else:
+        boto3.setup_default_session(region_name=region)
+    return boto3.DEFAULT_SESSION
+
+
 @contextlib.contextmanager
 def key_file(secret_id, region, profile):
     """Safely retrieve a secret file from AWS for temporary use.
@@ -194,7 +365,10 @@ def key_file(secret_id, region, profile):
         enc_secret = secret['encoded_pem']
         return base64.b64decode(enc_secret.encode('ascii')).decode('ascii')
 
-    secret = read_aws_secret()
+    key = (secret_id, region, profile)
+    if key not in PEM_KEYS:
+        PEM_KEYS[key] = read_aws_secret()
+    secret = PEM_KEYS[key]
 
     # Save the file to a temporary location with 600 permissions
     with tempfile.NamedTemporaryFile('w') as fobj:
@@ -203,15 +377,20 @@ def key_file(secret_id, region, profile):
         yield fobj.name
 
 
-def get_regions():
+def get_regions(session=None):
     """gets the AWS region longname
 
+    Parameters
+    ----------
+    session : boto3.session.Session, optional
+        The session to use, defaults to the default session
+
     Returns
     -------
     dict
         A dictionary of a region's shortcode to it's longname
     """
-    ssm = boto3.client('ssm')
+    ssm = (session or boto3).client('ssm')
 
     def _get_short_codes():
         nonlocal ssm
@@ -231,35 +410,47 @@ def get_regions():
     return regions
 
 
-def destroy_hook(exctype, value, tb):
-    """a hook to bind to sys.excepthook to destroy Forge instances
+def destroy_on_error(func):
+    """a decorator that destroys the Forge instances of a job if the job raises an unexpected error
 
     If an error occurs during the creation or running of a Forge instance, it may be more desirable to destroy the
-    instance to save resources. This destroy hook enables that by binding to sys.excepthook, so if an uncaught error
-    occurs, it will trigger this.
+    instance to save resources. The decorated function must take the Configuration as its first argument. Only the
+    instances of that config are destroyed, so jobs running in other threads of the same process are not affected.
+    ExitHandlerException is passed on, as it is handled by the engine retries.
 
     Examples
     --------
-    >>>sys.excepthook = destroy_hook
+    >>>@destroy_on_error
+    ...def create(config, on_ready=None):
 
     Parameters
     ----------
-    exctype : exception
-        The exception type
-    value : exception
-        The exception instance
-    tb : traceback
-        A traceback for the exception
+    func : callable
+        The job function
+
+    Returns
+    -------
+    callable
+        The wrapped job function, which exits with status 1 on an unexpected error
     """
-    from .destroy import destroy
+    @functools.wraps(func)
+    def wrapper(config: Configuration, *args, **kwargs):
+        try:
+            return func(config, *args, **kwargs)
+        except ExitHandlerException:
+            raise
+        except (Exception, KeyboardInterrupt) as e:
+            from .destroy import destroy
 
-    logger.critical('Unhandled exception of type %s caught with value %s.', exctype, value)
-    config: Configuration = tb.tb_next.tb_frame.f_locals.get('config')
-    if config.destroy_after_failure:
-        destroy(config)
-        logger.critical('Destroyed target instances due to exception.')
+            logger.critical('Unhandled exception of type %s caught with value %s.', type(e), e)
+            logger.debug('Traceback of the unhandled exception', exc_info=True)
+            if config.destroy_after_failure:
+                destroy(config)
+                logger.critical('Destroyed target instances due to exception.')
 
-    sys.exit(1)
+            sys.exit(1)
+
+    return wrapper
 
 
 def set_config_dir(args, forge_env=''):
@@ -362,12 +553,12 @@ def user_accessible_vars(config: Configuration, **kwargs):
         {k: v for k, v in config.items() if isinstance(v, (Number, str))}
     )
     # Expose any admin-defined variables
-    user_vars.update({k: v for k, v in config.items() if k in ADDITIONAL_KEYS})
+    user_vars.update({k: config[k] for k in config.additional_keys or [] if k in config})
 
     return user_vars
 
 
-def get_ec2_pricing(ec2_type, market, config: Configuration):
+def get_ec2_pricing(ec2_type, market, config: Configuration, az=None):
     """Get the hourly spot or on-demand price of given EC2 instance type.
 
     Parameters
@@ -378,6 +569,8 @@ def get_ec2_pricing(ec2_type, market, config: Configuration):
         Whether EC2 is a `'spot'` or `'on-demand'` instance.
     config : Configuration
         Forge configuration data.
+    az : str, optional
+        Availability zone to get the spot price in. Defaults to `config.aws_az`.
 
     Returns
     -------
@@ -385,10 +578,10 @@ def get_ec2_pricing(ec2_type, market, config: Configuration):
         Hourly price of given EC2 type in given market.
     """
     region = config.region
-    az = config.aws_az
+    az = az or config.aws_az
 
     if market == 'spot':
-        client = boto3.client('ec2')
+        client = (config.aws_session or boto3).client('ec2')
         response = client.describe_spot_price_history(
             StartTime=datetime.utcnow(),
             ProductDescriptions=['Linux/UNIX (Amazon VPC)'],
@@ -398,9 +591,9 @@ def get_ec2_pricing(ec2_type, market, config: Configuration):
         price = float(response['SpotPriceHistory'][0]['SpotPrice'])
 
     elif market == 'on-demand':
-        client = boto3.client('pricing', region_name='us-east-1')
+        client = (config.aws_session or boto3).client('pricing', region_name='us-east-1')
 
-        long_region = get_regions()[region]
+        long_region = get_regions(config.aws_session)[region]
         op_sys = 'Linux'
 
         filters = [
@@ -423,8 +616,26 @@ def get_ec2_pricing(ec2_type, market, config: Configuration):
     return price
 
 
+def retry_enabled(config: Configuration):
+    """check if engine will retry after an error
+
+    Engine then replaces the failed fleets itself, so create and run do not destroy them after a failure.
+
+    Parameters
+    ----------
+    config : Configuration
+        Forge configuration data
+
+    Returns
+    -------
+    bool
+        True if errors are bubbled up to engine to retry
+    """
+    return config.job == 'engine' and bool(config.spot_retries or (config.on_demand_failover or config.market_failover))
+
+
 def exit_callback(config: Configuration, exit: bool = False):
-    if config.job == 'engine' and (config.spot_retries or (config.on_demand_failover or config.market_failover)):
+    if retry_enabled(config):
         logger.error('Error occurred, bubbling up error to handler.')
         raise ExitHandlerException
 
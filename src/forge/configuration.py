@@ -3,19 +3,25 @@ import getpass
 import logging
 import os
 import sys
-from typing import ForwardRef, Literal, Optional, Type, Union
+from typing import Any, ForwardRef, Literal, Optional, Type, Union
 
 import boto3
 from botocore.exceptions import ClientError, NoCredentialsError
 import yaml
 
-from . import ADDITIONAL_KEYS, DEFAULT_ARG_VALS, REQUIRED_ARGS
+from . import DEFAULT_ARG_VALS, REQUIRED_ARGS
+from .cache import LogRecorder, cache_identity, cached_identity, config_cache_enabled, config_cache_key, \
+    credential_fingerprint, file_fingerprint, read_config_cache, write_config_cache
 
 logger = logging.getLogger(__name__)
 
+# The C loader is much faster on large environment YAMLs, when libyaml is available
+YamlLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
 
 MachineSpec = Union[list[Union[int, list[int]]]]
-JobUnion = Literal['cleanup', 'create', 'destroy', 'engine', 'rsync', 'run', 'ssh', 'start', 'stop']
+JobUnion = Literal['cleanup', 'create', 'destroy', 'engine', 'logs', 'rsync', 'run', 'ssh', 'start', 'status', 'stop',
+                   'wait']
 
 
 @dataclass
@@ -25,7 +31,8 @@ class Configuration:
     ec2_key: str
     forge_env: str
     forge_pem_secret: str
-    job: JobUnion
+    # Set when the job starts, a config loaded through forge.api is not tied to a job
+    job: Optional[JobUnion] = None
 
     additional_config: Optional[list[dict]] = None
     ami: Optional[str] = None
@@ -38,39 +45,72 @@ class Configuration:
     aws_region: Optional[str] = None
     aws_role: Optional[str] = None
     aws_security_group: Optional[list[str]] = None
+    # boto3 session of the job, set by forge.api and batch so that jobs in the same process do not share the default one
+    aws_session: Optional[Any] = None
     aws_subnet: Optional[str] = None
+    cleanup_concurrency: Optional[int] = None
+    cleanup_grace: Optional[int] = None
+    cleanup_daemon: Optional[bool] = None
+    cleanup_interval: Optional[int] = None
     config_dir: Optional[str] = None
+    cost_report: Optional[str] = None
     cpu: Optional[MachineSpec] = None
     create_timeout: Optional[int] = None
     date: Optional[str] = None
     destroy_after_success: Optional[bool] = DEFAULT_ARG_VALS['destroy_after_success']
     destroy_after_failure: Optional[bool] = DEFAULT_ARG_VALS['destroy_after_failure']
     destroy_on_create: Optional[bool] = None
+    destroy_wait: Optional[bool] = None
+    additional_keys: Optional[list[str]] = field(default=None, compare=False)
+    default_ratio: Optional[list[int]] = None
+    hibernate: Optional[bool] = None
+    stop_wait: Optional[bool] = None
+    start_wait: Optional[bool] = None
+    detach: Optional[bool] = None
     disk: Optional[int] = None
+    dry_run: Optional[bool] = None
     disk_device_name: Optional[str] = None
     ec2_max: Optional[int] = DEFAULT_ARG_VALS['ec2_max']
     excluded_ec2s: Optional[list] = None
+    follow: Optional[bool] = None
     gpu_flag: Optional[bool] = DEFAULT_ARG_VALS['gpu_flag']
     home_dir: Optional[str] = None
+    incremental_rsync: Optional[bool] = None
+    job_context: Optional[Any] = None
     log_level: Optional[Literal['DEBUG', 'INFO', 'WARNING', 'ERROR']] = DEFAULT_ARG_VALS['log_level']
-    market: Optional[Union[str, list[str]]] = field(default_factory=lambda: DEFAULT_ARG_VALS['market'])
+    market: Optional[Union[str, list[str]]] = field(default_factory=lambda: list(DEFAULT_ARG_VALS['market']))
     market_failover: Optional[bool] = None  # ToDo: Remove
+    min_ready_fraction: Optional[float] = None
+    min_ready_workers: Optional[int] = None
     name: Optional[str] = None
     on_demand_failover: Optional[bool] = None
+    poll_interval: Optional[int] = None
     ratio: Optional[MachineSpec] = None #field(default_factory=lambda: DEFAULT_ARG_VALS['default_ratio'])
     ram: Optional[MachineSpec] = None
     rr_all: Optional[bool] = None
     rsync_path: Optional[str] = None
     run_cmd: Optional[str] = None
+    run_concurrency: Optional[int] = None
+    run_console_max_lines: Optional[int] = None
+    run_log_backups: Optional[int] = None
+    run_log_compress: Optional[bool] = None
+    run_log_dir: Optional[str] = None
+    run_log_max_bytes: Optional[int] = None
+    run_prefix_output: Optional[bool] = None
+    run_tail_lines: Optional[int] = None
     s3_path: Optional[str] = None
     service: Optional[Literal['single', 'cluster']] = None
     spot_retries: Optional[int] = None
     spot_strategy: Optional[Literal['lowest-price', 'diversified', 'capacity-optimized', 'capacity-optimized-prioritized', 'price-capacity-optimized']] = DEFAULT_ARG_VALS['spot_strategy']
     src_dir: Optional[str] = None
     tags: Optional[list[dict]] = None
+    tail: Optional[int] = None
+    transfer_compression: Optional[Literal['gzip', 'zstd']] = None
+    transfer_method: Optional[Literal['auto', 'rsync', 'tar']] = None
     user: Optional[str] = None
     user_data: Optional[Union[dict, list]] = None
     valid_time: Optional[int] = DEFAULT_ARG_VALS['valid_time']
+    wait_timeout: Optional[int] = None
     workers: Optional[int] = None
     yaml: Optional[str] = None
     yaml_dir: Optional[str] = None
@@ -88,6 +128,12 @@ class Configuration:
         if self.valid_time and self.valid_time <= 0:
             raise ValueError('The valid must be greater than zero')
 
+        if self.min_ready_fraction is not None and not 0 < self.min_ready_fraction <= 1:
+            raise ValueError('The minimum ready fraction must be greater than zero and at most one')
+
+        if self.min_ready_workers is not None and self.min_ready_workers <= 0:
+            raise ValueError('The minimum number of ready workers must be greater than zero')
+
         if self.workers and self.workers <= 0:
             raise ValueError('The number of workers must be greater than zero')
 
@@ -146,6 +192,43 @@ class Configuration:
             user_config: Optional[dict] = None,
             env_config: Optional[dict] = None,
             additional_config: Optional[dict] = None) -> 'Configuration':
+        if user_config or env_config or additional_config or not config_cache_enabled():
+            return Configuration._compile_config(cli_config, user_config, env_config, additional_config)
+
+        key = config_cache_key({k: v for k, v in cli_config.items() if v is not None}, getpass.getuser())
+        if entry := read_config_cache(key):
+            for level, message in entry['logs']:
+                logger.log(level, '%s', message)
+
+            config = Configuration(**entry['config'])
+            for k, v in entry['additional'].items():
+                config[k] = v
+            return config
+
+        recorder = LogRecorder()
+        logger.addHandler(recorder)
+        try:
+            config = Configuration._compile_config(cli_config)
+        finally:
+            logger.removeHandler(recorder)
+
+        inputs = [config.yaml, os.path.join(config.config_dir, f'{config.forge_env}.yaml')]
+        additional = {k: config[k] for k in config.additional_keys or []}
+        write_config_cache(key, {
+            'inputs': [fingerprint for path in inputs if path and (fingerprint := file_fingerprint(path))],
+            'logs': recorder.records,
+            'config': {k: v for k, v in config.items()
+                       if k not in additional and k not in {'job_context', 'aws_session'}},
+            'additional': additional,
+        })
+        return config
+
+    @staticmethod
+    def _compile_config(
+            cli_config: dict,
+            user_config: Optional[dict] = None,
+            env_config: Optional[dict] = None,
+            additional_config: Optional[dict] = None) -> 'Configuration':
         src_dir = os.path.dirname(os.path.realpath(__file__))
         home_dir = os.path.dirname(src_dir)
         yaml_dir = None
@@ -160,7 +243,7 @@ class Configuration:
                 try:
                     with open(user_yaml, 'r') as f:
                         logger.info('Opening user config file: %s', user_yaml)
-                        user_config = yaml.safe_load(f)
+                        user_config = yaml.load(f, Loader=YamlLoader)
 
                     yaml_dir = os.path.dirname(user_yaml)
                     app_dir = os.path.dirname(yaml_dir)
@@ -191,7 +274,7 @@ class Configuration:
                 try:
                     with open(env_yaml, 'r') as f:
                         logger.info('Opening %s config file at %s.', forge_env, env_yaml)
-                        env_config = yaml.safe_load(f)
+                        env_config = yaml.load(f, Loader=YamlLoader)
                 except FileNotFoundError:
                     logger.error("Environment '%s' config file not found: %s", forge_env, env_yaml)
                     sys.exit(1)
@@ -213,8 +296,6 @@ class Configuration:
                     adc_default: Optional[adc_type] = i.get('default')
                     adc_constraints: list = i.get('constraints', [])
 
-                    ADDITIONAL_KEYS.append(adc_name)
-
                     val: Optional[adc_type] = config_dict.pop(adc_name, adc_default)
 
                     if adc_constraints and val not in adc_constraints:
@@ -241,7 +322,6 @@ class Configuration:
         cpu = config_dict.get('cpu')
         ram = config_dict.get('ram')
         ratio = config_dict.get('ratio')
-        ec2_max = config_dict.get('ec2_max')
 
         if aws_az and aws_multi_az:
             logger.warning('The config options aws_az and aws_multi_az are mutually exclusive, defaulting to aws_az')
@@ -290,11 +370,9 @@ class Configuration:
             return option
 
         if not ram and not cpu:
-            if ratio:
-                DEFAULT_ARG_VALS['default_ratio'] = ratio
-
-            if ec2_max:
-                DEFAULT_ARG_VALS['ec2_max'] = ec2_max
+            # An environment ratio is the default ratio of the jobs that use its config
+            if ratio and not config_dict.get('default_ratio'):
+                config_dict['default_ratio'] = ratio
         else:
             if ram := _parse_list(ram):
                 config_dict['ram'] = ram
@@ -335,6 +413,7 @@ class Configuration:
         config = Configuration(**config_dict)
 
         # Add additional config options
+        config.additional_keys = list(additional_config)
         for k, v in additional_config.items():
             config[k] = v
 
@@ -344,7 +423,7 @@ class Configuration:
         return self.validate_aws_permissions() and self.validate_job_args()
 
     def validate_job_args(self) -> bool:
-        if self.job in ['create', 'destroy', 'engine', 'rsync', 'run', 'ssh', 'start', 'stop']:
+        if self.job in ['create', 'destroy', 'engine', 'logs', 'rsync', 'run', 'ssh', 'start', 'status', 'stop', 'wait']:
             for requisite in REQUIRED_ARGS[self.job]:
                 if not self[requisite]:
                     logger.error('Missing required argument "%s" for job "%s"', requisite, self.job)
@@ -362,7 +441,17 @@ class Configuration:
             else:
                 session = boto3.session.Session(region_name=region)
 
-            session.client('sts').get_caller_identity()
+            credentials = session.get_credentials()
+            if credentials is None:
+                raise NoCredentialsError()
+
+            # Skip the STS round-trip if the same credentials were checked recently
+            fingerprint = credential_fingerprint(profile, credentials)
+            if cached_identity(fingerprint):
+                return True
+
+            identity = session.client('sts').get_caller_identity()
+            cache_identity(fingerprint, identity)
 
             return True
         except NoCredentialsError:
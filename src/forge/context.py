@@ -0,0 +1,216 @@
+"""Instance data discovered once per job and shared between its stages."""
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class JobContext:
+    """instance details of the fleets of a job
+
+    Filled in by create as fleets and instances come up, and read by the later stages of the same job so they do not
+    have to discover the fleets again. Details use the same format as ``ec2_ip``.
+
+    A fleet that create left before all of its instances were initialized is partial: the instances that came up
+    later are not recorded, so its details are not used until the fleet is described again with ``set_fleet``.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._fleets = {}
+        self._readiness = {}
+        self._synced = set()
+
+    def __contains__(self, n):
+        with self._lock:
+            return n in self._fleets
+
+    def set_fleet(self, n, details):
+        """record all instance details of fleet n
+
+        Parameters
+        ----------
+        n : str
+            Fleet name
+        details : list
+            A list of dictionaries of the instance details in n
+        """
+        with self._lock:
+            self._fleets[n] = [dict(d) for d in details]
+            self._readiness.pop(n, None)
+
+    def add_instance(self, n, detail):
+        """record or update the details of one instance of fleet n
+
+        Parameters
+        ----------
+        n : str
+            Fleet name
+        detail : dict
+            Instance details
+        """
+        with self._lock:
+            instances = [d for d in self._fleets.get(n, []) if d.get('id') and d['id'] != detail['id']]
+            instances.append(dict(detail))
+            self._fleets[n] = instances
+
+    def set_readiness(self, n, ready, target):
+        """record how many instances of fleet n are initialized
+
+        Parameters
+        ----------
+        n : str
+            Fleet name
+        ready : int
+            Number of initialized instances
+        target : int
+            Number of instances expected in the fleet
+        """
+        with self._lock:
+            self._readiness[n] = (ready, target)
+
+    def readiness(self, n):
+        """get how many instances of fleet n were initialized when create moved on
+
+        Parameters
+        ----------
+        n : str
+            Fleet name
+
+        Returns
+        -------
+        tuple or None
+            The number of initialized and expected instances, or None if not recorded
+        """
+        with self._lock:
+            return self._readiness.get(n)
+
+    def is_partial(self, n):
+        """check if create moved on before all instances of fleet n were initialized
+
+        Parameters
+        ----------
+        n : str
+            Fleet name
+
+        Returns
+        -------
+        bool
+            True if some instances of n may be missing from its details
+        """
+        with self._lock:
+            ready, target = self._readiness.get(n, (0, 0))
+            return ready < target
+
+    def mark_synced(self, uid):
+        """record that the user content was copied to an instance
+
+        Parameters
+        ----------
+        uid : str
+            Instance ID
+        """
+        with self._lock:
+            self._synced.add(uid)
+
+    def is_synced(self, uid):
+        """check if the user content was already copied to an instance
+
+        Parameters
+        ----------
+        uid : str
+            Instance ID
+
+        Returns
+        -------
+        bool
+            True if the instance has the user content
+        """
+        with self._lock:
+            return uid in self._synced
+
+    def synced_details(self, n):
+        """get the instance details of fleet n that the user content was copied to
+
+        Parameters
+        ----------
+        n : str
+            Fleet name
+
+        Returns
+        -------
+        list
+            A copy of the details of the synced instances in n, empty if none were synced
+        """
+        with self._lock:
+            return [dict(d) for d in self._fleets.get(n, []) if d.get('id') in self._synced]
+
+    def drop(self, n):
+        """forget fleet n, e.g. after it is destroyed
+
+        Parameters
+        ----------
+        n : str
+            Fleet name
+        """
+        with self._lock:
+            self._fleets.pop(n, None)
+            self._readiness.pop(n, None)
+
+    def details(self, n):
+        """get the instance details of fleet n
+
+        Parameters
+        ----------
+        n : str
+            Fleet name
+
+        Returns
+        -------
+        list or None
+            A copy of the instance details in n, or None if n is not known
+        """
+        with self._lock:
+            if n not in self._fleets:
+                return None
+            return [dict(d) for d in self._fleets[n]]
+
+    def instance_ids(self):
+        """get the IDs of all known instances
+
+        Returns
+        -------
+        list
+            Instance IDs of all fleets
+        """
+        with self._lock:
+            return [d['id'] for details in self._fleets.values() for d in details if d.get('id')]
+
+
+def context_details(n, config):
+    """get the instance details of fleet n from the job context
+
+    Parameters
+    ----------
+    n : str
+        Fleet name
+    config : Configuration
+        Forge configuration data
+
+    Returns
+    -------
+    list or None
+        The instance details in n, or None if there is no job context, n is not in it, or n is partial
+    """
+    context = config.job_context
+    if context is None:
+        return None
+
+    if context.is_partial(n):
+        logger.debug('Job context details for %s are partial, describing the fleet again', n)
+        return None
+
+    details = context.details(n)
+    if details is not None:
+        logger.debug('Using job context details for %s', n)
+    return details
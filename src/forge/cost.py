@@ -0,0 +1,211 @@
+"""Cost accounting for the instances of a Forge job."""
+import json
+import logging
+import threading
+from datetime import datetime, timezone
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+from .common import get_ec2_pricing
+from .configuration import Configuration
+
+logger = logging.getLogger(__name__)
+
+_PRICES = {}
+_PRICES_LOCK = threading.Lock()
+
+
+def get_price(ec2_type, az, market, config: Configuration):
+    """get the hourly price of an instance type, cached per type, AZ and market
+
+    Parameters
+    ----------
+    ec2_type : str
+        EC2 type to get pricing for
+    az : str
+        Availability zone of the instance
+    market : {'spot', 'on-demand'}
+        The market the instance was created in
+    config : Configuration
+        Forge configuration data
+
+    Returns
+    -------
+    float or None
+        Hourly price, or None if it could not be found
+    """
+    key = (config.region, ec2_type, az, market)
+    with _PRICES_LOCK:
+        if key in _PRICES:
+            return _PRICES[key]
+
+    try:
+        price = get_ec2_pricing(ec2_type, market, config, az=az)
+    except (BotoCoreError, ClientError, IndexError, KeyError, ValueError) as e:
+        logger.warning('Could not get the %s price of %s in %s: %s', market, ec2_type, az, e)
+        price = None
+
+    with _PRICES_LOCK:
+        _PRICES[key] = price
+    return price
+
+
+def instance_cost(detail, market, config: Configuration, now=None):
+    """get the cost of one instance from its own launch time, type, AZ and market
+
+    Parameters
+    ----------
+    detail : dict
+        Instance details, as returned by ec2_ip
+    market : {'spot', 'on-demand'}
+        The market the instance was created in
+    config : Configuration
+        Forge configuration data
+    now : datetime, optional
+        End of the billed period, default is now
+
+    Returns
+    -------
+    dict
+        The instance cost breakdown
+    """
+    now = now or datetime.now(timezone.utc)
+    ec2_type = detail['instance_type']
+    az = detail['az']
+    launch_time = detail['launch_time']
+    hours = max((now - launch_time).total_seconds(), 0) / 3600
+
+    price = get_price(ec2_type, az, market, config)
+    on_demand_price = price if market == 'on-demand' else get_price(ec2_type, az, 'on-demand', config)
+
+    return {
+        'id': detail['id'],
+        'instance_type': ec2_type,
+        'az': az,
+        'market': market,
+        'launch_time': launch_time.isoformat(),
+        'hours': hours,
+        'hourly_price': price,
+        'cost': price * hours if price is not None else None,
+        'on_demand_cost': on_demand_price * hours if on_demand_price is not None else None,
+    }
+
+
+def _sum(values):
+    values = [v for v in values if v is not None]
+    return sum(values) if values else None
+
+
+def fleet_cost(n, detail, market, config: Configuration, now=None):
+    """get the cost of the running instances of a fleet
+
+    Parameters
+    ----------
+    n : str
+        Fleet name
+    detail : list
+        A list of AWS EC2 instance details
+    market : {'spot', 'on-demand'}
+        The market the fleet was created in
+    config : Configuration
+        Forge configuration data
+    now : datetime, optional
+        End of the billed period, default is now
+
+    Returns
+    -------
+    dict
+        The fleet cost breakdown, with the breakdown of each instance
+    """
+    now = now or datetime.now(timezone.utc)
+    instances = [instance_cost(e, market, config, now) for e in detail
+                 if e['state'] == 'running' and e.get('launch_time')]
+
+    return {
+        'name': n,
+        'market': market,
+        'instances': instances,
+        'hours': max((i['hours'] for i in instances), default=0),
+        'instance_hours': sum(i['hours'] for i in instances),
+        'cost': _sum(i['cost'] for i in instances),
+        'on_demand_cost': _sum(i['on_demand_cost'] for i in instances),
+    }
+
+
+def job_cost(fleets):
+    """get the total cost of a job from the breakdown of its fleets
+
+    Parameters
+    ----------
+    fleets : list
+        Fleet cost breakdowns from fleet_cost
+
+    Returns
+    -------
+    dict
+        The job cost breakdown
+    """
+    cost = _sum(f['cost'] for f in fleets)
+    on_demand_cost = _sum(f['on_demand_cost'] for f in fleets)
+    savings = None
+    if cost is not None and on_demand_cost:
+        savings = 100 * (1 - cost / on_demand_cost)
+
+    return {
+        'fleets': fleets,
+        'hours': max((f['hours'] for f in fleets), default=0),
+        'cost': cost,
+        'on_demand_cost': on_demand_cost,
+        'savings': savings,
+    }
+
+
+def format_hours(hours):
+    """format a number of hours as hours and minutes
+
+    Parameters
+    ----------
+    hours : float
+        Number of hours
+
+    Returns
+    -------
+    str
+        E.g. '2 hours and 5 minutes'
+    """
+    h, rem = divmod(int(hours * 3600), 3600)
+    return f'{h} hours and {rem // 60} minutes'
+
+
+def log_cost(breakdown):
+    """log the run time and cost of a fleet or job breakdown
+
+    Parameters
+    ----------
+    breakdown : dict
+        A breakdown from fleet_cost or job_cost
+    """
+    if not breakdown['cost']:
+        return
+
+    if breakdown.get('market') == 'spot' and breakdown['on_demand_cost']:
+        saving = 100 * (1 - breakdown['cost'] / breakdown['on_demand_cost'])
+        logger.info('Total run time was %s. Total cost was $%.2f. Savings of %.2f%%',
+                    format_hours(breakdown['hours']), breakdown['cost'], saving)
+    else:
+        logger.info('Total run time was %s. Total cost was $%.2f', format_hours(breakdown['hours']), breakdown['cost'])
+
+
+def export_cost(breakdown, path):
+    """write a cost breakdown to a JSON file
+
+    Parameters
+    ----------
+    breakdown : dict
+        A breakdown from job_cost
+    path : str
+        Path of the JSON file
+    """
+    with open(path, 'w') as f:
+        json.dump(breakdown, f, indent=2)
+    logger.info('Cost breakdown written to %s', path)
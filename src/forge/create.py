@@ -13,12 +13,26 @@ from botocore.exceptions import ClientError
 
 from . import DEFAULT_ARG_VALS, REQUIRED_ARGS
 from .parser import add_basic_args, add_job_args, add_env_args, add_general_args, add_action_args
-from .common import ec2_ip, destroy_hook, exit_callback, user_accessible_vars, FormatEmpty, get_ec2_pricing
+from .common import (ec2_ip, describe_ec2s, destroy_on_error, exit_callback, retry_enabled, user_accessible_vars, FormatEmpty,
+                     get_ec2_pricing)
 from .configuration import Configuration
-from .destroy import destroy
+from .context import context_details
+from .destroy import destroy, find_and_destroy
+from .ledger import record
 
 logger = logging.getLogger(__name__)
 
+REQUIRED_ARGS['create'] = ['name',
+                           'service',
+                           'aws_role',
+                           'forge_env']
+
+STATUS_BATCH_SIZE = 100
+# Seconds to wait for enough workers with min_ready_fraction or min_ready_workers when create_timeout is not set
+WORKER_READY_TIMEOUT = 1800
+# Largest RAM, in MiB, of instance types that support hibernation
+HIBERNATE_MAX_RAM = 150 * 1024
+
 
 def cli_create(subparsers):
     """adds create parser to subparser
@@ -35,26 +49,23 @@ def cli_create(subparsers):
     add_env_args(parser)
     add_general_args(parser)
 
-    REQUIRED_ARGS['create'] = ['name',
-                               'service',
-                               'aws_role',
-                               'forge_env']
 
-
-def fleet_request(kwargs):
+def fleet_request(kwargs, session=None):
     """creates the fleet
 
     Parameters
     ----------
     kwargs : dict
         Arguments to pass to Boto3 create_fleet
+    session : boto3.session.Session, optional
+        The session of the job, defaults to the default session
 
     Returns
     -------
     dict
         Response from Boto3 create_fleet
     """
-    client = boto3.client('ec2', region_name=kwargs.pop('region'))
+    client = (session or boto3).client('ec2', region_name=kwargs.pop('region'))
     response = client.create_fleet(**kwargs)
     return response
 
@@ -137,7 +148,186 @@ def get_status(client, ec2_id):
     return status
 
 
-def create_status(n, request, config: Configuration):
+def get_statuses(client, ec2_ids):
+    """get the string status codes of EC2 instances in batches
+
+    Parameters
+    ----------
+    client : Boto3.client
+        The client used to get the instance data
+    ec2_ids : list
+        The EC2 instance IDs to check
+
+    Returns
+    -------
+    dict
+        Status of each EC2 instance, by instance ID
+    """
+    statuses = {}
+    for i in range(0, len(ec2_ids), STATUS_BATCH_SIZE):
+        batch = ec2_ids[i:i + STATUS_BATCH_SIZE]
+        try:
+            response = client.describe_instance_status(InstanceIds=batch)
+        except ClientError:
+            # One unknown instance fails the whole batch, so check them one by one
+            statuses.update({ec2_id: get_status(client, ec2_id) for ec2_id in batch})
+            continue
+
+        statuses.update({ec2_id: 'no-status' for ec2_id in batch})
+        for status in response.get('InstanceStatuses', []):
+            statuses[status['InstanceId']] = status.get('InstanceStatus', {}).get('Status', 'no-status')
+
+    return statuses
+
+
+def min_ready_count(config: Configuration, target):
+    """get the number of workers that must be ready before moving on
+
+    Parameters
+    ----------
+    config : Configuration
+        Forge configuration data
+    target : int
+        The number of workers expected in the fleet
+
+    Returns
+    -------
+    int
+        The number of workers that must be initialized
+    """
+    required = 0
+    if config.min_ready_fraction:
+        required = math.ceil(config.min_ready_fraction * target)
+    if config.min_ready_workers:
+        required = max(required, config.min_ready_workers)
+
+    return max(1, min(required, target))
+
+
+def worker_status(n, client, fleet_id, create_time, config: Configuration, t, on_ready=None):
+    """wait until enough workers of a fleet are initialized
+
+    Used instead of waiting for the whole fleet when min_ready_fraction or min_ready_workers is set. The remaining
+    workers keep starting up in the background. Gives up after create_timeout, or WORKER_READY_TIMEOUT if it is not set.
+
+    Parameters
+    ----------
+    n : str
+        Fleet name
+    client : Boto3.client
+        The client used to get the fleet data
+    fleet_id : str
+        AWS Fleet ID
+    create_time : datetime
+        Fleet creation time
+    config : Configuration
+        Forge configuration data
+    t : int
+        Seconds elapsed so far
+    on_ready : callable, optional
+        Called with the fleet name, IP and ID of each instance as soon as it is initialized
+    """
+    destroy_flag = config.destroy_after_failure and not retry_enabled(config)
+    timeout = config.create_timeout or WORKER_READY_TIMEOUT
+
+    ready = {}
+    target = required = 0
+    time_without_instance = 0
+    while True:
+        if t > timeout:
+            logger.error('Timeout of %s seconds hit for instance fulfillment; Aborting.', timeout)
+            if destroy_flag:
+                destroy(config)
+            exit_callback(config, exit=True)
+
+        fleet_description = client.describe_fleets(FleetIds=[fleet_id])
+        current_status = fleet_description.get('Fleets', [{}])[0].get('ActivityStatus')
+        active = [i['InstanceId'] for i in client.describe_fleet_instances(FleetId=fleet_id).get('ActiveInstances', [])]
+
+        if active:
+            time_without_instance = 0
+        elif current_status not in {'pending_fulfillment', 'fulfilled'}:
+            time_without_instance += 10
+            if time_without_instance == 70:
+                logger.error('Could not create fleet request. Last status: %s.', current_status)
+                if destroy_flag:
+                    destroy(config)
+                logger.error('Last status details: %s', get_fleet_error(client, fleet_id, create_time))
+                exit_callback(config, exit=True)
+
+        waiting = [ec2_id for ec2_id in active if ec2_id not in ready]
+        statuses = get_statuses(client, waiting) if waiting else {}
+        new = [ec2_id for ec2_id, status in statuses.items() if status == 'ok']
+        for ec2_id, status in statuses.items():
+            if status not in {'initializing', 'no-status', 'ok'}:
+                logger.warning('Worker %s is %s, waiting for it to be replaced.', ec2_id, status)
+
+        if new:
+            for detail in describe_ec2s(client, new, [fleet_id]):
+                ready[detail['id']] = detail
+                ready_instance(n, config, detail, on_ready)
+
+        target = config.workers or len(active)
+        required = min_ready_count(config, target) if target else 1
+        if config.job_context is not None:
+            config.job_context.set_readiness(n, len(ready), target)
+
+        if len(ready) >= required:
+            break
+
+        time.sleep(10)
+        t += 10
+        logger.info('%d of %d workers initialized, waiting for %d - %ds elapsed', len(ready), target, required, t)
+
+    if len(ready) < target:
+        logger.info('%d of %d workers initialized, continuing while the rest start up.', len(ready), target)
+    else:
+        logger.info('EC2 initialized.')
+
+
+def ready_instance(n, config: Configuration, detail, on_ready=None):
+    """record an initialized instance in the job context and report it
+
+    Parameters
+    ----------
+    n : str
+        Fleet name
+    config : Configuration
+        Forge configuration data
+    detail : dict
+        Instance details
+    on_ready : callable, optional
+        Called with the fleet name, IP and ID of the instance
+    """
+    if config.job_context is not None:
+        config.job_context.add_instance(n, detail)
+    if on_ready:
+        on_ready(n, detail['ip'], detail['id'])
+
+
+def keep_fleet(n, config: Configuration, detail, on_ready=None):
+    """record an existing fleet in the job context and report its running instances
+
+    Parameters
+    ----------
+    n : str
+        Fleet name
+    config : Configuration
+        Forge configuration data
+    detail : list
+        A list of dictionaries of the instance details in n
+    on_ready : callable, optional
+        Called with the fleet name, IP and ID of each running instance
+    """
+    if config.job_context is not None:
+        config.job_context.set_fleet(n, detail)
+    if on_ready:
+        for e in detail:
+            if e['state'] == 'running':
+                on_ready(n, e['ip'], e['id'])
+
+
+def create_status(n, request, config: Configuration, on_ready=None):
     """create the console status messages for Forge
 
     Parameters
@@ -148,10 +338,12 @@ def create_status(n, request, config: Configuration):
         Response data from Boto3 create_fleet
     config : Configuration
         Forge configuration data
+    on_ready : callable, optional
+        Called with the fleet name, IP and ID of each instance as soon as it is initialized
     """
-    destroy_flag = config.destroy_after_failure
+    destroy_flag = config.destroy_after_failure and not retry_enabled(config)
 
-    client = boto3.client('ec2')
+    client = (config.aws_session or boto3).client('ec2')
 
     logger.info('Creating Fleet... - 0s elapsed')
     time.sleep(10)
@@ -164,6 +356,12 @@ def create_status(n, request, config: Configuration):
     current_status = fleet_details.get('ActivityStatus')
     create_time = fleet_details.get('CreateTime')
     time_without_spot = 0
+
+    if 'cluster-worker' in n and (config.min_ready_fraction or config.min_ready_workers):
+        worker_status(n, client, fleet_id, create_time, config, t, on_ready)
+        pricing(n, config, fleet_id)
+        return
+
     while current_status != 'fulfilled':
         if config.create_timeout and t > config.create_timeout:
             logger.error('Timeout of %s seconds hit for instance fulfillment; Aborting.', config.create_timeout)
@@ -234,6 +432,8 @@ def create_status(n, request, config: Configuration):
                 if destroy_flag:
                     destroy(config)
                 exit_callback(config, exit=True)
+        if on_ready or config.job_context is not None:
+            ready_instance(n, config, describe_ec2s(client, [s], [fleet_id])[0], on_ready)
     logger.info('EC2 initialized.')
     pricing(n, config, fleet_id)
 
@@ -255,17 +455,23 @@ def pricing(n, config: Configuration, fleet_id):
     market = config.market or DEFAULT_ARG_VALS['market']
     market = market[-1] if 'cluster-worker' in n else market[0]
 
-    ec2_client = boto3.client('ec2')
+    ec2_client = (config.aws_session or boto3).client('ec2')
 
     # Get list of active fleet EC2s
     fleet_types = []
-    fleet_request_configs = ec2_client.describe_fleet_instances(FleetId=fleet_id)
-    for i in fleet_request_configs.get('ActiveInstances', []):
-        fleet_types.append(i['InstanceType'])
+    details = context_details(n, config)
+    if details is not None:
+        fleet_types = [i['instance_type'] for i in details if i.get('instance_type')]
+    else:
+        fleet_request_configs = ec2_client.describe_fleet_instances(FleetId=fleet_id)
+        for i in fleet_request_configs.get('ActiveInstances', []):
+            fleet_types.append(i['InstanceType'])
 
     if not fleet_types:
         return
 
+    record(config, 'create', n, market, fleet_types)
+
     # Get on-demand prices regardless of market
     total_on_demand_cost = 0
     for ec2_type in fleet_types:
@@ -282,7 +488,7 @@ def pricing(n, config: Configuration, fleet_id):
         logger.info('Hourly price is $%.2f', total_on_demand_cost)
 
 
-def create_template(n, config: Configuration, task):
+def create_template(n, config: Configuration, task, max_ram=None):
     """creates EC2 Launch Template for n
 
     Parameters
@@ -293,6 +499,9 @@ def create_template(n, config: Configuration, task):
         Forge configuration data
     task : str
         Forge service to run
+    max_ram : int, optional
+        Largest RAM, in MiB, of the instance types the fleet may use. With hibernate, the root volume is grown to hold
+        it on top of the disk of the AMI.
     """
     ud = config.user_data
     key = config.ec2_key
@@ -311,6 +520,9 @@ def create_template(n, config: Configuration, task):
     imds_max_hops = config.aws_imds_max_hops
 
     market = market[-1] if task == 'cluster-worker' else market[0]
+    hibernate = config.hibernate and market == 'on-demand'
+    if config.hibernate and not hibernate:
+        logger.warning('Hibernation is only supported for on-demand instances, %s will not be hibernated.', n)
     if service:
         if user_ami[:4] == "ami-":
             if not user_disk or not user_disk_device_name:
@@ -327,11 +539,19 @@ def create_template(n, config: Configuration, task):
             if not imds_max_hops and ami_info.get('aws_imds_max_hops'):
                 imds_max_hops = ami_info['aws_imds_max_hops']
 
+        ami_disk = disk
         disk = user_disk if user_disk > disk else disk
         disk_device_name = user_disk_device_name if user_disk_device_name else disk_device_name
 
+        # Hibernation writes the RAM to the root volume, next to what the AMI already uses
+        hibernate_disk = ami_disk + math.ceil(max_ram / 1024) if hibernate and max_ram else 0
+        if disk < hibernate_disk:
+            logger.info('Increasing the root volume of %s from %d to %d GiB so it can hold the RAM when hibernating.',
+                        n, disk, hibernate_disk)
+            disk = hibernate_disk
+
     fmt = FormatEmpty()
-    client = boto3.client('ec2')
+    client = (config.aws_session or boto3).client('ec2')
     if isinstance(ud, dict):
         # ToDo: Deprecate service being checked in event of AMI ID
         ami_or_service = user_ami if user_ami in config.user_data else service
@@ -386,6 +606,10 @@ def create_template(n, config: Configuration, task):
     if imds_max_hops:
         metadata_options['HttpPutResponseHopLimit'] = imds_max_hops
 
+    # Hibernation saves the RAM to the root volume, which must be encrypted
+    if hibernate:
+        specs['HibernationOptions'] = {'Configured': True}
+
     response = client.create_launch_template(
         LaunchTemplateName=n,
         LaunchTemplateData={
@@ -393,7 +617,8 @@ def create_template(n, config: Configuration, task):
             'BlockDeviceMappings': [{'DeviceName': disk_device_name,
                                      'Ebs': {'DeleteOnTermination': True,
                                              'VolumeSize': disk,
-                                             'VolumeType': 'gp3'}},
+                                             'VolumeType': 'gp3',
+                                             **({'Encrypted': True} if hibernate else {})}},
                                     ],
             'ImageId': ami,
             'KeyName': key,
@@ -409,12 +634,11 @@ def create_template(n, config: Configuration, task):
     logger.info('Template %s created.', n)
 
 
-def calc_machine_ranges(*, ram=None, cpu=None, ratio=None, workers=None):
+def calc_machine_ranges(*, ram=None, cpu=None, ratio=None, workers=None, default_ratio=None, ec2_max=None):
     """calculate machine data for an EC2 instance
 
     Two of the three optional list values (ram, cpu, ratio) must be provided to calculate the third. If all three are
-    provided then use all three. Ratio will default to the DEFAULT_ARG_VALS['ratio'] value which is set in __init__.py
-    and overridden by normalize_config.
+    provided then use all three. Ratio will default to default_ratio, which can be set by the environment config.
 
     Parameters
     ----------
@@ -426,6 +650,10 @@ def calc_machine_ranges(*, ram=None, cpu=None, ratio=None, workers=None):
         The ratio data in a double nested list
     workers : int, default=1
         The number of workers
+    default_ratio : list, default=DEFAULT_ARG_VALS['default_ratio']
+        The ratio data used when ratio is not provided
+    ec2_max : int, default=DEFAULT_ARG_VALS['ec2_max']
+        The maximum ram of a single instance
 
     Returns
     -------
@@ -438,7 +666,7 @@ def calc_machine_ranges(*, ram=None, cpu=None, ratio=None, workers=None):
     ram2cpu_ratio : list
         The calculated ram:cpu ratio range
     """
-    default_ratio = False
+    ratio_defaulted = False
     default_worker = False
     ram_and_cpu = True
 
@@ -446,8 +674,9 @@ def calc_machine_ranges(*, ram=None, cpu=None, ratio=None, workers=None):
         workers = 1
         default_worker = True
     if not ratio:
-        ratio = DEFAULT_ARG_VALS['default_ratio']
-        default_ratio = True
+        ratio = default_ratio or DEFAULT_ARG_VALS['default_ratio']
+        ratio_defaulted = True
+    ec2_max = ec2_max or DEFAULT_ARG_VALS['ec2_max']
 
     ratio = sorted(ratio)
 
@@ -462,13 +691,13 @@ def calc_machine_ranges(*, ram=None, cpu=None, ratio=None, workers=None):
 
     total_ram = ram[0] * 1024
 
-    # 768 is the max size, so make sure nothing is set to be larger than 768
-    if ram[0] / workers > DEFAULT_ARG_VALS['ec2_max']:
+    # ec2_max is the max size, so make sure nothing is set to be larger than ec2_max
+    if ram[0] / workers > ec2_max:
         if not default_worker:
             logger.error('Minimum amount of RAM per worker exceeds AWS max instance')
             raise ValueError('Minimum amount of ram per worker exceeds AWS instance limit')
 
-        job_ram = [128, 768]
+        job_ram = [128, ec2_max]
     else:
         job_ram = [ram[0] // workers, ram[-1] // workers]
 
@@ -480,7 +709,7 @@ def calc_machine_ranges(*, ram=None, cpu=None, ratio=None, workers=None):
         job_cpu = sorted(cpu)
         job_cpu = [job_cpu[0], job_cpu[-1]]
 
-    if ram_and_cpu and not default_ratio:
+    if ram_and_cpu and not ratio_defaulted:
         ram2cpu_ratio = sorted(ratio)
         ram2cpu_ratio = [ram2cpu_ratio[0], ram2cpu_ratio[-1]]
     else:
@@ -498,7 +727,7 @@ def get_placement_az(config: Configuration, instance_details, mode=None):
     region = config.region
     subnet = config.aws_multi_az
 
-    client = boto3.client('ec2')
+    client = (config.aws_session or boto3).client('ec2')
     az_info = client.describe_availability_zones()
     az_mapping = {x['ZoneId']: x['ZoneName'] for x in az_info['AvailabilityZones']}
 
@@ -554,7 +783,7 @@ def get_placement_az(config: Configuration, instance_details, mode=None):
     return az
 
 
-def create_fleet(n, config: Configuration, task, instance_details):
+def create_fleet(n, config: Configuration, task, instance_details, on_ready=None):
     """creates the AWS EC2 fleet
 
     Parameters
@@ -567,6 +796,8 @@ def create_fleet(n, config: Configuration, task, instance_details):
         Forge service to run
     instance_details: dict
         EC2 instance details for create_fleet
+    on_ready : callable, optional
+        Called with the fleet name, IP and ID of each instance as soon as it is initialized
     """
     valid = config.valid_time or DEFAULT_ARG_VALS['valid_time']
     excluded_ec2s = config.excluded_ec2s
@@ -642,12 +873,12 @@ def create_fleet(n, config: Configuration, task, instance_details):
     kwargs['LaunchTemplateConfigs'] = [launch_template_config]
     kwargs['region'] = region
     logger.debug(kwargs)
-    request = fleet_request(kwargs)
+    request = fleet_request(kwargs, config.aws_session)
     logger.debug(request)
-    create_status(n, request, config)
+    create_status(n, request, config, on_ready)
 
 
-def search_and_create(config: Configuration, task, instance_details):
+def search_and_create(config: Configuration, task, instance_details, on_ready=None):
     """check for running instances and create new ones if necessary
 
     Parameters
@@ -658,6 +889,9 @@ def search_and_create(config: Configuration, task, instance_details):
         Forge service to run
     instance_details: dict
         EC2 instance details for create_fleet
+    on_ready : callable, optional
+        Called with the fleet name, IP and ID of each instance as soon as it is initialized,
+        including instances that were already running
     """
     if not config.ram and not config.cpu:
         logger.error('Please supply either a ram or cpu value to continue.')
@@ -670,8 +904,9 @@ def search_and_create(config: Configuration, task, instance_details):
     market = market[-1] if task == 'cluster-worker' else market[0]
 
     n = f'{name}-{market}-{task}-{date}'
+    max_ram = instance_details.get(task, {}).get('override_instance_stats', {}).get('MemoryMiB', {}).get('Max')
 
-    detail = ec2_ip(n, config)
+    detail = context_details(n, config) or ec2_ip(n, config)
 
     if len(detail) == 1:
         e = detail[0]
@@ -680,24 +915,28 @@ def search_and_create(config: Configuration, task, instance_details):
 
             if config.destroy_on_create:
                 logger.info('destroy_on_create true, destroying fleet.')
-                destroy(config)
-                create_template(n, config, task)
-                create_fleet(n, config, task, instance_details)
+                find_and_destroy(n, config)
+                create_template(n, config, task, max_ram)
+                create_fleet(n, config, task, instance_details, on_ready)
+            else:
+                keep_fleet(n, config, detail, on_ready)
         else:
             if len(e['fleet_id']) != 0:
                 logger.info('Fleet is running without EC2, will recreate it.')
-                destroy(config)
-            create_template(n, config, task)
-            create_fleet(n, config, task, instance_details)
+                find_and_destroy(n, config)
+            create_template(n, config, task, max_ram)
+            create_fleet(n, config, task, instance_details, on_ready)
     elif len(detail) > 1 and task != 'cluster-worker':
         logger.info('Multiple %s instances running, destroying and recreating', task)
-        destroy(config)
-        create_template(n, config, task)
-        create_fleet(n, config, task, instance_details)
-        detail = ec2_ip(n, config)
+        find_and_destroy(n, config)
+        create_template(n, config, task, max_ram)
+        create_fleet(n, config, task, instance_details, on_ready)
+        detail = context_details(n, config) or ec2_ip(n, config)
         for e in detail:
             if e['state'] == 'running':
                 logger.info('%s is running, the IP is %s', task, e['ip'])
+    else:
+        keep_fleet(n, config, detail, on_ready)
 
 
 def get_instance_details(config: Configuration, task_list):
@@ -730,6 +969,7 @@ def get_instance_details(config: Configuration, task_list):
         sys.exit(1)
 
     instance_details = {}
+    limits = {'default_ratio': config.default_ratio, 'ec2_max': config.ec2_max}
 
     def _check(x, i):
         logger.debug('Get index %d of %s', i, x)
@@ -738,16 +978,26 @@ def get_instance_details(config: Configuration, task_list):
     for task in task_list:
         task_worker_count = worker_count
         if 'cluster-master' in task or 'single' in task:
-            task_ram, task_cpu, total_ram, ram2cpu_ratio = calc_machine_ranges(ram=_check(ram, 0), cpu=_check(cpu, 0), ratio=_check(ratio, 0))
+            task_ram, task_cpu, total_ram, ram2cpu_ratio = calc_machine_ranges(ram=_check(ram, 0), cpu=_check(cpu, 0), ratio=_check(ratio, 0), **limits)
             task_worker_count = 1
         elif 'cluster-worker' in task:
-            task_ram, task_cpu, total_ram, ram2cpu_ratio = calc_machine_ranges(ram=_check(ram, 1), cpu=_check(cpu, 1), ratio=_check(ratio, 1), workers=task_worker_count)
+            task_ram, task_cpu, total_ram, ram2cpu_ratio = calc_machine_ranges(ram=_check(ram, 1), cpu=_check(cpu, 1), ratio=_check(ratio, 1), workers=task_worker_count, **limits)
         else:
             logger.error("'%s' does not seem to be a valid cluster or single job.", task)
             if destroy_flag:
                 destroy(config)
             sys.exit(1)
 
+        market = (config.market or DEFAULT_ARG_VALS['market'])[-1 if task == 'cluster-worker' else 0]
+        if config.hibernate and market == 'on-demand' and task_ram[1] > HIBERNATE_MAX_RAM:
+            if task_ram[0] > HIBERNATE_MAX_RAM:
+                logger.error('Instances with more than %d GiB of RAM cannot hibernate.', HIBERNATE_MAX_RAM // 1024)
+                if destroy_flag:
+                    destroy(config)
+                sys.exit(1)
+            logger.info('Limiting %s to %d GiB of RAM so it can hibernate.', task, HIBERNATE_MAX_RAM // 1024)
+            task_ram = [task_ram[0], HIBERNATE_MAX_RAM]
+
         logger.debug('%s OVERRIDE DETAILS | RAM: %s out of %s | CPU: %s with ratio of %s', task, task_ram, total_ram, task_cpu, ram2cpu_ratio)
 
         instance_details[task] = {
@@ -764,16 +1014,17 @@ def get_instance_details(config: Configuration, task_list):
     return instance_details
 
 
-def create(config: Configuration):
+@destroy_on_error
+def create(config: Configuration, on_ready=None):
     """creates EC2 instances based on config
 
     Parameters
     ----------
     config : Configuration
         Forge configuration data
+    on_ready : callable, optional
+        Called with the fleet name, IP and ID of each instance as soon as it is initialized
     """
-    sys.excepthook = destroy_hook
-
     service = config.service
     task_list = ['single']
 
@@ -785,5 +1036,6 @@ def create(config: Configuration):
     if not config.aws_az:
         config.aws_az = get_placement_az(config, instance_details[task_list[-1]])
 
+    kwargs = {'on_ready': on_ready} if on_ready else {}
     for task in task_list:
-        search_and_create(config, task, instance_details[task])
+        search_and_create(config, task, instance_details[task], **kwargs)
@@ -1,18 +1,31 @@
 """EC2 instance destruction."""
 import logging
 import json
+import time
 
-from datetime import datetime, timezone, timedelta
+from concurrent.futures import ThreadPoolExecutor
 
 import boto3
+from botocore.exceptions import ClientError, WaiterError
 
 from . import DEFAULT_ARG_VALS, REQUIRED_ARGS
-from .parser import add_basic_args, add_general_args, add_env_args, add_job_args, add_action_args
-from .common import ec2_ip, get_ec2_pricing
+from .parser import add_basic_args, add_general_args, add_env_args, add_job_args, add_action_args, positive_int_arg
+from .common import describe_ec2s, ec2_ip
 from .configuration import Configuration
+from .context import context_details
+from .cost import export_cost, fleet_cost, job_cost, log_cost
+from .ledger import record
 
 logger = logging.getLogger(__name__)
 
+REQUIRED_ARGS['destroy'] = ['name',
+                            'service',
+                            'forge_env']
+
+FLEET_DELETE_BATCH_SIZE = 25
+TERMINATE_BATCH_SIZE = 100
+TERMINATE_POLL_DELAY = 15
+
 
 def cli_destroy(subparsers):
     """adds destroy parser to subparser
@@ -29,13 +42,15 @@ def cli_destroy(subparsers):
     add_action_args(parser, suppress=True)
     add_env_args(parser)
 
-    REQUIRED_ARGS['destroy'] = ['name',
-                                'service',
-                                'forge_env']
+    parser.add_argument('--cost_report', '--cost-report', help='Write the cost breakdown to this JSON file.')
+    parser.add_argument('--wait', action='store_true', dest='destroy_wait', default=None,
+                        help='Wait until all instances are terminated.')
+    parser.add_argument('--wait_timeout', '--wait-timeout', type=positive_int_arg,
+                        help='Give up waiting after this many seconds. Default is 600.')
 
 
 def pricing(detail, config: Configuration, market):
-    """get pricing info for fleet from AWS
+    """get the cost of the running instances of a fleet and log it
 
     Parameters
     ----------
@@ -45,57 +60,243 @@ def pricing(detail, config: Configuration, market):
         Forge configuration data
     market : {'spot', 'on-demand'}
         The market the instance was created in
+
+    Returns
+    -------
+    dict
+        The fleet cost breakdown
     """
-    logger.debug('config is %s', config)
-
-    total_cost = 0
-    now = datetime.now(timezone.utc)
-    max_dif = timedelta()
-    for e in detail:
-        if e['state'] == 'running':
-            launch_time = e['launch_time']
-            dif = (now - launch_time)
-            if dif > max_dif:
-                max_dif = dif
-            ec2_type = e['instance_type']
-            config.aws_az = e['az']
-            total_cost = get_ec2_pricing(ec2_type, market, config)
-
-    if total_cost > 0:
-        time_d_float = max_dif.total_seconds()
-        hours, rem = divmod(int(time_d_float), 3600)
-        minutes = rem // 60
-        cost = round(total_cost * (time_d_float / 60 / 60), 2)
-        time_diff = f"{hours} hours and {minutes} minutes"
-        logger.info('Total run time was %s. Total cost was $%s', time_diff, cost)
-
-
-def fleet_destroy(n, fleet_id, config: Configuration):
-    """sends the cancel fleet request or terminate instance to AWS
+    breakdown = fleet_cost(None, detail, market, config)
+    log_cost(breakdown)
+    return breakdown
+
+
+def delete_template(client, n):
+    """deletes the launch template of fleet n
 
     Parameters
     ----------
+    client : Boto3.client
+        The client used to delete the template
     n : str
-        Fleet name
-    fleet_id : str
-        Fleet ID
-    config : Configuration
-        Forge configuration data
+        Fleet name, which is also the template name
     """
-    client = boto3.client('ec2')
-
     try:
         response = client.delete_launch_template(LaunchTemplateName=n)
         debug_info = list(response.values())[0]
-        logger.debug('Deleted instance %s %s from %s', debug_info["LaunchTemplateId"], debug_info["LaunchTemplateName"],
-                     fleet_id[0])
+        logger.debug('Deleted template %s %s', debug_info["LaunchTemplateId"], debug_info["LaunchTemplateName"])
         logger.debug('Template %s is destroyed', n)
-    except:
+    except ClientError:
         logger.debug('Template %s not found', n)
 
-    response = client.delete_fleets(FleetIds=fleet_id, TerminateInstances=True)
-    logger.debug('Deleted %d fleets successfully and %d fleets unsuccessfully',
-                 len(list(response["SuccessfulFleetDeletions"])), len(list(response["UnsuccessfulFleetDeletions"])))
+
+def fleet_destroy(fleets, config: Configuration):
+    """sends the delete fleet requests and deletes the launch templates of fleets
+
+    Fleet IDs are deduplicated and deleted with as few delete_fleets calls as possible, while the templates are deleted
+    concurrently.
+
+    Parameters
+    ----------
+    fleets : dict
+        Fleet IDs of each fleet name
+    config : Configuration
+        Forge configuration data
+
+    Returns
+    -------
+    int
+        The number of fleets that could not be deleted
+    """
+    client = (config.aws_session or boto3).client('ec2')
+    fleet_ids = list(dict.fromkeys(f for ids in fleets.values() for f in ids or []))
+    failed = 0
+
+    with ThreadPoolExecutor(max_workers=max(len(fleets), 1)) as executor:
+        templates = [executor.submit(delete_template, client, n) for n in fleets]
+
+        for i in range(0, len(fleet_ids), FLEET_DELETE_BATCH_SIZE):
+            batch = fleet_ids[i:i + FLEET_DELETE_BATCH_SIZE]
+            response = client.delete_fleets(FleetIds=batch, TerminateInstances=True)
+            logger.debug('Deleted %d fleets successfully and %d fleets unsuccessfully',
+                         len(response.get('SuccessfulFleetDeletions', [])),
+                         len(response.get('UnsuccessfulFleetDeletions', [])))
+
+            for unsuccessful in response.get('UnsuccessfulFleetDeletions', []):
+                error = unsuccessful.get('Error', {})
+                logger.error('Could not delete fleet %s: %s %s', unsuccessful.get('FleetId'), error.get('Code', ''),
+                             error.get('Message', ''))
+                failed += 1
+
+        for future in templates:
+            future.result()
+
+    return failed
+
+
+def wait_for_termination(ec2_ids, config: Configuration):
+    """waits until instances are terminated and reports the ones that are not
+
+    Parameters
+    ----------
+    ec2_ids : list
+        IDs of the instances to wait for
+    config : Configuration
+        Forge configuration data
+
+    Returns
+    -------
+    int
+        The number of instances that were not terminated in time
+    """
+    if not ec2_ids:
+        return 0
+
+    client = (config.aws_session or boto3).client('ec2')
+    waiter = client.get_waiter('instance_terminated')
+    timeout = config.wait_timeout or DEFAULT_ARG_VALS['terminate_timeout']
+    deadline = time.monotonic() + timeout
+
+    logger.info('Waiting for %d instance(s) to terminate...', len(ec2_ids))
+    stragglers = []
+    for i in range(0, len(ec2_ids), TERMINATE_BATCH_SIZE):
+        batch = ec2_ids[i:i + TERMINATE_BATCH_SIZE]
+        attempts = max(1, int(deadline - time.monotonic()) // TERMINATE_POLL_DELAY)
+        try:
+            waiter.wait(InstanceIds=batch, WaiterConfig={'Delay': TERMINATE_POLL_DELAY, 'MaxAttempts': attempts})
+        except WaiterError:
+            stragglers += [ec2 for ec2 in describe_ec2s(client, batch, []) if ec2['state'] != 'terminated']
+
+    if stragglers:
+        for ec2 in stragglers:
+            logger.error('Instance %s (%s) is still %s.', ec2['id'], ec2['ip'], ec2['state'])
+        logger.error('%d of %d instance(s) were not terminated after %ds.', len(stragglers), len(ec2_ids), timeout)
+    else:
+        logger.info('All instances terminated.')
+
+    return len(stragglers)
+
+
+def get_fleet_ids(detail):
+    """get the distinct fleet IDs of a fleet's instance details
+
+    Parameters
+    ----------
+    detail : list
+        A list of AWS EC2 instance details
+
+    Returns
+    -------
+    list
+        The fleet IDs in detail
+    """
+    return list(dict.fromkeys(f for i in detail for f in i.get('fleet_id') or []))
+
+
+def find_fleets(n_list, config: Configuration):
+    """finds the instance details of the fleets in n_list
+
+    Parameters
+    ----------
+    n_list : list
+        Fleet names
+    config : Configuration
+        Forge configuration data
+
+    Returns
+    -------
+    dict
+        Instance details of each fleet name
+    """
+    client = (config.aws_session or boto3).client('ec2')
+
+    def _find(n):
+        logger.info('Finding %s instances', n)
+        return context_details(n, config) or ec2_ip(n, config, client)
+
+    with ThreadPoolExecutor(max_workers=max(len(n_list), 1)) as executor:
+        details = list(executor.map(_find, n_list))
+
+    fleets = {}
+    for n, detail in zip(n_list, details):
+        logger.debug(detail)
+        fleets[n] = detail
+    return fleets
+
+
+def fleets_cost(fleets, config: Configuration):
+    """logs the cost of the running instances of destroyed fleets and records them in the ledger
+
+    Parameters
+    ----------
+    fleets : dict
+        Instance details of each fleet name, from find_fleets
+    config : Configuration
+        Forge configuration data
+
+    Returns
+    -------
+    dict or None
+        The job cost breakdown, or None if no instances were running
+    """
+    market = config.market or DEFAULT_ARG_VALS['market']
+
+    costs = []
+    for n, detail in fleets.items():
+        fleet_market = market[-1] if 'cluster-worker' in n else market[0]
+        breakdown = pricing(detail, config, fleet_market)
+        if breakdown:
+            costs.append({**breakdown, 'name': n})
+            if breakdown.get('instances'):
+                record(config, 'destroy', n, fleet_market, breakdown=breakdown)
+
+    breakdown = None
+    if costs:
+        breakdown = job_cost(costs)
+        if len(costs) > 1:
+            log_cost(breakdown)
+        if config.cost_report:
+            export_cost(breakdown, config.cost_report)
+
+    if not any(c.get('instances') for c in costs):
+        breakdown = None
+    return breakdown
+
+
+def teardown(n_list, config: Configuration):
+    """destroys the fleets in n_list together
+
+    The delete requests are sent before the cost of the instances is looked up and recorded. Returns once that is
+    done, unless destroy_wait is set, in which case it waits for all instances to be terminated.
+
+    Parameters
+    ----------
+    n_list : list
+        Fleet names
+    config : Configuration
+        Forge configuration data
+
+    Returns
+    -------
+    status : int
+        0 if all fleets were deleted, and with destroy_wait, all instances were terminated
+    breakdown : dict or None
+        The cost breakdown of the instances that were running, or None if there were none
+    """
+    details = find_fleets(n_list, config)
+    status = fleet_destroy({n: get_fleet_ids(detail) for n, detail in details.items()}, config)
+    breakdown = fleets_cost(details, config)
+
+    if config.destroy_wait:
+        ec2_ids = [i['id'] for detail in details.values() for i in detail if i.get('id')]
+        status += wait_for_termination(ec2_ids, config)
+
+    for n in n_list:
+        if config.job_context is not None:
+            config.job_context.drop(n)
+        logger.info('Fleet %s destroyed', n)
+
+    return 1 if status else 0, breakdown
 
 
 def find_and_destroy(n, config: Configuration):
@@ -107,38 +308,79 @@ def find_and_destroy(n, config: Configuration):
         Fleet name
     config : Configuration
         Forge configuration data
-    """
-    logger.info('Finding %s instances', n)
-    detail = ec2_ip(n, config)
-    logger.debug(detail)
-    market = config.market_failover or DEFAULT_ARG_VALS['market']
-    market = market[-1] if 'cluster-worker' in n else market[0]
-    pricing(detail, config, market)
-    for i in detail:
-        fleet_destroy(n, i.get('fleet_id'), config)
 
-    logger.info('Fleet %s destroyed', n)
+    Returns
+    -------
+    int
+        0 if the fleet was destroyed
+    """
+    return teardown([n], config)[0]
 
 
-def destroy(config: Configuration):
-    """finds and destroys forge instances based on market name and service
+def fleet_names(config: Configuration):
+    """get the names of all fleets of a job
 
     Parameters
     ----------
     config : Configuration
         Forge configuration data
+
+    Returns
+    -------
+    list
+        Fleet names of the job
     """
     name = config.name
     date = config.date or ''
     service = config.service
     market = config.market or DEFAULT_ARG_VALS['market']
 
+    n_list = []
     if service == 'single':
-        n = f'{name}-{market[0]}-{service}-{date}'
-        find_and_destroy(n, config)
+        n_list.append(f'{name}-{market[0]}-{service}-{date}')
 
     if service == 'cluster':
-        n = f'{name}-{market[0]}-{service}-master-{date}'
-        find_and_destroy(n, config)
-        n = f'{name}-{market[-1]}-{service}-worker-{date}'
-        find_and_destroy(n, config)
+        n_list.append(f'{name}-{market[0]}-{service}-master-{date}')
+        n_list.append(f'{name}-{market[-1]}-{service}-worker-{date}')
+
+    return n_list
+
+
+def destroy_with_cost(config: Configuration):
+    """finds and destroys the fleets of a job, and gets the cost of their running instances
+
+    Parameters
+    ----------
+    config : Configuration
+        Forge configuration data
+
+    Returns
+    -------
+    status : int
+        0 if the fleets were destroyed
+    breakdown : dict or None
+        The job cost breakdown, or None if no instances were running
+    """
+    n_list = fleet_names(config)
+    if not n_list:
+        return 0, None
+
+    return teardown(n_list, config)
+
+
+def destroy(config: Configuration):
+    """finds and destroys forge instances based on market name and service
+
+    All fleets of the job are torn down together.
+
+    Parameters
+    ----------
+    config : Configuration
+        Forge configuration data
+
+    Returns
+    -------
+    int
+        0 if the fleets were destroyed
+    """
+    return destroy_with_cost(config)[0]
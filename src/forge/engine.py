@@ -1,20 +1,37 @@
 """Run a command on remote EC2, rsync user content, and execute it."""
+import contextlib
 import logging
+import os
+import subprocess
+import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import boto3
+from botocore.exceptions import ClientError
 
 from . import DEFAULT_ARG_VALS, REQUIRED_ARGS
 from .exceptions import ExitHandlerException
 from .parser import add_basic_args, add_job_args, add_env_args, add_general_args, add_action_args, nonnegative_int_arg
 from .configuration import Configuration
+from .common import describe_ec2s, destroy_on_error, exit_callback, get_nlist, key_file
+from .context import JobContext
 from .create import create, ec2_ip
-from .rsync import rsync
+from .destroy import destroy, find_and_destroy
+from .rsync import SSH_OPTS, rsync_ip, s3_file, scan_source
 from .run import run
 
 
 logger = logging.getLogger(__name__)
 
+REQUIRED_ARGS['engine'] = list(set(REQUIRED_ARGS['create'] +
+                                   REQUIRED_ARGS['rsync'] +
+                                   REQUIRED_ARGS['run'] +
+                                   REQUIRED_ARGS['destroy']))
+
+SSH_READY_TIMEOUT = 300
+SSH_READY_INTERVAL = 5
+
 
 def cli_engine(subparsers):
     """add engine parser to subparsers
@@ -33,16 +50,190 @@ def cli_engine(subparsers):
 
     parser.add_argument('--spot_retries', '--spot-retries', type=nonnegative_int_arg)
     parser.add_argument('--on_demand_failover', '--on-demand-failover', action='store_true', dest='market_failover')
+    parser.add_argument('--cost_report', '--cost-report', help='Write the cost breakdown to this JSON file on destroy.')
+
+
+def wait_for_ssh(ip, pem_path, timeout=SSH_READY_TIMEOUT, interval=SSH_READY_INTERVAL):
+    """wait until an instance accepts SSH connections
+
+    Parameters
+    ----------
+    ip : str
+        IP of the instance
+    pem_path : str
+        Path to the SSH key
+    timeout : int, default=SSH_READY_TIMEOUT
+        Seconds to wait before giving up
+    interval : int, default=SSH_READY_INTERVAL
+        Seconds between attempts
+
+    Returns
+    -------
+    bool
+        True if the instance accepted a connection in time
+    """
+    cmd = ['ssh', *SSH_OPTS.split(), '-o', f'ConnectTimeout={interval}', '-o', 'BatchMode=yes',
+           '-i', pem_path, f'root@{ip}', 'true']
+    deadline = time.monotonic() + timeout
+
+    while True:
+        result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+        if result.returncode == 0:
+            return True
+        if time.monotonic() >= deadline:
+            return False
+        logger.debug('SSH to %s not ready yet, retrying in %ds', ip, interval)
+        time.sleep(interval)
+
+
+def sync_node(config: Configuration, n, ip, uid, source=None, s3_local_path=None):
+    """wait for SSH on a ready instance and copy the user content to it
+
+    Parameters
+    ----------
+    config : Configuration
+        Forge configuration data
+    n : str
+        Fleet name of the instance
+    ip : str
+        IP of the instance
+    uid : str
+        ID of the instance
+    source : dict, optional
+        Shared by the calls for the same rsync_path, so that the folder is scanned once
+    s3_local_path : str, optional
+        The file at s3_path, downloaded once for all the instances
+
+    Returns
+    -------
+    int
+        The status of the rsync commands
+    """
+    with key_file(config.forge_pem_secret, config.region, config.aws_profile) as pem_path:
+        if not wait_for_ssh(ip, pem_path):
+            logger.error('Timed out waiting for SSH on %s', ip)
+            return 1
+
+    logger.info('%s is ready, starting rsync.', ip)
+    return rsync_ip(config, ip, n, uid, source=source, s3_local_path=s3_local_path)
+
+
+def provision(config: Configuration):
+    """create the fleets and copy the user content to each instance as soon as it is ready
+
+    Only the fleets that rsync copies to are synced, i.e. the master of a cluster unless rr_all is set. Instances that
+    the job context records as already synced, such as a master kept across spot retries, are skipped.
+
+    Parameters
+    ----------
+    config : Configuration
+        Forge configuration data
+
+    Returns
+    -------
+    int
+        The status of the rsync commands
+    """
+    if not config.rsync_path and not config.s3_path:
+        logger.error('No rsync_path or s3_path specified, exiting')
+        sys.exit(1)
+
+    context = config.job_context
+    n_list = get_nlist(config)
+    transfers = []
+    concurrency = config.run_concurrency or DEFAULT_ARG_VALS['run_concurrency']
+
+    with contextlib.ExitStack() as stack:
+        # Scanned and downloaded before the instances are ready, so that the rsync threads share them
+        source = scan_source(config.rsync_path, config) if os.path.isdir(config.rsync_path or '') else {}
+        s3_local_path = None
+        if config.s3_path:
+            s3_local_path = stack.enter_context(s3_file(config))
+            if s3_local_path is None:
+                logger.error('Invalid s3_path: %s', config.s3_path)
+                return 1
+
+        executor = stack.enter_context(ThreadPoolExecutor(max_workers=concurrency))
+
+        def on_ready(n, ip, uid):
+            logger.debug('%s in %s is initialized', uid, n)
+            if n not in n_list:
+                return
+            if context is not None and context.is_synced(uid):
+                logger.info('%s already has the user content, skipping rsync.', ip)
+                return
+            transfers.append((ip, uid, executor.submit(sync_node, config, n, ip, uid, source, s3_local_path)))
+
+        create(config, on_ready=on_ready)
+
+        if transfers:
+            logger.info('Waiting for rsync to %d instance(s) to finish...', len(transfers))
+
+        status = 0
+        for ip, uid, future in transfers:
+            rval = future.result()
+            if rval:
+                logger.error('Rsync to %s unsuccessful.', ip)
+            elif context is not None:
+                context.mark_synced(uid)
+            status += rval
+
+    return status
+
+
+def failed_fleets(config: Configuration, n_list):
+    """find the fleets in n_list that have instances that are not running
+
+    Instances recorded in the job context are described in one batch. Fleets that are not in it are discovered with
+    ec2_ip.
+
+    Parameters
+    ----------
+    config : Configuration
+        Forge configuration data
+    n_list : list
+        Fleet names to check
+
+    Returns
+    -------
+    list
+        Names of the fleets that need to be replaced
+    """
+    context = config.job_context
+    fleet_ids = {}
+    if context is not None:
+        fleet_ids = {n: [d['id'] for d in context.details(n) if d.get('id')] for n in n_list if n in context}
+
+    states = {}
+    ec2_ids = [ec2_id for ids in fleet_ids.values() for ec2_id in ids]
+    if ec2_ids:
+        try:
+            client = (config.aws_session or boto3).client('ec2')
+            states = {ec2['id']: ec2['state'] for ec2 in describe_ec2s(client, ec2_ids, [])}
+        except ClientError:
+            # Instances that are long gone fail the whole batch, so check each fleet by name instead
+            fleet_ids = {}
 
-    REQUIRED_ARGS['engine'] = list(set(REQUIRED_ARGS['create'] +
-                                       REQUIRED_ARGS['rsync'] +
-                                       REQUIRED_ARGS['run'] +
-                                       REQUIRED_ARGS['destroy']))
+    failed = []
+    for n in n_list:
+        if n in fleet_ids:
+            ids = fleet_ids[n]
+            if not ids or any(states.get(ec2_id) != 'running' for ec2_id in ids):
+                failed.append(n)
+        elif any(ec2['state'] != 'running' for ec2 in ec2_ip(n, config)):
+            failed.append(n)
 
+    return failed
 
+
+@destroy_on_error
 def engine(config: Configuration):
     """runs the Forge engine command
 
+    On an error with spot instances, only the fleets that lost instances are destroyed and created again, up to
+    spot_retries times. Healthy fleets and the user content already copied to them are kept. With on_demand_failover, a
+    last attempt is made with on-demand instances.
+
     Parameters
     ----------
     config : Configuration
@@ -54,16 +245,18 @@ def engine(config: Configuration):
         The exit status for run with 0 for success
     """
     status = 4
+    config.job_context = JobContext()
+
+    while True:
+        try:
+            if provision(config):
+                exit_callback(config)
+            return run(config)
+        except ExitHandlerException:
+            if 'spot' not in config.market:
+                status = 5
+                break
 
-    try:
-        create(config)
-        logger.info('Waiting for 60s to ensure EC2 has finished starting up...')
-        time.sleep(60)
-        status = rsync(config)
-        status = run(config)
-    except ExitHandlerException:
-        # Check for spot instances and retries
-        if 'spot' in config.market:
             name = config.name
             date = config.date or ''
             market = config.market or DEFAULT_ARG_VALS['market']
@@ -76,28 +269,27 @@ def engine(config: Configuration):
             elif service == "single":
                 n_list.append(f'{name}-{market[0]}-{service}-{date}')
 
-            for n in n_list:
-                flag = False
-                details = ec2_ip(n, config)
-
-                for ec2 in details:
-                    if ec2['state'] != 'running':
-                        flag = True
-
-                if flag:
-                    break
-            else:
+            failed = failed_fleets(config, n_list)
+            if not failed:
                 logger.critical('Bubble received but all instances are ok.')
                 status = 3
-                return status
+                break
 
             if (config.spot_retries or 0) > 0:
                 config.spot_retries -= 1
-                status = engine(config)
+                logger.info('Replacing %s, %d spot retries left.', ', '.join(failed), config.spot_retries)
+                for n in failed:
+                    find_and_destroy(n, config)
             elif config.on_demand_failover or config.market_failover:
-                config.market[0] = config.market[-1] = 'on-demand'
-                status = engine(config)
-        else:
-            status = 5
+                logger.info('Spot retries exhausted, failing over to on-demand.')
+                destroy(config)
+                config.market = ['on-demand'] * len(config.market)
+                config.job_context = JobContext()
+            else:
+                break
+
+    if config.destroy_after_failure:
+        logger.info('destroy_after_failure parameter True, running forge destroy...')
+        destroy(config)
 
     return status
@@ -1,3 +1,33 @@
 class ExitHandlerException(Exception):
     """Raised when there's an exception for the ExitHandler"""
     pass
+
+
+class ForgeError(Exception):
+    """Base class of the errors raised by the Forge API"""
+    pass
+
+
+class ConfigurationError(ForgeError):
+    """Raised when a config cannot be loaded or is missing options for a job"""
+    pass
+
+
+class JobError(ForgeError):
+    """Raised when a Forge job fails
+
+    Attributes
+    ----------
+    job : str
+        The job that failed
+    status : int
+        The exit status of the job
+    result : object or None
+        The result of the job, if it got far enough to have one
+    """
+
+    def __init__(self, job, status, message=None, result=None):
+        self.job = job
+        self.status = status
+        self.result = result
+        super().__init__(message or f'{job} failed with status {status}')
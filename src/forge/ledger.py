@@ -0,0 +1,271 @@
+"""Local ledger of the cost and run time of Forge jobs, and the report subcommand."""
+import logging
+import os
+import sqlite3
+import sys
+from contextlib import closing
+from datetime import datetime, timedelta, timezone
+
+from .common import get_state_dir
+from .parser import positive_int_arg
+
+logger = logging.getLogger(__name__)
+
+LEDGER_FILE = 'ledger.db'
+REPORT_GROUPS = ('name', 'env', 'user', 'day', 'month')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    recorded_at TEXT NOT NULL,
+    event TEXT NOT NULL,
+    name TEXT,
+    env TEXT,
+    user TEXT,
+    service TEXT,
+    fleet TEXT,
+    market TEXT,
+    instance_types TEXT,
+    instances INTEGER,
+    hours REAL,
+    instance_hours REAL,
+    cost REAL,
+    on_demand_cost REAL
+);
+CREATE INDEX IF NOT EXISTS events_recorded_at ON events (recorded_at);
+'''
+
+
+def cli_report(subparsers):
+    """adds report parser to subparser
+
+    Parameters
+    ----------
+    subparsers : argparse.ArgumentParser
+        Argument parser for Forge.main
+    """
+    parser = subparsers.add_parser('report', description='Report the cost and run time of past jobs')
+
+    parser.add_argument('--by', choices=REPORT_GROUPS, default='name', help='Group jobs by this field. Default is name.')
+    parser.add_argument('--name', help='Only report jobs with this name.')
+    parser.add_argument('--forge_env', '--forge-env', help='Only report jobs in this environment.')
+    parser.add_argument('--user', help='Only report jobs of this user.')
+    parser.add_argument('--since', type=_date_arg, help='Only report jobs destroyed on or after this date (YYYY-MM-DD).')
+    parser.add_argument('--until', type=_date_arg, help='Only report jobs destroyed before this date (YYYY-MM-DD).')
+    parser.add_argument('--days', type=positive_int_arg, help='Only report jobs destroyed in the last DAYS days.')
+    parser.add_argument(
+        '--log_level', '--log-level', choices={'DEBUG', 'INFO', 'WARNING', 'ERROR'},
+        default='INFO', type=str.upper, help='Override logging level.'
+    )
+
+
+def _date_arg(string):
+    return datetime.strptime(string, '%Y-%m-%d').replace(tzinfo=timezone.utc)
+
+
+def ledger_path():
+    """get the path of the ledger database
+
+    Returns
+    -------
+    str
+        Path of the SQLite ledger in the Forge state directory
+    """
+    return os.path.join(get_state_dir(), LEDGER_FILE)
+
+
+def connect(path=None):
+    """open the ledger, creating it if needed
+
+    Parameters
+    ----------
+    path : str, optional
+        Path of the ledger, default is ledger_path()
+
+    Returns
+    -------
+    sqlite3.Connection
+        Connection to the ledger
+    """
+    conn = sqlite3.connect(path or ledger_path(), timeout=10)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def record(config, event, fleet, market, instance_types=(), breakdown=None, path=None):
+    """append an event of a fleet to the ledger
+
+    Errors are logged and ignored so the ledger never fails a job.
+
+    Parameters
+    ----------
+    config : Configuration
+        Forge configuration data
+    event : {'create', 'destroy'}
+        What happened to the fleet
+    fleet : str
+        Fleet name
+    market : {'spot', 'on-demand'}
+        The market of the fleet
+    instance_types : iterable, optional
+        Instance types in the fleet
+    breakdown : dict, optional
+        Fleet cost breakdown from cost.fleet_cost
+    path : str, optional
+        Path of the ledger, default is ledger_path()
+    """
+    breakdown = breakdown or {}
+    if breakdown.get('instances'):
+        instance_types = [i['instance_type'] for i in breakdown['instances']]
+    instance_types = list(instance_types)
+
+    row = {
+        'recorded_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'event': event,
+        'name': config.name,
+        'env': config.forge_env,
+        'user': config.user,
+        'service': config.service,
+        'fleet': fleet,
+        'market': market,
+        'instance_types': ','.join(sorted(set(instance_types))),
+        'instances': len(instance_types),
+        'hours': breakdown.get('hours'),
+        'instance_hours': breakdown.get('instance_hours'),
+        'cost': breakdown.get('cost'),
+        'on_demand_cost': breakdown.get('on_demand_cost'),
+    }
+
+    try:
+        with closing(connect(path)) as conn, conn:
+            conn.execute(f'INSERT INTO events ({", ".join(row)}) VALUES ({", ".join("?" * len(row))})',
+                         list(row.values()))
+    except (OSError, sqlite3.Error) as e:
+        logger.warning('Could not record %s of %s in the ledger: %s', event, fleet, e)
+
+
+def summarize(by='name', name=None, env=None, user=None, since=None, until=None, path=None):
+    """aggregate the destroyed fleets in the ledger
+
+    Parameters
+    ----------
+    by : {'name', 'env', 'user', 'day', 'month'}, default='name'
+        Field to group jobs by
+    name : str, optional
+        Only include jobs with this name
+    env : str, optional
+        Only include jobs in this environment
+    user : str, optional
+        Only include jobs of this user
+    since : datetime, optional
+        Only include fleets destroyed on or after this time
+    until : datetime, optional
+        Only include fleets destroyed before this time
+    path : str, optional
+        Path of the ledger, default is ledger_path()
+
+    Returns
+    -------
+    list
+        A dictionary per group with the number of fleets, hours, instance hours, cost, and on-demand cost
+
+    Raises
+    ------
+    ValueError
+        If by is not one of REPORT_GROUPS
+    """
+    if by not in REPORT_GROUPS:
+        raise ValueError(f'Cannot group jobs by {by!r}, must be one of {", ".join(REPORT_GROUPS)}')
+
+    group = {'day': 'substr(recorded_at, 1, 10)', 'month': 'substr(recorded_at, 1, 7)'}.get(by, by)
+
+    where = ["event = 'destroy'"]
+    params = []
+    for column, value in (('name', name), ('env', env), ('user', user)):
+        if value:
+            where.append(f'{column} = ?')
+            params.append(value)
+    if since:
+        where.append('recorded_at >= ?')
+        params.append(since.isoformat(timespec='seconds'))
+    if until:
+        where.append('recorded_at < ?')
+        params.append(until.isoformat(timespec='seconds'))
+
+    query = f'''
+        SELECT {group} AS grp, COUNT(*), SUM(hours), SUM(instance_hours), SUM(cost), SUM(on_demand_cost)
+        FROM events WHERE {' AND '.join(where)} GROUP BY grp ORDER BY grp
+    '''
+    with closing(connect(path)) as conn:
+        rows = conn.execute(query, params).fetchall()
+
+    keys = ('group', 'fleets', 'hours', 'instance_hours', 'cost', 'on_demand_cost')
+    return [dict(zip(keys, row)) for row in rows]
+
+
+def format_report(rows, by='name'):
+    """format a ledger summary as a table
+
+    Parameters
+    ----------
+    rows : list
+        Rows from summarize
+    by : str, default='name'
+        Field the rows are grouped by
+
+    Returns
+    -------
+    str
+        The report table
+    """
+    header = (by, 'fleets', 'hours', 'instance hours', 'cost', 'on-demand cost', 'savings')
+    lines = [header]
+    for row in rows:
+        savings = ''
+        if row['cost'] is not None and row['on_demand_cost']:
+            savings = f"{100 * (1 - row['cost'] / row['on_demand_cost']):.1f}%"
+        lines.append((
+            str(row['group']),
+            str(row['fleets']),
+            f"{row['hours'] or 0:.2f}",
+            f"{row['instance_hours'] or 0:.2f}",
+            f"${row['cost'] or 0:.2f}",
+            f"${row['on_demand_cost'] or 0:.2f}",
+            savings,
+        ))
+
+    widths = [max(len(line[i]) for line in lines) for i in range(len(header))]
+    return '\n'.join('  '.join(v.ljust(w) if i == 0 else v.rjust(w) for i, (v, w) in enumerate(zip(line, widths)))
+                     for line in lines)
+
+
+def report(args):
+    """print the cost and run time of past jobs from the ledger
+
+    Parameters
+    ----------
+    args : dict
+        Parsed report arguments
+
+    Returns
+    -------
+    int
+        0 if the report was printed
+    """
+    since = args.get('since')
+    if args.get('days'):
+        since = datetime.now(timezone.utc) - timedelta(days=args['days'])
+
+    try:
+        rows = summarize(args.get('by') or 'name', args.get('name'), args.get('forge_env'), args.get('user'),
+                         since, args.get('until'))
+    except (OSError, sqlite3.Error) as e:
+        logger.error('Could not read the ledger: %s', e)
+        return 1
+
+    if not rows:
+        logger.info('No jobs found in the ledger.')
+        return 0
+
+    sys.stdout.write(format_report(rows, args.get('by') or 'name') + '\n')
+    return 0
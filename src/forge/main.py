@@ -1,33 +1,113 @@
 import argparse
+import importlib
 import logging
 import sys
+from typing import TYPE_CHECKING
 
-import boto3
 from . import __version__, DEFAULT_ARG_VALS
-from .engine import cli_engine, engine
-from .create import create, cli_create
-from .destroy import cli_destroy, destroy
-from .rsync import cli_rsync, rsync
-from .run import cli_run, run
-from .ssh import cli_ssh, ssh
-from .configuration import Configuration
-from .configure import cli_configure, configure
-from .stop import cli_stop, stop
-from .start import cli_start, start
-from .cleanup import cli_cleanup, cleanup
-
-available_subcommands = [
-    cli_create,
-    cli_destroy,
-    cli_rsync,
-    cli_run,
-    cli_engine,
-    cli_configure,
-    cli_ssh,
-    cli_stop,
-    cli_start,
-    cli_cleanup
-]
+
+if TYPE_CHECKING:
+    from .configuration import Configuration
+
+# Subcommand name: (module, parser function, job function, description). Modules are only imported when their
+# subcommand is used, so that e.g. `forge --version` does not import boto3.
+SUBCOMMANDS = {
+    'create': ('create', 'cli_create', 'create', 'Create EC2'),
+    'destroy': ('destroy', 'cli_destroy', 'destroy', 'Destroy EC2'),
+    'rsync': ('rsync', 'cli_rsync', 'rsync', 'Rsync user content to EC2 instance'),
+    'run': ('run', 'cli_run', 'run', 'Run command on remote EC2'),
+    'engine': ('engine', 'cli_engine', 'engine', 'Create EC2, rsync content, and execute it'),
+    'configure': ('configure', 'cli_configure', 'configure', 'Configure the environment yaml'),
+    'ssh': ('ssh', 'cli_ssh', 'ssh', 'SSH to EC2 instance'),
+    'stop': ('stop', 'cli_stop', 'stop', 'Stop an on-demand EC2'),
+    'start': ('start', 'cli_start', 'start', 'Start an on-demand EC2'),
+    'cleanup': ('cleanup', 'cli_cleanup', 'cleanup', 'Cleanup EC2 launch templates'),
+    'status': ('monitor', 'cli_status', 'show_status', 'Show the state of a detached run'),
+    'logs': ('monitor', 'cli_logs', 'show_logs', 'Show the output of a detached run'),
+    'wait': ('monitor', 'cli_wait', 'wait_for_run', 'Wait for a detached run to end'),
+    'report': ('ledger', 'cli_report', 'report', 'Report the cost and run time of past jobs'),
+    'batch': ('batch', 'cli_batch', 'batch', 'Run the engine for each job in a jobs file'),
+    'serve': ('serve', 'cli_serve', 'serve', 'Run a daemon that the forge CLI forwards commands to'),
+}
+
+# Subcommands run by the forge serve daemon when one is listening. The interactive configure and ssh, and serve
+# itself, always run in the CLI process.
+FORWARDED_SUBCOMMANDS = {'batch', 'cleanup', 'create', 'destroy', 'engine', 'logs', 'report', 'rsync', 'run', 'start',
+                         'status', 'stop', 'wait'}
+
+
+def load_subcommand(job):
+    """import the module of a subcommand
+
+    Parameters
+    ----------
+    job : str
+        Subcommand name
+
+    Returns
+    -------
+    cli : callable
+        Adds the subcommand parser to the subparsers
+    func : callable
+        Runs the job
+    """
+    module, cli, func, _ = SUBCOMMANDS[job]
+    module = importlib.import_module(f'.{module}', __package__)
+    return getattr(module, cli), getattr(module, func)
+
+
+def selected_subcommand(argv):
+    """get the subcommand in the command line arguments without parsing them
+
+    Parameters
+    ----------
+    argv : list
+        Command line arguments, without the program name
+
+    Returns
+    -------
+    str or None
+        The subcommand, or None if there is none, e.g. for `forge --version`
+    """
+    for arg in argv:
+        if not arg.startswith('-'):
+            return arg if arg in SUBCOMMANDS else None
+    return None
+
+
+def build_parser(job=None):
+    """build the Forge argument parser
+
+    Only the parser of the selected subcommand is built in full. The other subcommands are listed by name, so that
+    `forge --help` does not import them.
+
+    Parameters
+    ----------
+    job : str, optional
+        The selected subcommand
+
+    Returns
+    -------
+    argparse.ArgumentParser
+        The Forge argument parser
+    """
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter, allow_abbrev=False
+    )
+    # TODO: maybe convert this to lowercase (version) and rename the other version to spark_version?
+    parser.add_argument(
+        '-V', '--version',
+        dest='forge_version', action='store_true',
+        help='Print the version number of Forge.'
+    )
+    subparsers = parser.add_subparsers(help='job for forge to do', dest='job')
+    for name, (*_, description) in SUBCOMMANDS.items():
+        if name == job:
+            cli, _ = load_subcommand(name)
+            cli(subparsers)
+        else:
+            subparsers.add_parser(name, help=description, description=description)
+    return parser
 
 
 def print_version():
@@ -61,7 +141,7 @@ def set_logger(name=None, level=DEFAULT_ARG_VALS['log_level']):
     return _logger
 
 
-def execute(config: Configuration):
+def execute(config: 'Configuration'):
     """execute the proper Forge job
 
     Parameters
@@ -74,59 +154,56 @@ def execute(config: Configuration):
     int
         The exit status of the job
     """
-    status = 0
     job = config['job']
-    if job == 'create':
-        create(config)
-    elif job == 'destroy':
-        destroy(config)
-    elif job == 'rsync':
-        status = rsync(config)
-    elif job == 'run':
-        status = run(config)
-    elif job == 'engine':
-        status = engine(config)
-    elif job == 'configure':
-        configure()
-    elif job == 'ssh':
-        ssh(config)
-    elif job == 'stop':
-        stop(config)
-    elif job == 'start':
-        start(config)
-    elif job == 'cleanup':
-        cleanup(config)
+    _, func = load_subcommand(job)
+    status = (func() if job == 'configure' else func(config)) or 0
 
     if job in {'run', 'engine'}:
-        if not status and config.destroy_after_success:
+        if config.detach:
+            logger.info('Run is detached, skipping destroy_after_success.')
+        elif not status and config.destroy_after_success:
+            from .destroy import destroy
+
             logger.info('destroy_after_success parameter True, running forge destroy...')
             destroy(config)
     return status
 
 
-def main():
-    """Forge entrypoint."""
-    parser = argparse.ArgumentParser(
-        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter, allow_abbrev=False
-    )
-    # TODO: maybe convert this to lowercase (version) and rename the other version to spark_version?
-    parser.add_argument(
-        '-V', '--version',
-        dest='forge_version', action='store_true',
-        help='Print the version number of Forge.'
-    )
-    subparsers = parser.add_subparsers(help='job for forge to do', dest='job')
-    for sub in available_subcommands:
-        sub(subparsers)
-    args = vars(parser.parse_args())
+def main(argv=None):
+    """Forge entrypoint.
+
+    Commands from the command line in FORWARDED_SUBCOMMANDS are run by the forge serve daemon when one is listening.
+
+    Parameters
+    ----------
+    argv : list, optional
+        Command line arguments, without the program name. Default is sys.argv[1:]
+    """
+    job = selected_subcommand(sys.argv[1:] if argv is None else argv)
+    if argv is None and job in FORWARDED_SUBCOMMANDS:
+        from .serve import forward_command
+
+        status = forward_command(sys.argv[1:])
+        if status is not None:
+            return status
+
+    parser = build_parser(job)
+    args = vars(parser.parse_args(argv))
     if args.pop('forge_version'):
         print_version()
         return 0
 
+    if not args['job']:
+        parser.print_usage()
+        return 1
+
     # Set initial log level
     logger.setLevel(args['log_level'] or DEFAULT_ARG_VALS['log_level'])
 
-    if args['job'] != 'configure':
+    if args['job'] not in {'configure', 'report', 'batch', 'serve'}:
+        from .common import setup_default_session
+        from .configuration import Configuration
+
         config: Configuration = Configuration.load_config(args)
 
         if not config.validate():
@@ -136,10 +213,7 @@ def main():
         logger.setLevel(config.log_level)
 
         # Set default boto3 session
-        if config.aws_profile:
-            boto3.setup_default_session(profile_name=config.aws_profile, region_name=config.region)
-        else:
-            boto3.setup_default_session(region_name=config.region)
+        setup_default_session(config.aws_profile, config.region)
     else:
         config = args
 
@@ -0,0 +1,220 @@
+"""Local manifests of the content already copied to each Forge instance."""
+import fnmatch
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from .common import get_state_dir
+
+logger = logging.getLogger(__name__)
+
+FORGEIGNORE = '.forgeignore'
+
+_manifest_lock = threading.Lock()
+
+
+def load_ignore(root):
+    """read the ignore patterns from the .forgeignore file at the top of root
+
+    Blank lines and lines starting with `#` are skipped.
+
+    Parameters
+    ----------
+    root : str
+        Folder being copied
+
+    Returns
+    -------
+    list
+        The ignore patterns, empty if there is no .forgeignore file
+    """
+    try:
+        with open(f'{root}/{FORGEIGNORE}', 'r') as f:
+            lines = [line.strip() for line in f]
+    except OSError:
+        return []
+
+    return [line for line in lines if line and not line.startswith('#')]
+
+
+def is_ignored(rel_path, patterns, is_dir=False):
+    """check if a path matches any of the ignore patterns
+
+    Patterns follow a subset of the .gitignore syntax: patterns ending in `/` only match folders, patterns
+    containing a `/` are matched against the path relative to the copied folder, and any other pattern is
+    matched against the file or folder name.
+
+    Parameters
+    ----------
+    rel_path : str
+        Path relative to the copied folder
+    patterns : list
+        Ignore patterns from load_ignore
+    is_dir : bool, optional
+        Whether rel_path is a folder
+
+    Returns
+    -------
+    bool
+        True if rel_path should be skipped
+    """
+    name = os.path.basename(rel_path)
+    for pattern in patterns:
+        if pattern.endswith('/'):
+            if not is_dir:
+                continue
+            pattern = pattern.rstrip('/')
+
+        if '/' in pattern:
+            if fnmatch.fnmatchcase(rel_path, pattern.lstrip('/')):
+                return True
+        elif fnmatch.fnmatchcase(name, pattern):
+            return True
+
+    return False
+
+
+def file_digest(path):
+    """get the sha256 hex digest of the file at path"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def scan(root, patterns=None, previous=None, checksum=True):
+    """list the files under root that are not ignored
+
+    Parameters
+    ----------
+    root : str
+        Folder being copied
+    patterns : list, optional
+        Ignore patterns from load_ignore
+    previous : dict, optional
+        An earlier scan of root. Files with the same size and modification time reuse its digest.
+    checksum : bool, optional
+        Whether to compute the digest of each file
+
+    Returns
+    -------
+    dict
+        Map of the relative path of each file to `[size, mtime_ns, digest]`
+    """
+    patterns = patterns or []
+    previous = previous or {}
+    files = {}
+
+    for dir_path, dir_names, file_names in os.walk(root):
+        rel_dir = os.path.relpath(dir_path, root)
+        rel_dir = '' if rel_dir == '.' else rel_dir
+
+        dir_names[:] = [d for d in dir_names if not is_ignored(os.path.join(rel_dir, d), patterns, is_dir=True)]
+
+        for name in file_names:
+            rel_path = os.path.join(rel_dir, name)
+            if is_ignored(rel_path, patterns):
+                continue
+
+            full_path = os.path.join(dir_path, name)
+            try:
+                stat = os.stat(full_path)
+            except OSError:
+                continue
+
+            digest = None
+            if checksum:
+                old = previous.get(rel_path)
+                if old and old[0] == stat.st_size and old[1] == stat.st_mtime_ns:
+                    digest = old[2]
+                else:
+                    digest = file_digest(full_path)
+
+            files[rel_path] = [stat.st_size, stat.st_mtime_ns, digest]
+
+    return files
+
+
+def changed_files(local, remote):
+    """get the files in local that are missing or different in remote
+
+    Parameters
+    ----------
+    local : dict
+        Scan of the local folder
+    remote : dict
+        Scan recorded in the manifest for an instance
+
+    Returns
+    -------
+    list
+        Sorted relative paths of the files to copy
+    """
+    return sorted(k for k, v in local.items() if k not in remote or remote[k][2] != v[2])
+
+
+def manifest_path(n):
+    """get the path of the manifest file for fleet n"""
+    return os.path.join(get_state_dir('manifests'), f'{n}.json')
+
+
+def load_manifest(n, instance_id):
+    """get the files last copied to an instance
+
+    Parameters
+    ----------
+    n : str
+        Fleet name
+    instance_id : str
+        EC2 instance ID
+
+    Returns
+    -------
+    dict
+        Scan of the files copied to the instance, empty if there is none
+    """
+    try:
+        with open(manifest_path(n), 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+    return manifest.get(instance_id, {})
+
+
+def save_manifest(n, instance_id, files, live_ids=None):
+    """record the files copied to an instance
+
+    Parameters
+    ----------
+    n : str
+        Fleet name
+    instance_id : str
+        ID of the instance the files were copied to
+    files : dict
+        Scan of the copied files
+    live_ids : list, optional
+        IDs of the instances still in the fleet. Other instances are dropped from the manifest.
+    """
+    path = manifest_path(n)
+
+    with _manifest_lock:
+        try:
+            with open(path, 'r') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = {}
+
+        if live_ids is not None:
+            manifest = {k: v for k, v in manifest.items() if k in live_ids}
+        manifest[instance_id] = files
+
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, path)
+
+    logger.debug('Saved manifest of %d files for %s on %s', len(files), n, instance_id)
@@ -0,0 +1,324 @@
+"""Follow commands started on remote EC2 with run --detach."""
+import logging
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import DEFAULT_ARG_VALS, REQUIRED_ARGS
+from .parser import (add_basic_args, add_general_args, add_env_args, add_job_args, add_action_args,
+                     nonnegative_int_arg, positive_int_arg)
+from .common import ec2_ip, key_file, get_ip, get_nlist
+from .configuration import Configuration
+from .run import REMOTE_RUN_DIR, stream_output
+
+logger = logging.getLogger(__name__)
+
+REQUIRED_ARGS['status'] = ['name',
+                           'service',
+                           'forge_env']
+REQUIRED_ARGS['logs'] = ['name',
+                         'service',
+                         'forge_env']
+REQUIRED_ARGS['wait'] = ['name',
+                         'service',
+                         'forge_env']
+
+STATUS_CMD = (
+    f'if [ -f {REMOTE_RUN_DIR}/exit_code ]; then echo exited $(cat {REMOTE_RUN_DIR}/exit_code); '
+    f'elif [ ! -f {REMOTE_RUN_DIR}/pid ]; then echo none; '
+    f'elif kill -0 $(cat {REMOTE_RUN_DIR}/pid) 2>/dev/null; then echo running; '
+    f'elif [ -f {REMOTE_RUN_DIR}/exit_code ]; then echo exited $(cat {REMOTE_RUN_DIR}/exit_code); '
+    f'else echo lost; fi'
+)
+
+
+def _add_monitor_args(parser):
+    """adds the arguments shared by the status, logs and wait parsers"""
+    add_basic_args(parser)
+    add_general_args(parser)
+    add_job_args(parser, suppress=True)
+    add_action_args(parser)
+    add_env_args(parser)
+
+
+def _concurrency(config: Configuration, ips):
+    """the number of instances to reach at the same time, like run does"""
+    return min(len(ips), config.run_concurrency or DEFAULT_ARG_VALS['run_concurrency'])
+
+
+def cli_status(subparsers):
+    """adds status parser to subparser
+
+    Parameters
+    ----------
+    subparsers : argparse.ArgumentParser
+        Argument parser for Forge.main
+    """
+    parser = subparsers.add_parser('status', description='Show the state of a detached run')
+    _add_monitor_args(parser)
+
+
+def cli_logs(subparsers):
+    """adds logs parser to subparser
+
+    Parameters
+    ----------
+    subparsers : argparse.ArgumentParser
+        Argument parser for Forge.main
+    """
+    parser = subparsers.add_parser('logs', description='Show the output of a detached run')
+    _add_monitor_args(parser)
+
+    parser.add_argument('--tail', type=nonnegative_int_arg, help='Number of lines to show. Default is 100.')
+    parser.add_argument('--follow', '-f', action='store_true', default=None,
+                        help='Keep printing new output until the run ends.')
+
+
+def cli_wait(subparsers):
+    """adds wait parser to subparser
+
+    Parameters
+    ----------
+    subparsers : argparse.ArgumentParser
+        Argument parser for Forge.main
+    """
+    parser = subparsers.add_parser('wait', description='Wait for a detached run to end')
+    _add_monitor_args(parser)
+
+    parser.add_argument('--poll_interval', '--poll-interval', type=positive_int_arg,
+                        help='Seconds between checks on the instance. Default is 10.')
+    parser.add_argument('--wait_timeout', '--wait-timeout', type=positive_int_arg,
+                        help='Give up after this many seconds.')
+
+
+def get_ssh_cmd(pem_path, ip, remote_cmd):
+    """build the ssh command that runs remote_cmd on ip without a TTY
+
+    Parameters
+    ----------
+    pem_path : str
+        Path to the SSH key
+    ip : str
+        IP of the instance
+    remote_cmd : str
+        Shell command to run on the instance
+
+    Returns
+    -------
+    list
+        The ssh command
+    """
+    return ['ssh', '-o', 'UserKnownHostsFile=/dev/null', '-o', 'StrictHostKeyChecking=no',
+            '-o', 'ConnectTimeout=10', '-o', 'ServerAliveInterval=30', '-i', pem_path, f'root@{ip}', remote_cmd]
+
+
+def parse_state(output):
+    """parse the state printed by STATUS_CMD
+
+    Parameters
+    ----------
+    output : str
+        Output of the remote command
+
+    Returns
+    -------
+    tuple
+        The state (`'running'`, `'exited'`, `'lost'`, `'none'` or `'unreachable'`) and the exit code if it exited
+    """
+    words = output.split()
+    if len(words) == 2 and words[0] == 'exited' and words[1].lstrip('-').isdigit():
+        return 'exited', int(words[1])
+    if len(words) == 1 and words[0] in {'running', 'lost', 'none'}:
+        return words[0], None
+    return 'unreachable', None
+
+
+def get_targets(config: Configuration):
+    """get the IPs of the instances to follow
+
+    Parameters
+    ----------
+    config : Configuration
+        Forge configuration data
+
+    Returns
+    -------
+    list
+        IPs of the running instances
+    """
+    ips = []
+    for n in get_nlist(config):
+        details = ec2_ip(n, config)
+        targets = get_ip(details, ('running',))
+        if not targets or len(targets[0]) != 2:
+            logger.error('Could not find any valid instances for %s', n)
+            continue
+        ips += [ip for ip, _ in targets]
+
+    if not ips:
+        sys.exit(1)
+
+    return ips
+
+
+def _state_status(ip, state, code):
+    """log the state of a node and get its status code"""
+    if state == 'exited':
+        level = logging.INFO if code == 0 else logging.ERROR
+        logger.log(level, '%s: run exited with code %d', ip, code)
+        return code
+    if state == 'running':
+        logger.info('%s: run is still running', ip)
+        return 0
+    if state == 'none':
+        logger.error('%s: no detached run found', ip)
+    elif state == 'lost':
+        logger.error('%s: run stopped without an exit code', ip)
+    else:
+        logger.error('%s: could not get the run state', ip)
+    return 1
+
+
+def show_status(config: Configuration):
+    """show the state of the detached run on each instance
+
+    Parameters
+    ----------
+    config : Configuration
+        Forge configuration data
+
+    Returns
+    -------
+    int
+        0 if the run is still going or ended successfully everywhere, otherwise the first failing status
+    """
+    ips = get_targets(config)
+
+    def _get_state(pem_path, ip):
+        output = subprocess.run(get_ssh_cmd(pem_path, ip, STATUS_CMD), capture_output=True, universal_newlines=True)
+        return parse_state(output.stdout) if output.returncode == 0 else ('unreachable', None)
+
+    with key_file(config.forge_pem_secret, config.region, config.aws_profile) as pem_path:
+        with ThreadPoolExecutor(max_workers=_concurrency(config, ips)) as executor:
+            states = list(executor.map(lambda ip: _get_state(pem_path, ip), ips))
+
+    statuses = [_state_status(ip, *state) for ip, state in zip(ips, states)]
+    return next((status for status in statuses if status), 0)
+
+
+def get_logs_cmd(tail, follow=False):
+    """build the command that prints the output of the detached run on an instance
+
+    Parameters
+    ----------
+    tail : int
+        Number of lines of output to print
+    follow : bool, optional
+        Keep printing new output until the run ends. Without a pid file, keep printing until interrupted.
+
+    Returns
+    -------
+    str
+        The command to run on the instance
+    """
+    log_path = f'{REMOTE_RUN_DIR}/output.log'
+    if not follow:
+        return f'tail -n {tail} {log_path}'
+
+    pid_path = f'{REMOTE_RUN_DIR}/pid'
+    return (f'if [ -f {pid_path} ]; then tail -n {tail} -F --pid=$(cat {pid_path}) {log_path}; '
+            f'else tail -n {tail} -F {log_path}; fi')
+
+
+def show_logs(config: Configuration):
+    """print the output of the detached run on each instance
+
+    Parameters
+    ----------
+    config : Configuration
+        Forge configuration data
+
+    Returns
+    -------
+    int
+        Status of the ssh commands
+    """
+    ips = get_targets(config)
+    tail = config.tail if config.tail is not None else DEFAULT_ARG_VALS['tail']
+
+    remote_cmd = get_logs_cmd(tail, config.follow)
+
+    with key_file(config.forge_pem_secret, config.region, config.aws_profile) as pem_path:
+        if len(ips) == 1:
+            return subprocess.run(get_ssh_cmd(pem_path, ips[0], remote_cmd), universal_newlines=True).returncode
+
+        lock = threading.Lock()
+
+        def _logs(ip):
+            proc = subprocess.Popen(get_ssh_cmd(pem_path, ip, remote_cmd), stdin=subprocess.DEVNULL,
+                                    stdout=subprocess.PIPE, universal_newlines=True, errors='replace')
+            stream_output(proc.stdout, ip, sys.stdout, lock)
+            return proc.wait()
+
+        with ThreadPoolExecutor(max_workers=_concurrency(config, ips)) as executor:
+            statuses = list(executor.map(_logs, ips))
+
+    return next((status for status in statuses if status), 0)
+
+
+def wait_for_run(config: Configuration):
+    """wait for the detached run to end on each instance
+
+    Each instance is watched by a loop running on the instance itself, so only one SSH session is used per instance.
+    If the connection drops, it is opened again until wait_timeout is hit.
+
+    Parameters
+    ----------
+    config : Configuration
+        Forge configuration data
+
+    Returns
+    -------
+    int
+        0 if the run ended successfully everywhere, otherwise the first failing status
+    """
+    ips = get_targets(config)
+    interval = config.poll_interval or DEFAULT_ARG_VALS['poll_interval']
+    deadline = time.monotonic() + config.wait_timeout if config.wait_timeout else None
+
+    remote_cmd = (
+        f'while [ ! -f {REMOTE_RUN_DIR}/exit_code ]; do '
+        f'if [ ! -f {REMOTE_RUN_DIR}/pid ] || ! kill -0 $(cat {REMOTE_RUN_DIR}/pid) 2>/dev/null; then '
+        f'[ -f {REMOTE_RUN_DIR}/exit_code ] || {{ echo lost; exit 0; }}; fi; '
+        f'sleep {interval}; done; echo exited $(cat {REMOTE_RUN_DIR}/exit_code)'
+    )
+
+    def _wait(pem_path, ip):
+        while True:
+            remaining = deadline - time.monotonic() if deadline else None
+            if remaining is not None and remaining <= 0:
+                logger.error('%s: timed out waiting for the run to end', ip)
+                return 'timeout', None
+
+            try:
+                output = subprocess.run(get_ssh_cmd(pem_path, ip, remote_cmd), capture_output=True,
+                                        universal_newlines=True, timeout=remaining)
+            except subprocess.TimeoutExpired:
+                continue
+
+            state = parse_state(output.stdout)
+            if output.returncode == 0 and state[0] != 'unreachable':
+                return state
+
+            logger.warning('%s: lost connection while waiting, retrying in %ds', ip, interval)
+            time.sleep(interval)
+
+    logger.info('Waiting for the run to end on %s', ', '.join(ips))
+    with key_file(config.forge_pem_secret, config.region, config.aws_profile) as pem_path:
+        with ThreadPoolExecutor(max_workers=_concurrency(config, ips)) as executor:
+            states = list(executor.map(lambda ip: _wait(pem_path, ip), ips))
+
+    statuses = [_state_status(ip, *state) if state[0] != 'timeout' else 1 for ip, state in zip(ips, states)]
+    return next((status for status in statuses if status), 0)
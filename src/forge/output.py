@@ -0,0 +1,133 @@
+"""Streaming capture of the output of commands run on remote EC2."""
+import collections
+import gzip
+import logging
+import logging.handlers
+import os
+import shutil
+
+# Longest line read from a pipe at once, longer lines are split
+MAX_LINE = 64 * 1024
+
+
+def read_lines(pipe):
+    """iterate over the lines of a text pipe, splitting lines longer than MAX_LINE
+
+    Parameters
+    ----------
+    pipe : io.TextIOBase
+        Output pipe of a subprocess
+
+    Returns
+    -------
+    iterator
+        The lines read from pipe
+    """
+    return iter(lambda: pipe.readline(MAX_LINE), '')
+
+
+def _gzip_rotator(source, dest):
+    """compress a rotated log file, used as RotatingFileHandler.rotator"""
+    with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+class NodeOutput:
+    """output pipeline for a command running on one instance
+
+    Each line is written to an optional rotating log file, kept in a bounded buffer of the last lines, and printed
+    to the console with the instance as prefix until the console limit is hit.
+
+    Parameters
+    ----------
+    node : str
+        Name of the instance, usually its IP, used as prefix on the console
+    lock : threading.Lock
+        Lock shared by everything writing to the console
+    log_path : str, optional
+        File to save the output to. Nothing is saved if not set.
+    max_bytes : int, optional
+        Size at which the log file is rotated. Never rotated if 0.
+    backups : int, optional
+        Number of rotated log files to keep
+    compress : bool, optional
+        Whether to gzip rotated log files
+    tail_lines : int, optional
+        Number of lines kept in memory for error reports
+    console_max_lines : int, optional
+        Maximum number of lines printed to the console. Unlimited if not set.
+
+    Methods
+    -------
+    write(line, console)
+        Handle one line of output
+    pump(pipe, console)
+        Handle every line of a pipe until it is closed
+    close()
+        Close the log file
+    """
+
+    def __init__(self, node, lock, log_path=None, max_bytes=0, backups=0, compress=False, tail_lines=50,
+                 console_max_lines=None):
+        self.node = node
+        self.lock = lock
+        self.log_path = log_path
+        self.tail = collections.deque(maxlen=tail_lines)
+        self.console_max_lines = console_max_lines
+        self.console_lines = 0
+        self._handler = None
+
+        if log_path:
+            os.makedirs(os.path.dirname(log_path) or '.', exist_ok=True)
+            self._handler = logging.handlers.RotatingFileHandler(
+                log_path, maxBytes=max_bytes, backupCount=backups, encoding='utf-8'
+            )
+            self._handler.terminator = ''
+            if compress:
+                self._handler.namer = lambda name: f'{name}.gz'
+                self._handler.rotator = _gzip_rotator
+
+    def write(self, line, console):
+        """handle one line of output
+
+        Parameters
+        ----------
+        line : str
+            Line of output
+        console : io.TextIOBase
+            Console stream the line came from, e.g. sys.stdout
+        """
+        self.tail.append(line)
+
+        if self._handler:
+            self._handler.handle(logging.makeLogRecord({'msg': line}))
+
+        with self.lock:
+            if self.console_max_lines is None or self.console_lines < self.console_max_lines:
+                console.write(f'[{self.node}] {line}' if line.endswith('\n') else f'[{self.node}] {line}\n')
+                console.flush()
+            elif self.console_lines == self.console_max_lines:
+                where = f', see {self.log_path}' if self.log_path else ''
+                console.write(f'[{self.node}] Console output limit reached{where}\n')
+                console.flush()
+            self.console_lines += 1
+
+    def pump(self, pipe, console):
+        """handle every line of a pipe until it is closed
+
+        Parameters
+        ----------
+        pipe : io.TextIOBase
+            Output pipe of a subprocess
+        console : io.TextIOBase
+            Console stream for the pipe
+        """
+        for line in read_lines(pipe):
+            self.write(line, console)
+        pipe.close()
+
+    def close(self):
+        """close the log file"""
+        if self._handler:
+            self._handler.close()
@@ -32,6 +32,34 @@ def positive_int_arg(string):
     return number
 
 
+def fraction_arg(string):
+    """helper function to validate arguments that must be fractions
+
+    Parameters
+    ----------
+    string : str
+        String to check if it is a number greater than 0 and at most 1
+
+    Returns
+    -------
+    float
+        The number in string if it is a fraction
+
+    Raises
+    ------
+    argparse.ArgumentTypeError
+        If the number is not a fraction
+    """
+    msg = 'Must be a number greater than 0 and at most 1'
+    try:
+        number = float(string)
+    except ValueError:
+        raise argparse.ArgumentTypeError(msg) from None
+    if not 0 < number <= 1:
+        raise argparse.ArgumentTypeError(msg)
+    return number
+
+
 def nonnegative_int_arg(string):
     """helper function to validate arguments that must be nonnegative integers
 
@@ -136,6 +164,9 @@ def add_job_args(parser, *, suppress: bool = False):
     common_grp.add_argument('--destroy_on_create', '--destroy-on-create', action='store_true', default=None, help=help_message)
     common_grp.add_argument('--ami', help=help_message)
     common_grp.add_argument('--disk_device_name', '--disk-device-name', help=help_message)
+    common_grp.add_argument('--min_ready_fraction', '--min-ready-fraction', type=fraction_arg, help=help_message)
+    common_grp.add_argument('--min_ready_workers', '--min-ready-workers', type=positive_int_arg, help=help_message)
+    common_grp.add_argument('--hibernate', action='store_true', default=None, help=help_message)
 
 
 def add_action_args(parser, *, suppress: bool = False):
@@ -159,6 +190,22 @@ def add_action_args(parser, *, suppress: bool = False):
     action_grp.add_argument('--s3_path', '--s3-path', help=help_message)
     action_grp.add_argument('--run_cmd', '--run-cmd', help=help_message)
     action_grp.add_argument('--all', action='store_true', dest='rr_all', help=help_message, default=None)
+    action_grp.add_argument('--detach', action='store_true', help=help_message, default=None)
+    action_grp.add_argument('--run_concurrency', '--run-concurrency', type=positive_int_arg, help=help_message)
+    action_grp.add_argument('--incremental', action='store_true', dest='incremental_rsync', help=help_message,
+                            default=None)
+    action_grp.add_argument('--run_log_dir', '--run-log-dir', type=os.path.realpath, help=help_message)
+    action_grp.add_argument('--run_log_max_bytes', '--run-log-max-bytes', type=positive_int_arg, help=help_message)
+    action_grp.add_argument('--run_log_backups', '--run-log-backups', type=nonnegative_int_arg, help=help_message)
+    action_grp.add_argument('--run_log_compress', '--run-log-compress', action='store_true', default=None,
+                            help=help_message)
+    action_grp.add_argument('--run_tail_lines', '--run-tail-lines', type=positive_int_arg, help=help_message)
+    action_grp.add_argument('--run_console_max_lines', '--run-console-max-lines', type=nonnegative_int_arg,
+                            help=help_message)
+    action_grp.add_argument('--transfer_method', '--transfer-method', choices={'auto', 'rsync', 'tar'},
+                            help=help_message)
+    action_grp.add_argument('--transfer_compression', '--transfer-compression', choices={'gzip', 'zstd'},
+                            help=help_message)
 
 
 def add_env_args(parser):
@@ -1,9 +1,13 @@
 """Rsync user content to EC2 instance."""
+import contextlib
 import logging
 import os
 import re
+import shlex
+import shutil
 import subprocess
 import sys
+import tempfile
 
 import boto3
 
@@ -12,9 +16,21 @@ from .exceptions import ExitHandlerException
 from .parser import add_basic_args, add_general_args, add_env_args, add_action_args, add_job_args
 from .common import ec2_ip, key_file, get_ip, get_nlist, exit_callback
 from .configuration import Configuration
+from .context import context_details
+from .manifest import changed_files, load_ignore, load_manifest, save_manifest, scan
 
 logger = logging.getLogger(__name__)
 
+REQUIRED_ARGS['rsync'] = ['name',
+                          'service',
+                          'forge_env',]
+
+# Folders with at least this many files and an average file size below TAR_MAX_AVG_SIZE are streamed with tar
+TAR_MIN_FILES = 1000
+TAR_MAX_AVG_SIZE = 1024 * 1024
+
+SSH_OPTS = '-o UserKnownHostsFile=/dev/null -o StrictHostKeyChecking=no'
+
 
 def cli_rsync(subparsers):
     """adds rsync parser to subparser
@@ -32,109 +48,347 @@ def cli_rsync(subparsers):
     add_action_args(parser)
     add_env_args(parser)
 
-    REQUIRED_ARGS['rsync'] = ['name',
-                              'service',
-                              'forge_env',]
 
+def get_transfer_method(rsync_loc, method=None):
+    """pick the transfer backend for the folder at rsync_loc
 
-def rsync(config: Configuration):
-    """rsyncs the file at rsync_path to the instance
+    Parameters
+    ----------
+    rsync_loc : str
+        Path of the folder to transfer
+    method : {'auto', 'rsync', 'tar'}, optional
+        Requested transfer method. `'auto'` (the default) picks tar for folders with many small files.
+
+    Returns
+    -------
+    str
+        Either `'rsync'` or `'tar'`
+    """
+    if method and method != 'auto':
+        return method
+
+    file_count = total_size = 0
+    for root, _, files in os.walk(rsync_loc):
+        for f in files:
+            file_count += 1
+            try:
+                total_size += os.lstat(os.path.join(root, f)).st_size
+            except OSError:
+                pass
+
+    if file_count >= TAR_MIN_FILES and total_size / file_count <= TAR_MAX_AVG_SIZE:
+        logger.debug('Folder has %d files averaging %d bytes, using tar', file_count, total_size // file_count)
+        return 'tar'
+
+    return 'rsync'
+
+
+def scan_source(rsync_loc, config: Configuration, previous=None):
+    """scan the folder at rsync_loc once for all the instances it is copied to
 
     Parameters
     ----------
+    rsync_loc : str
+        Path of the folder to copy
     config : Configuration
         Forge configuration data
+    previous : dict, optional
+        A manifest of the folder, to reuse the digests of unchanged files
 
     Returns
     -------
-    int
-        The status of the rsync commands
+    dict
+        The transfer `method`, the ignore `patterns` and, with incremental_rsync or patterns, the scanned `files`
     """
+    patterns = load_ignore(rsync_loc)
+    files = None
+    if config.incremental_rsync or patterns:
+        files = scan(rsync_loc, patterns, previous, checksum=bool(config.incremental_rsync))
 
-    rval = 0
+    return {
+        'method': get_transfer_method(rsync_loc, config.transfer_method),
+        'patterns': patterns,
+        'files': files,
+    }
 
-    def _rsync(config: Configuration, ip):
-        """performs the rsync to a given ip
-
-        Parameters
-        ----------
-        config : Configuration
-            Forge configuration data
-        ip : str
-            IP of the instance to rsync to
-        """
-        pem_secret = config.forge_pem_secret
-        region = config.region
-        profile = config.aws_profile
-        rsync_loc = config.rsync_path or config.app_dir
-
-        with key_file(pem_secret, region, profile) as pem_path:
-            if os.path.isdir(rsync_loc):
-                logger.info('Copying folder %s to EC2.', rsync_loc)
-                rsync_loc += '/*'
-            elif os.path.isfile(rsync_loc):
-                logger.info('Copying file %s to EC2.', rsync_loc)
-            else:
-                logger.error("File or folder from 'rsync_path' parameter not found: %s", rsync_loc)
-                sys.exit(1)
 
-            cmd = 'rsync -rave "ssh -o UserKnownHostsFile=/dev/null -o StrictHostKeyChecking=no'
+def remote_has(ip, pem_path, program):
+    """check whether a program is installed on the instance at ip
+
+    Parameters
+    ----------
+    ip : str
+        IP of the instance
+    pem_path : str
+        Path to the SSH key
+    program : str
+        Name of the program
+
+    Returns
+    -------
+    bool
+        True if the program is on the PATH of root on the instance
+    """
+    cmd = f'ssh {SSH_OPTS} -i {pem_path} root@{ip} "command -v {program}"'
+    return subprocess.run(cmd, shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0
+
+
+def get_tar_cmd(rsync_loc, ip, pem_path, compression=None, files_from=None):
+    """build the shell pipeline that streams the folder at rsync_loc to ip over a single SSH connection
+
+    The pipeline sets pipefail so that a failure of tar or of the compression is not hidden by ssh, and must be run
+    with bash.
+
+    Parameters
+    ----------
+    rsync_loc : str
+        Path of the folder to transfer
+    ip : str
+        IP of the instance to transfer to
+    pem_path : str
+        Path to the SSH key
+    compression : {'gzip', 'zstd'}, optional
+        Compression used on the stream, defaults to gzip
+    files_from : str, optional
+        Path to a file listing the files to send, relative to rsync_loc. Defaults to the entries of the folder that
+        are not hidden, like the `rsync_loc/*` sent by rsync.
+
+    Returns
+    -------
+    str
+        The shell command to run
+    """
+    if compression == 'zstd' and not shutil.which('zstd'):
+        logger.warning('zstd not found locally, falling back to gzip compression')
+        compression = 'gzip'
+
+    if compression == 'zstd':
+        compress, decompress = 'zstd -q -T0 -c', 'zstd -q -d -c'
+    else:
+        compress, decompress = 'gzip -c', 'gzip -d -c'
+
+    # The folder itself is not archived, or extracting it would give /root its owner and mode and break SSH logins
+    if files_from:
+        members = f'-T {shlex.quote(files_from)}'
+    else:
+        members = '-- ' + ' '.join(shlex.quote(e) for e in sorted(os.listdir(rsync_loc)) if not e.startswith('.'))
+
+    cmd = f'set -o pipefail; tar -C {shlex.quote(rsync_loc)} -cf - {members} | {compress}'
+    cmd += f' | ssh {SSH_OPTS} -i {pem_path} root@{ip} "{decompress} | tar -xf - -C /root/"'
+    return cmd
+
+
+def _rsync(config: Configuration, ip, n=None, uid=None, live_ids=None, source=None):
+    """performs the rsync to a given ip
+
+    Folders with a .forgeignore file are sent as a list of the files that are not ignored. With
+    incremental_rsync, only files that changed since the last copy to the same instance are sent.
+
+    Parameters
+    ----------
+    config : Configuration
+        Forge configuration data
+    ip : str
+        IP of the instance to rsync to
+    n : str, optional
+        Fleet name of the instance, needed for incremental_rsync
+    uid : str, optional
+        ID of the instance, needed for incremental_rsync
+    live_ids : list, optional
+        IDs of all instances in the fleet
+    source : dict, optional
+        Shared by the calls for the same folder. Filled with the result of scan_source by the first call.
+    """
+    pem_secret = config.forge_pem_secret
+    region = config.region
+    profile = config.aws_profile
+    rsync_loc = config.rsync_path or config.app_dir
+
+    method = 'rsync'
+    incremental = bool(config.incremental_rsync and n and uid)
+    files = to_copy = None
+
+    with contextlib.ExitStack() as stack:
+        pem_path = stack.enter_context(key_file(pem_secret, region, profile))
+
+        if os.path.isdir(rsync_loc):
+            logger.info('Copying folder %s to EC2.', rsync_loc)
+            if source is None:
+                source = {}
+            previous = load_manifest(n, uid) if incremental else {}
+            if not source:
+                source.update(scan_source(rsync_loc, config, previous))
+            method = source['method']
+
+            if incremental or source['patterns']:
+                files = source['files']
+                to_copy = changed_files(files, previous) if incremental else sorted(files)
+                if not to_copy:
+                    logger.info('No changed files to copy to %s.', ip)
+                    return 0
+                logger.info('Copying %d of %d files.', len(to_copy), len(files))
+            elif method == 'rsync':
+                rsync_loc += '/*'
+        elif os.path.isfile(rsync_loc):
+            logger.info('Copying file %s to EC2.', rsync_loc)
+        else:
+            logger.error("File or folder from 'rsync_path' parameter not found: %s", rsync_loc)
+            sys.exit(1)
+
+        files_from = None
+        if to_copy is not None:
+            list_file = stack.enter_context(tempfile.NamedTemporaryFile('w', suffix='.files'))
+            list_file.write('\n'.join(to_copy) + '\n')
+            list_file.flush()
+            files_from = list_file.name
+
+        if method == 'tar':
+            logger.info('Streaming folder over SSH with tar.')
+            compression = config.transfer_compression
+            if compression == 'zstd' and not remote_has(ip, pem_path, 'zstd'):
+                logger.warning('zstd not found on %s, falling back to gzip compression', ip)
+                compression = 'gzip'
+            cmd = get_tar_cmd(rsync_loc, ip, pem_path, compression, files_from)
+        elif files_from:
+            cmd = f'rsync -rave "ssh {SSH_OPTS} -i {pem_path}"'
+            cmd += f' --files-from={files_from} {rsync_loc}/ root@{ip}:/root/'
+        else:
+            cmd = f'rsync -rave "ssh {SSH_OPTS}'
             cmd += f' -i {pem_path}" {rsync_loc} root@{ip}:/root/'
 
-            try:
-                output = subprocess.check_output(
-                    cmd, stderr=subprocess.STDOUT, shell=True, universal_newlines=True
-                )
-                logger.info('Rsync successful:\n%s', output)
-                return 0
-            except subprocess.CalledProcessError as exc:
-                logger.error('Rsync failed:\n%s', exc.output)
-                return exc.returncode
+        # pipefail in the tar pipeline needs bash
+        shell_args = {'executable': '/bin/bash'} if method == 'tar' else {}
+        try:
+            output = subprocess.check_output(
+                cmd, stderr=subprocess.STDOUT, shell=True, universal_newlines=True, **shell_args
+            )
+            logger.info('Rsync successful:\n%s', output)
+        except subprocess.CalledProcessError as exc:
+            logger.error('Rsync failed:\n%s', exc.output)
+            return exc.returncode
 
-    def _s3_rsync(config: Configuration, ip):
-        """downloads a file from S3 and performs a rsync to a given ip
+    if incremental and files is not None:
+        save_manifest(n, uid, files, live_ids)
 
-        Parameters
-        ----------
-        config : Configuration
-            Forge configuration data
-        ip : str
-            IP of the instance to rsync to
-        """
+    return 0
 
-        rval = 0
 
-        s3_loc = config.s3_path
+@contextlib.contextmanager
+def s3_file(config: Configuration):
+    """download the file at s3_path to a temporary folder that is removed on exit
 
-        logger.debug('S3 path: %s', s3_loc)
+    Parameters
+    ----------
+    config : Configuration
+        Forge configuration data
 
-        s3_uri_pattern = r'(?:s3\:/)?/?(?P<bucket>\S+?)/(?P<key>\S+)'
+    Yields
+    ------
+    str
+        Path of the downloaded file, or None if s3_path is not a valid S3 URI
+    """
+    s3_loc = config.s3_path
 
-        match = re.match(s3_uri_pattern, s3_loc)
-        if match:
-            bucket = match.group('bucket')
-            key = match.group('key')
-            name = key.split('/')[-1]
+    logger.debug('S3 path: %s', s3_loc)
 
-            local_path = f'/tmp/{name}'
+    s3_uri_pattern = r'(?:s3\:/)?/?(?P<bucket>\S+?)/(?P<key>\S+)'
 
-            logger.debug('Downloading file from S3 to %s', local_path)
+    match = re.match(s3_uri_pattern, s3_loc)
+    if not match:
+        yield None
+        return
 
-            s3 = boto3.resource('s3')
-            s3.Object(bucket, key).download_file(local_path)
+    bucket = match.group('bucket')
+    key = match.group('key')
+    name = key.split('/')[-1]
 
-            logger.debug('Successfully downloaded file %s', local_path)
+    with tempfile.TemporaryDirectory(prefix='forge-s3-') as tmp_dir:
+        local_path = os.path.join(tmp_dir, name)
 
-            s3_config = config.clone()
-            s3_config.rsync_path = local_path
+        logger.debug('Downloading file from S3 to %s', local_path)
 
-            rval += _rsync(s3_config, ip)
+        s3 = (config.aws_session or boto3).resource('s3')
+        s3.Object(bucket, key).download_file(local_path)
 
-            os.remove(local_path)
-        else:
-            rval += 1
+        logger.debug('Successfully downloaded file %s', local_path)
 
-        return rval
+        yield local_path
+
+
+def _s3_rsync(config: Configuration, ip, local_path=None):
+    """downloads a file from S3 and performs a rsync to a given ip
+
+    Parameters
+    ----------
+    config : Configuration
+        Forge configuration data
+    ip : str
+        IP of the instance to rsync to
+    local_path : str, optional
+        The file already downloaded by s3_file. Downloaded for this rsync if not set.
+    """
+    if local_path is None:
+        with s3_file(config) as local_path:
+            return _s3_rsync(config, ip, local_path) if local_path else 1
+
+    s3_config = config.clone()
+    s3_config.rsync_path = local_path
+
+    return _rsync(s3_config, ip)
+
+
+def rsync_ip(config: Configuration, ip, n=None, uid=None, live_ids=None, source=None, s3_local_path=None):
+    """copies rsync_path and/or s3_path to a given ip
+
+    Parameters
+    ----------
+    config : Configuration
+        Forge configuration data
+    ip : str
+        IP of the instance to rsync to
+    n : str, optional
+        Fleet name of the instance, needed for incremental_rsync
+    uid : str, optional
+        ID of the instance, needed for incremental_rsync
+    live_ids : list, optional
+        IDs of all instances in the fleet
+    source : dict, optional
+        Shared by the calls for the same rsync_path, so that the folder is scanned once
+    s3_local_path : str, optional
+        The file at s3_path, downloaded once by s3_file for all the instances
+
+    Returns
+    -------
+    int
+        The status of the rsync commands
+    """
+    rval = 0
+
+    if config.rsync_path:
+        logger.info('Rsync destination is %s', ip)
+        rval += _rsync(config, ip, n, uid, live_ids, source)
+
+    if config.s3_path:
+        logger.info('S3 rsync destination is %s', ip)
+        rval += _s3_rsync(config, ip, s3_local_path)
+
+    return rval
+
+
+def rsync(config: Configuration):
+    """rsyncs the file at rsync_path to the instance
+
+    Parameters
+    ----------
+    config : Configuration
+        Forge configuration data
+
+    Returns
+    -------
+    int
+        The status of the rsync commands
+    """
+    rval = 0
 
     n_list = get_nlist(config)
 
@@ -142,24 +396,21 @@ def rsync(config: Configuration):
         logger.error('No rsync_path or s3_path specified, exiting')
         sys.exit(1)
 
+    source = {}
+
     for n in n_list:
         try:
             logger.info('Trying to rsync to %s...', n)
-            details = ec2_ip(n, config)
+            details = context_details(n, config) or ec2_ip(n, config)
             targets = get_ip(details, ('running',))
             logger.debug('Instance target details are %s', targets)
             if not targets or len(targets[0]) != 2:
                 logger.error('Could not find any valid instances to rsync to')
                 continue
 
-            for ip, _ in targets:
-                if config.rsync_path:
-                    logger.info('Rsync destination is %s', ip)
-                    rval += _rsync(config, ip)
-
-                if config.s3_path:
-                    logger.info('S3 rsync destination is %s', ip)
-                    rval += _s3_rsync(config, ip)
+            live_ids = [uid for _, uid in targets]
+            for ip, uid in targets:
+                rval += rsync_ip(config, ip, n, uid, live_ids, source)
 
                 if rval:
                     raise ValueError('Rsync command unsuccessful, ending attempts.')
@@ -1,18 +1,32 @@
 """Run a command on remote EC2."""
 import logging
+import os
 import shlex
 import subprocess
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from . import DEFAULT_ARG_VALS, REQUIRED_ARGS
 from .exceptions import ExitHandlerException
 from .parser import add_basic_args, add_general_args, add_env_args, add_action_args, add_job_args
-from .common import ec2_ip, key_file, get_ip, destroy_hook, user_accessible_vars, FormatEmpty, exit_callback, get_nlist
+from .common import (ec2_ip, key_file, get_ip, destroy_on_error, user_accessible_vars, FormatEmpty, exit_callback, get_nlist,
+                     retry_enabled)
 from .configuration import Configuration
+from .context import context_details
 from .destroy import destroy
+from .output import NodeOutput, read_lines
 
 logger = logging.getLogger(__name__)
 
+REQUIRED_ARGS['run'] = ['name',
+                        'service',
+                        'forge_env',
+                        'run_cmd']
+
+# Folder on the instance holding the pid, exit code and output of detached runs
+REMOTE_RUN_DIR = '/root/.forge/run'
+
 
 def cli_run(subparsers):
     """adds run parser to subparser
@@ -29,15 +43,64 @@ def cli_run(subparsers):
     add_action_args(parser)
     add_env_args(parser)
 
-    REQUIRED_ARGS['run'] = ['name',
-                            'service',
-                            'forge_env',
-                            'run_cmd']
+
+def get_detached_cmd(run_cmd):
+    """wrap run_cmd so it keeps running on the instance after the SSH session ends
+
+    The command runs under nohup from /root. Its pid, output and exit code are written to REMOTE_RUN_DIR.
+
+    Parameters
+    ----------
+    run_cmd : str
+        Command to run, relative to /root
+
+    Returns
+    -------
+    str
+        The shell command to run on the instance
+    """
+    inner = f'/root/{run_cmd}; echo $? > {REMOTE_RUN_DIR}/exit_code'
+    cmd = f'mkdir -p {REMOTE_RUN_DIR} && rm -f {REMOTE_RUN_DIR}/exit_code && cd /root &&'
+    cmd += f' nohup sh -c {shlex.quote(inner)} > {REMOTE_RUN_DIR}/output.log 2>&1 < /dev/null &'
+    cmd += f' echo $! > {REMOTE_RUN_DIR}/pid'
+    return cmd
+
+
+def stream_output(pipe, prefix, out, lock):
+    """copy each line of a subprocess pipe to out with a host prefix
+
+    Parameters
+    ----------
+    pipe : io.TextIOBase
+        Output pipe of the subprocess
+    prefix : str
+        Prefix added to each line
+    out : io.TextIOBase
+        Stream to write to, e.g. sys.stdout
+    lock : threading.Lock
+        Lock shared by all the streams writing to out
+    """
+    for line in read_lines(pipe):
+        with lock:
+            out.write(f'[{prefix}] {line}')
+            out.flush()
+    pipe.close()
 
 
+@destroy_on_error
 def run(config: Configuration):
     """runs the file specified by run_cmd on the instance
 
+    When there is more than one target instance, e.g. with `--all`, the command runs on all of them at once, up to
+    run_concurrency at a time, and each line of output is prefixed with the instance IP.
+
+    With run_log_dir or run_console_max_lines, each instance's output is also captured through a NodeOutput, which
+    saves it to rotating log files and caps how much reaches the console. This is used even for a single instance,
+    as is the prefixed output without a TTY when run_prefix_output is set, e.g. by batch.
+
+    With detach, the command is started in the background on each instance and run returns as soon as it started.
+    Use the status, logs and wait jobs to follow it.
+
     Parameters
     ----------
     config : Configuration
@@ -48,16 +111,26 @@ def run(config: Configuration):
     int
         The status of the run commands
     """
-    sys.excepthook = destroy_hook
-
     # run the run script on the single or master
     service = config.service
     market = config.market or DEFAULT_ARG_VALS['market']
-    destroy_flag = config.destroy_after_failure
+    destroy_flag = config.destroy_after_failure and not retry_enabled(config)
+    concurrency = config.run_concurrency or DEFAULT_ARG_VALS['run_concurrency']
     rval = 0
-    task = service
 
-    def _run(config: Configuration, ip):
+    def _get_cmd(config: Configuration, ip, node_market, task, pem_path, tty):
+        """builds the ssh command that runs run_cmd on a given ip"""
+        fmt = FormatEmpty()
+        run_cmd = fmt.format(config.run_cmd, **user_accessible_vars(config, market=node_market, task=task, ip=ip))
+        cmd = 'ssh -t' if tty else 'ssh'
+        cmd += ' -o UserKnownHostsFile=/dev/null -o StrictHostKeyChecking=no'
+        if config.detach:
+            cmd += f' -i {pem_path} root@{ip} {shlex.quote(get_detached_cmd(run_cmd))}'
+        else:
+            cmd += f' -i {pem_path} root@{ip} /root/{run_cmd}'
+        return cmd
+
+    def _run(config: Configuration, ip, node_market, task):
         """performs the run operation on a given ip
 
         Parameters
@@ -66,22 +139,22 @@ def run(config: Configuration):
             Forge configuration data
         ip : str
             IP of the instance to run the command on
+        node_market : str
+            Market of the instance
+        task : str
+            Forge task of the instance
 
         Returns
         -------
         int
             The status of the program
         """
-        run_cmd = config.run_cmd
         pem_secret = config.forge_pem_secret
         region = config.region
         profile = config.aws_profile
 
         with key_file(pem_secret, region, profile) as pem_path:
-            fmt = FormatEmpty()
-            run_cmd = fmt.format(run_cmd, **user_accessible_vars(config, market=market, task=task, ip=ip))
-            cmd = 'ssh -t -o UserKnownHostsFile=/dev/null -o StrictHostKeyChecking=no'
-            cmd += f' -i {pem_path} root@{ip} /root/{run_cmd}'
+            cmd = _get_cmd(config, ip, node_market, task, pem_path, tty=True)
 
             try:
                 subprocess.run(shlex.split(cmd), check=True, universal_newlines=True)
@@ -92,41 +165,128 @@ def run(config: Configuration):
                 )
                 return exc.returncode
 
+    def _run_all(config: Configuration, nodes):
+        """performs the run operation on all nodes at once
+
+        Parameters
+        ----------
+        config : Configuration
+            Forge configuration data
+        nodes : list
+            List of (ip, market, task) tuples of the instances to run the command on
+
+        Returns
+        -------
+        int
+            The status of the first node that failed, or 0 if all succeeded
+        """
+        pem_secret = config.forge_pem_secret
+        region = config.region
+        profile = config.aws_profile
+        lock = threading.Lock()
+        log_backups = config.run_log_backups
+        if log_backups is None:
+            log_backups = DEFAULT_ARG_VALS['run_log_backups']
+
+        def _run_node(ip, node_market, task, pem_path):
+            cmd = _get_cmd(config, ip, node_market, task, pem_path, tty=False)
+            log_path = os.path.join(config.run_log_dir, f'{config.name}-{ip}.log') if config.run_log_dir else None
+            node_output = NodeOutput(
+                ip, lock, log_path,
+                max_bytes=config.run_log_max_bytes or DEFAULT_ARG_VALS['run_log_max_bytes'],
+                backups=log_backups,
+                compress=bool(config.run_log_compress),
+                tail_lines=config.run_tail_lines or DEFAULT_ARG_VALS['run_tail_lines'],
+                console_max_lines=config.run_console_max_lines
+            )
+
+            try:
+                proc = subprocess.Popen(
+                    shlex.split(cmd), stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                    universal_newlines=True, errors='replace'
+                )
+                err_thread = threading.Thread(target=node_output.pump, args=(proc.stderr, sys.stderr), daemon=True)
+                err_thread.start()
+                node_output.pump(proc.stdout, sys.stdout)
+                err_thread.join()
+                returncode = proc.wait()
+            finally:
+                node_output.close()
+
+            if log_path:
+                logger.info('Output of %s saved to %s', ip, log_path)
+            if returncode:
+                logger.error('EC2 command on %s failed with error code %d: %s', ip, returncode, cmd)
+                if node_output.tail and not config.detach:
+                    logger.error('Last %d lines of output from %s:\n%s', len(node_output.tail), ip,
+                                 ''.join(node_output.tail))
+            return returncode
+
+        with key_file(pem_secret, region, profile) as pem_path:
+            with ThreadPoolExecutor(max_workers=min(concurrency, len(nodes))) as executor:
+                futures = [executor.submit(_run_node, *node, pem_path) for node in nodes]
+                statuses = [f.result() for f in futures]
+
+        failed = [ip for (ip, _, _), status in zip(nodes, statuses) if status]
+        logger.info('Run command succeeded on %d of %d instances.', len(nodes) - len(failed), len(nodes))
+        if failed:
+            logger.error('Run command failed on %s', ', '.join(failed))
+
+        return next((status for status in statuses if status), 0)
+
     n_list = get_nlist(config)
 
+    nodes = []
     for n in n_list:
+        logger.info('Trying to run command on %s', n)
+        # Engine runs on the instances it copied the user content to, not on workers that started up after
+        synced = config.job_context.synced_details(n) if config.job_context is not None else []
+        details = synced or context_details(n, config) or ec2_ip(n, config)
+        targets = get_ip(details, ('running',))
+
+        if not targets or len(targets[0]) != 2:
+            logger.error('Could not find any valid instances to run the command on')
+            rval += 1
+            continue
+
+        logger.debug('Instance target details are %s', targets)
+
+        if 'cluster-master' in n:
+            node_market, task = market[0], f'{service}-master'
+        elif 'cluster-worker' in n:
+            node_market, task = market[-1], f'{service}-worker'
+        else:
+            node_market, task = market[0], service
+
+        nodes += [(ip, node_market, task) for ip, _ in targets]
+
+    try:
+        status = 0
+        if config.detach and nodes:
+            logger.info('Starting detached run on %s', ', '.join(ip for ip, _, _ in nodes))
+            status = _run_all(config, nodes)
+            if not status:
+                logger.info('Run command started in the background. Follow it with forge status, logs or wait.')
+        elif len(nodes) == 1 and not (config.run_log_dir or config.run_console_max_lines is not None or
+                                      config.run_prefix_output):
+            logger.info('Run destination is %s', nodes[0][0])
+            status = _run(config, *nodes[0])
+        elif nodes:
+            logger.info('Run destinations are %s', ', '.join(ip for ip, _, _ in nodes))
+            status = _run_all(config, nodes)
+
+        if status:
+            rval = status
+            raise ValueError('Run command unsuccessful, ending attempts.')
+    except ValueError as e:
+        logger.error('Run command raised error: %s', e)
         try:
-            logger.info('Trying to run command on %s', n)
-            details = ec2_ip(n, config)
-            targets = get_ip(details, ('running',))
-
-            if not targets or len(targets[0]) != 2:
-                logger.error('Could not find any valid instances to run the command on')
-                rval += 1
-                continue
-
-            logger.debug('Instance target details are %s', targets)
-            market = n.split('-')[1]
-
-            if 'cluster-master' in n:
-                task += '-master'
-            elif 'cluster-worker' in n:
-                task += '-worker'
-
-            for ip, _ in targets:
-                logger.info('Run destination is %s', ip)
-                rval = _run(config, ip)
-                if rval:
-                    raise ValueError('Run command unsuccessful, ending attempts.')
-        except ValueError as e:
-            logger.error('Run command raised error: %s', e)
-            try:
-                exit_callback(config)
-            except ExitHandlerException:
-                raise
-            finally:
-                if destroy_flag:
-                    logger.info('destroy_after_failure parameter True, running forge destroy...')
-                    destroy(config)
+            exit_callback(config)
+        except ExitHandlerException:
+            raise
+        finally:
+            if destroy_flag:
+                logger.info('destroy_after_failure parameter True, running forge destroy...')
+                destroy(config)
 
     return rval
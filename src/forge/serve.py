@@ -0,0 +1,518 @@
+"""Forge daemon that keeps sessions, keys and prices warm, and runs the commands the forge CLI forwards to it.
+
+The daemon listens on a Unix socket and forks a child for each command, so the child starts with every module
+imported and the warm caches of the daemon, and commands cannot change each other. The CLI passes its stdin, stdout
+and stderr with the command, so the output reaches the terminal as it is written. Interactive commands like
+`forge ssh` are not forwarded and run in the CLI.
+When the command ends, the child sends the AWS session it used, the prices it looked up and the PEM keys it read back
+to the daemon, to be reused by the next commands. Commands run with other AWS credentials in their environment than
+the daemon start without the warm state and do not send theirs back.
+
+This module is imported by the CLI on every command, so it only imports the standard library at the top.
+"""
+import json
+import logging
+import os
+import selectors
+import signal
+import socket
+import sys
+import time
+import traceback
+
+from . import __version__
+from .cache import get_state_dir
+from .parser import positive_int_arg
+
+logger = logging.getLogger(__name__)
+
+SOCKET_FILE = 'serve.sock'
+# Path of the daemon socket, if not in the Forge state directory
+SOCKET_ENV = 'FORGE_SOCKET'
+# Set to 0 to never forward commands to the daemon
+DAEMON_ENV = 'FORGE_DAEMON'
+CONNECT_TIMEOUT = 1
+MESSAGE_SIZE = 65536
+POLL_INTERVAL = 1
+# Seconds the daemon keeps prices and sessions, so spot prices and credentials do not go stale
+PRICE_TTL = 3600
+SESSION_TTL = 1800
+# Signals of the CLI that are passed on to the command
+FORWARDED_SIGNALS = ('SIGINT', 'SIGTERM', 'SIGHUP', 'SIGWINCH')
+
+
+def cli_serve(subparsers):
+    """adds serve parser to subparser
+
+    Parameters
+    ----------
+    subparsers : argparse.ArgumentParser
+        Argument parser for Forge.main
+    """
+    parser = subparsers.add_parser('serve', description='Run a daemon that the forge CLI forwards commands to')
+
+    parser.add_argument('--socket', dest='serve_socket',
+                        help='Path of the daemon socket. Default is serve.sock in the Forge state directory.')
+    parser.add_argument('--idle_timeout', '--idle-timeout', type=positive_int_arg, dest='serve_idle_timeout',
+                        help='Stop after this many minutes without a command. Default is to never stop.')
+    parser.add_argument(
+        '--log_level', '--log-level', choices={'DEBUG', 'INFO', 'WARNING', 'ERROR'},
+        default='INFO', type=str.upper, help='Override logging level.'
+    )
+
+
+def socket_path(path=None):
+    """get the path of the daemon socket
+
+    Parameters
+    ----------
+    path : str, optional
+        An explicit path, e.g. from --socket
+
+    Returns
+    -------
+    str
+        The path, from the argument, FORGE_SOCKET, or the Forge state directory
+    """
+    return path or os.environ.get(SOCKET_ENV) or os.path.join(get_state_dir(), SOCKET_FILE)
+
+
+def _send(conn, message):
+    conn.sendall(json.dumps(message).encode() + b'\n')
+
+
+class _Reader:
+    """reads newline-delimited JSON messages from a socket"""
+
+    def __init__(self, conn, data=b''):
+        self.conn = conn
+        self.buffer = data
+
+    def read(self):
+        while b'\n' not in self.buffer:
+            data = self.conn.recv(MESSAGE_SIZE)
+            if not data:
+                return None
+            self.buffer += data
+        line, self.buffer = self.buffer.split(b'\n', 1)
+        return json.loads(line)
+
+
+def _aws_env(env):
+    return {k: v for k, v in env.items() if k.startswith('AWS_')}
+
+
+def _share_warm_state(env):
+    """whether a command with the environment env shares the AWS credentials of the daemon
+
+    Sessions, PEM keys and prices read with other credentials do not apply, so they are cleared when it does not.
+    """
+    from . import common, cost
+
+    if _aws_env(env) == _aws_env(os.environ):
+        return True
+    common.WARM_SESSIONS.clear()
+    common.PEM_KEYS.clear()
+    cost._PRICES.clear()
+    return False
+
+
+def forward_command(argv):
+    """run a command in the forge serve daemon, if one is listening
+
+    Parameters
+    ----------
+    argv : list
+        Command line arguments, without the program name
+
+    Returns
+    -------
+    int or None
+        The exit status of the command, or None if there is no daemon to run it
+    """
+    if os.environ.get(DAEMON_ENV, '1').lower() in {'0', 'false', 'no'} or not hasattr(socket, 'send_fds'):
+        return None
+
+    path = socket_path()
+    if not os.path.exists(path):
+        return None
+
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.settimeout(CONNECT_TIMEOUT)
+        conn.connect(path)
+        request = {'version': __version__, 'argv': list(argv), 'cwd': os.getcwd(), 'env': dict(os.environ)}
+        socket.send_fds(conn, [json.dumps(request).encode() + b'\n'], [0, 1, 2])
+        reader = _Reader(conn)
+        reply = reader.read()
+    except (OSError, ValueError) as e:
+        logger.debug('Not using the forge daemon at %s: %s', path, e)
+        conn.close()
+        return None
+
+    if not reply or 'pid' not in reply:
+        logger.debug('Not using the forge daemon at %s: %s', path, reply and reply.get('error'))
+        conn.close()
+        return None
+
+    def _relay(signum, frame):
+        try:
+            os.killpg(reply['pid'], signum)
+        except OSError:
+            pass
+
+    previous = {}
+    for name in FORWARDED_SIGNALS:
+        if hasattr(signal, name):
+            previous[name] = signal.signal(getattr(signal, name), _relay)
+
+    try:
+        conn.settimeout(None)
+        result = reader.read()
+    except (OSError, ValueError):
+        result = None
+    finally:
+        for name, handler in previous.items():
+            signal.signal(getattr(signal, name), handler)
+        conn.close()
+
+    return result['status'] if result else 1
+
+
+def run_forwarded(conn, request, fds, report_fd):
+    """run a forwarded command in a forked child of the daemon
+
+    Parameters
+    ----------
+    conn : socket.socket
+        The connection of the CLI
+    request : dict
+        The command line arguments, working directory and environment of the CLI
+    fds : list
+        The stdin, stdout and stderr of the CLI
+    report_fd : int
+        Pipe to send the warm state of the command back to the daemon
+
+    Returns
+    -------
+    int
+        The exit status of the command
+    """
+    import boto3
+
+    from . import common, cost
+    from .main import main
+
+    # Own session and process group, so the CLI terminal is not a controlling terminal and signals reach the command
+    os.setsid()
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+
+    stdout_streams, stderr_streams = {sys.stdout, sys.__stdout__}, {sys.stderr, sys.__stderr__}
+    for target, fd in enumerate(fds):
+        os.dup2(fd, target)
+        os.close(fd)
+    sys.stdin = open(0, 'r', closefd=False)
+    sys.stdout = open(1, 'w', buffering=1, closefd=False)
+    sys.stderr = open(2, 'w', buffering=1, closefd=False)
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, logging.StreamHandler):
+            if handler.stream in stderr_streams:
+                handler.setStream(sys.stderr)
+            elif handler.stream in stdout_streams:
+                handler.setStream(sys.stdout)
+
+    # What the command reads with its own AWS credentials is not sent back
+    shared_credentials = _share_warm_state(request['env'])
+    os.chdir(request['cwd'])
+    os.environ.clear()
+    os.environ.update(request['env'])
+
+    prices, keys = set(cost._PRICES), set(common.PEM_KEYS)
+    _send(conn, {'pid': os.getpid()})
+
+    try:
+        status = main(request['argv'])
+    except SystemExit as e:
+        if isinstance(e.code, str):
+            sys.stderr.write(f'{e.code}\n')
+        status = e.code if isinstance(e.code, int) or e.code is None else 1
+    except BaseException:  # pylint: disable=broad-except
+        traceback.print_exc()
+        status = 1
+    status = status if isinstance(status, int) else 0 if status is None else 1
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    report = {}
+    session = boto3.DEFAULT_SESSION
+    if shared_credentials:
+        report['prices'] = [[*k, v] for k, v in cost._PRICES.items() if k not in prices]
+        report['keys'] = [[*k, v] for k, v in common.PEM_KEYS.items() if k not in keys]
+        if session is not None:
+            profile = session.profile_name if session.profile_name != 'default' else None
+            if (profile, session.region_name) not in common.WARM_SESSIONS:
+                report['session'] = [profile, session.region_name]
+    with open(report_fd, 'w') as f:
+        json.dump(report, f)
+
+    _send(conn, {'status': status})
+    return status
+
+
+class ForgeServer:
+    """the forge serve daemon, which forks a child to run each command it receives
+
+    Parameters
+    ----------
+    path : str
+        Path of the Unix socket
+    idle_timeout : float, optional
+        Seconds without a command after which serve_forever returns
+    """
+
+    def __init__(self, path, idle_timeout=None):
+        self.path = path
+        self.idle_timeout = idle_timeout
+        self.sock = None
+        self.selector = selectors.DefaultSelector()
+        self.children = {}
+        self.reports = {}
+        self.price_times = {}
+        self.session_times = {}
+        self.running = False
+        self.last_active = time.monotonic()
+
+    def listen(self):
+        """bind the socket, replacing a stale one
+
+        Raises
+        ------
+        RuntimeError
+            If another daemon is listening on the socket
+        """
+        if os.path.exists(self.path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+            except OSError:
+                os.remove(self.path)
+            else:
+                raise RuntimeError(f'A forge daemon is already listening on {self.path}')
+            finally:
+                probe.close()
+
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o177)
+        try:
+            self.sock.bind(self.path)
+        finally:
+            os.umask(umask)
+        self.sock.listen()
+        self.selector.register(self.sock, selectors.EVENT_READ)
+
+    def serve_forever(self):
+        """accept commands until shutdown is called or the idle timeout passes"""
+        self.running = True
+        while self.running:
+            for key, _ in self.selector.select(POLL_INTERVAL):
+                if key.data is None:
+                    self._accept()
+                else:
+                    self._read_report(key.fd)
+            self._reap()
+            self._expire()
+
+            if self.idle_timeout and not self.children and time.monotonic() - self.last_active > self.idle_timeout:
+                logger.info('No command for %d minutes, stopping.', self.idle_timeout // 60)
+                break
+
+    def shutdown(self):
+        """make serve_forever return"""
+        self.running = False
+
+    def close(self):
+        """close and remove the socket"""
+        self.selector.close()
+        if self.sock is not None:
+            self.sock.close()
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+    def _accept(self):
+        conn, _ = self.sock.accept()
+        self.last_active = time.monotonic()
+        fds = []
+        try:
+            conn.settimeout(CONNECT_TIMEOUT)
+            data, fds, _, _ = socket.recv_fds(conn, MESSAGE_SIZE, 3)
+            request = _Reader(conn, data).read()
+            if not request or len(fds) != 3:
+                raise ValueError('incomplete request')
+            if request.get('version') != __version__:
+                _send(conn, {'error': f'forge serve runs version {__version__}'})
+                raise ValueError(f"the CLI runs version {request.get('version')}")
+            conn.settimeout(None)
+        except (OSError, ValueError) as e:
+            logger.debug('Rejected a command: %s', e)
+            for fd in fds:
+                os.close(fd)
+            conn.close()
+            return
+
+        logger.info('Running forge %s', ' '.join(request['argv']))
+        sys.stdout.flush()
+        sys.stderr.flush()
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                os.close(read_fd)
+                self.sock.close()
+                for fd in self.reports:
+                    os.close(fd)
+                status = run_forwarded(conn, request, fds, write_fd)
+            except BaseException:  # pylint: disable=broad-except
+                traceback.print_exc()
+            finally:
+                os._exit(status)
+
+        os.close(write_fd)
+        for fd in fds:
+            os.close(fd)
+        conn.close()
+        self.children[pid] = read_fd
+        self.reports[read_fd] = b''
+        self.selector.register(read_fd, selectors.EVENT_READ, pid)
+
+    def _read_report(self, fd):
+        data = os.read(fd, MESSAGE_SIZE)
+        if data:
+            self.reports[fd] += data
+            return
+
+        self.selector.unregister(fd)
+        os.close(fd)
+        data = self.reports.pop(fd)
+        try:
+            report = json.loads(data) if data else {}
+        except ValueError:
+            logger.debug('Ignoring an unreadable command report')
+            return
+        self.merge(report)
+
+    def _reap(self):
+        for pid in list(self.children):
+            try:
+                done, _ = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                done = pid
+            if done:
+                self.children.pop(pid)
+
+    def _expire(self):
+        from . import common, cost
+
+        now = time.monotonic()
+        for key in [k for k, t in self.price_times.items() if now - t > PRICE_TTL]:
+            cost._PRICES.pop(key, None)
+            self.price_times.pop(key)
+        for key in [k for k, t in self.session_times.items() if now - t > SESSION_TTL]:
+            common.WARM_SESSIONS.pop(key, None)
+            self.session_times.pop(key)
+
+    def merge(self, report):
+        """keep the warm state a command sent back
+
+        Parameters
+        ----------
+        report : dict
+            The session, prices and PEM keys the command used
+        """
+        from . import common, cost
+
+        now = time.monotonic()
+        for *key, price in report.get('prices', []):
+            cost._PRICES[tuple(key)] = price
+            self.price_times[tuple(key)] = now
+        for *key, pem in report.get('keys', []):
+            common.PEM_KEYS[tuple(key)] = pem
+        if session := report.get('session'):
+            self.warm(*session)
+
+    def warm(self, profile, region):
+        """create a session and its clients for the commands that use profile and region
+
+        Parameters
+        ----------
+        profile : str or None
+            AWS profile
+        region : str
+            AWS region
+        """
+        import boto3
+        from botocore.exceptions import BotoCoreError, ClientError
+
+        from . import common
+        from .batch import WARM_CLIENTS
+
+        try:
+            if profile:
+                session = boto3.session.Session(profile_name=profile, region_name=region)
+            else:
+                session = boto3.session.Session(region_name=region)
+            for service in WARM_CLIENTS:
+                session.client(service)
+        except (BotoCoreError, ClientError) as e:
+            logger.warning('Could not warm the session of %s in %s: %s', profile or 'default', region, e)
+            return
+
+        common.WARM_SESSIONS[(profile, region)] = session
+        self.session_times[(profile, region)] = time.monotonic()
+        logger.info('Warmed the session of %s in %s', profile or 'default', region)
+
+
+def serve(args):
+    """run the forge serve daemon until it is stopped
+
+    Parameters
+    ----------
+    args : dict
+        Parsed serve arguments
+
+    Returns
+    -------
+    int
+        0 when the daemon stopped
+    """
+    if not hasattr(os, 'fork') or not hasattr(socket, 'send_fds'):
+        logger.error('forge serve needs fork and Unix sockets, which this platform does not have.')
+        return 1
+
+    from .main import SUBCOMMANDS, load_subcommand
+
+    idle_timeout = args.get('serve_idle_timeout')
+    server = ForgeServer(socket_path(args.get('serve_socket')), idle_timeout and idle_timeout * 60)
+    try:
+        server.listen()
+    except (OSError, RuntimeError) as e:
+        logger.error('Could not listen on %s: %s', server.path, e)
+        return 1
+
+    for job in SUBCOMMANDS:
+        if job != 'serve':
+            load_subcommand(job)
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: server.shutdown())
+    logger.info('Listening on %s', server.path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+    logger.info('Stopped.')
+    return 0
@@ -11,6 +11,10 @@ from .configuration import Configuration
 
 logger = logging.getLogger(__name__)
 
+REQUIRED_ARGS['ssh'] = ['name',
+                        'service',
+                        'forge_env']
+
 
 def cli_ssh(subparsers):
     """adds ssh parser to subparser
@@ -27,10 +31,6 @@ def cli_ssh(subparsers):
     add_action_args(parser, suppress=True)
     add_env_args(parser)
 
-    REQUIRED_ARGS['ssh'] = ['name',
-                            'service',
-                            'forge_env']
-
 
 def ssh(config: Configuration):
     """ssh into a running EC2 instance
@@ -1,16 +1,21 @@
 """Start a previously stopped EC2 on-demand instance."""
 import logging
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
 import boto3
 
-from . import REQUIRED_ARGS
-from .parser import add_basic_args, add_general_args, add_env_args, add_job_args, add_action_args
-from .common import ec2_ip, get_ip, get_nlist
+from . import DEFAULT_ARG_VALS, REQUIRED_ARGS
+from .parser import add_basic_args, add_general_args, add_env_args, add_job_args, add_action_args, positive_int_arg
+from .common import change_state, ec2_ip, get_ip, get_nlist, wait_for_state
 from .configuration import Configuration
 
 logger = logging.getLogger(__name__)
 
+REQUIRED_ARGS['start'] = ['name',
+                          'service',
+                          'forge_env']
+
 
 def cli_start(subparsers):
     """adds start parser to subparser
@@ -31,40 +36,69 @@ def cli_start(subparsers):
     add_action_args(parser, suppress=True)
     add_env_args(parser)
 
-    REQUIRED_ARGS['start'] = ['name',
-                              'service',
-                              'forge_env']
+    parser.add_argument('--wait', action='store_true', dest='start_wait', default=None,
+                        help='Wait until all instances are running.')
+    parser.add_argument('--wait_timeout', '--wait-timeout', type=positive_int_arg,
+                        help='Give up waiting after this many seconds. Default is 600.')
 
 
 def start_fleet(n_list, config: Configuration):
     """starts each fleet in n_list
 
+    All instances are started in batched requests. With start_wait, or hibernate, waits until they are running and,
+    after hibernation, until their memory is restored and they pass their status checks.
+
     Parameters
     ----------
     n_list : list
         List of fleet names
     config : Configuration
         Forge configuration data
+
+    Returns
+    -------
+    int
+        0 if all start requests were accepted, and with start_wait, all instances are running
     """
-    client = boto3.client('ec2')
+    client = (config.aws_session or boto3).client('ec2')
 
-    details = {n: ec2_ip(n, config) for n in n_list}
+    with ThreadPoolExecutor(max_workers=max(len(n_list), 1)) as executor:
+        details = dict(zip(n_list, executor.map(lambda n: ec2_ip(n, config, client), n_list)))
     targets = {k: get_ip(v, ('stopped', 'stopping')) for k, v in details.items()}
     if not targets:
         logger.error('Could not find any valid instances to start.')
         sys.exit(1)
 
+    logger.debug('Instance target details are %s', targets)
+    ec2_ids = []
     for k, v in targets.items():
         if not v:
             logger.error('Could not find any valid instances to start for %s', k)
             continue
 
-        logger.debug('Instance target details are %s', targets)
         logger.info(f'{k} fleet is now starting.')
+        ec2_ids += [uid for _, uid in v]
+
+    failed = change_state(client, 'start_instances', ec2_ids)
+    if not config.start_wait and not config.hibernate:
+        return 1 if failed else 0
 
-        for ec2 in v:
-            _, uid = ec2
-            client.start_instances(InstanceIds=[uid])
+    timeout = config.wait_timeout or DEFAULT_ARG_VALS['state_timeout']
+    logger.info('Waiting for %d instance(s) to be running...', len(ec2_ids) - len(failed))
+    details, stragglers = wait_for_state(client, [e for e in ec2_ids if e not in failed], 'running', timeout,
+                                         status_ok=bool(config.hibernate))
+
+    fleet_of = {uid: k for k, v in targets.items() for _, uid in v}
+    for ec2 in details:
+        if ec2['state'] == 'running':
+            logger.info('%s instance %s is running at %s', fleet_of.get(ec2['id']), ec2['id'], ec2['ip'])
+
+    for ec2 in stragglers:
+        logger.error('Instance %s (%s) is still %s.', ec2['id'], ec2['ip'], ec2['state'])
+    if not stragglers:
+        logger.info('All instances are running.')
+
+    return 1 if failed or stragglers else 0
 
 
 def start(config: Configuration):
@@ -74,6 +108,11 @@ def start(config: Configuration):
     ----------
     config : Configuration
         Forge configuration data
+
+    Returns
+    -------
+    int
+        The status of start_fleet
     """
     market = config.market
 
@@ -84,4 +123,4 @@ def start(config: Configuration):
     config.rr_all = True
 
     n_list = get_nlist(config)
-    start_fleet(n_list, config)
+    return start_fleet(n_list, config)
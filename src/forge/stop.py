@@ -1,16 +1,21 @@
 """Stop a running on-demand EC2 instance."""
 import logging
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
 import boto3
 
-from . import REQUIRED_ARGS
-from .parser import add_basic_args, add_general_args, add_env_args, add_job_args, add_action_args
-from .common import ec2_ip, get_ip, get_nlist
+from . import DEFAULT_ARG_VALS, REQUIRED_ARGS
+from .parser import add_basic_args, add_general_args, add_env_args, add_job_args, add_action_args, positive_int_arg
+from .common import change_state, ec2_ip, get_ip, get_nlist, wait_for_state
 from .configuration import Configuration
 
 logger = logging.getLogger(__name__)
 
+REQUIRED_ARGS['stop'] = ['name',
+                         'service',
+                         'forge_env']
+
 
 def cli_stop(subparsers):
     """adds stop parser to subparser
@@ -27,39 +32,69 @@ def cli_stop(subparsers):
     add_action_args(parser, suppress=True)
     add_env_args(parser)
 
-    REQUIRED_ARGS['stop'] = ['name',
-                             'service',
-                             'forge_env']
+    parser.add_argument('--wait', action='store_true', dest='stop_wait', default=None,
+                        help='Wait until all instances are stopped.')
+    parser.add_argument('--wait_timeout', '--wait-timeout', type=positive_int_arg,
+                        help='Give up waiting after this many seconds. Default is 600.')
 
 
 def stop_fleet(n_list, config: Configuration):
     """stops each fleet in n_list
 
+    All instances are stopped in batched requests, and hibernated if hibernate is set. With stop_wait, waits until
+    they are stopped.
+
     Parameters
     ----------
     n_list : list
         List of fleet names
     config : Configuration
         Forge configuration data
+
+    Returns
+    -------
+    int
+        0 if all stop requests were accepted, and with stop_wait, all instances are stopped
     """
-    client = boto3.client('ec2')
+    client = (config.aws_session or boto3).client('ec2')
 
-    details = {n: ec2_ip(n, config) for n in n_list}
+    with ThreadPoolExecutor(max_workers=max(len(n_list), 1)) as executor:
+        details = dict(zip(n_list, executor.map(lambda n: ec2_ip(n, config, client), n_list)))
     targets = {k: get_ip(v, ('running', 'pending')) for k, v in details.items()}
     if not targets:
         logger.error('Could not find any valid instances to stop.')
         sys.exit(1)
 
+    logger.debug('Instance target details are %s', targets)
+    ec2_ids = []
     for k, v in targets.items():
         if not v:
             logger.error('Could not find any valid instances to stop for %s', k)
             continue
 
-        logger.debug('Instance target details are %s', targets)
         logger.info(f'{k} fleet is now stopping.')
-        for ec2 in v:
-            _, uid = ec2
-            client.stop_instances(InstanceIds=[uid])
+        ec2_ids += [uid for _, uid in v]
+
+    if config.hibernate:
+        failed = change_state(client, 'stop_instances', ec2_ids, Hibernate=True)
+        if failed:
+            logger.warning('Could not hibernate %s, stopping them instead.', ', '.join(failed))
+            failed = change_state(client, 'stop_instances', failed)
+    else:
+        failed = change_state(client, 'stop_instances', ec2_ids)
+    if not config.stop_wait:
+        return 1 if failed else 0
+
+    timeout = config.wait_timeout or DEFAULT_ARG_VALS['state_timeout']
+    logger.info('Waiting for %d instance(s) to be stopped...', len(ec2_ids) - len(failed))
+    details, stragglers = wait_for_state(client, [e for e in ec2_ids if e not in failed], 'stopped', timeout)
+
+    for ec2 in stragglers:
+        logger.error('Instance %s (%s) is still %s.', ec2['id'], ec2['ip'], ec2['state'])
+    if not stragglers:
+        logger.info('All instances are stopped.')
+
+    return 1 if failed or stragglers else 0
 
 
 def stop(config: Configuration):
@@ -69,6 +104,11 @@ def stop(config: Configuration):
     ----------
     config : Configuration
         Forge configuration data
+
+    Returns
+    -------
+    int
+        The status of stop_fleet
     """
     market = config.market
 
@@ -79,4 +119,4 @@ def stop(config: Configuration):
     config.rr_all = True
 
     n_list = get_nlist(config)
-    stop_fleet(n_list, config)
+    return stop_fleet(n_list, config)
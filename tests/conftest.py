@@ -0,0 +1,9 @@
+"""Shared fixtures for the Forge tests."""
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def state_dir(tmp_path, monkeypatch):
+    """Keep the ledger, config cache, and other Forge state of each test in its own directory."""
+    monkeypatch.setenv('FORGE_STATE_DIR', str(tmp_path / 'forge-state'))
+    return tmp_path / 'forge-state'
@@ -0,0 +1,152 @@
+"""Tests for the Python API of Forge."""
+import logging
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+import boto3
+import pytest
+
+from forge import api, common
+from forge.configuration import Configuration
+from forge.exceptions import ConfigurationError, JobError
+
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+NOW = datetime.now(timezone.utc)
+DETAIL = {'id': 'i-1', 'ip': '10.0.0.1', 'state': 'running', 'instance_type': 'r5.large', 'az': 'us-east-1a',
+          'launch_time': NOW - timedelta(hours=2), 'fleet_id': ['fleet-1']}
+FLEET = 'test-spot-single-'
+
+
+@pytest.fixture
+def config():
+    """A single job config with valid AWS credentials."""
+    with mock.patch('forge.api.SharedClientSession'), \
+            mock.patch('forge.configuration.Configuration.validate_aws_permissions', return_value=True):
+        yield Configuration(region='us-east-1', ec2_amis={}, ec2_key='', forge_env='dev', forge_pem_secret='',
+                            job='engine', name='test', service='single', aws_role='role', run_cmd='run.sh',
+                            market=['spot'], destroy_after_success=False)
+
+
+def _create(config):
+    config.job_context.set_fleet(FLEET, [DETAIL])
+
+
+@mock.patch('forge.api.create_job.create', side_effect=_create)
+def test_create(mock_create, config):
+    """Test that create returns the fleets and IPs it created."""
+    result = api.create(config)
+
+    assert result.ips == ['10.0.0.1']
+    assert result.fleets[0].name == FLEET
+    assert result.fleets[0].fleet_ids == ['fleet-1']
+    assert result.fleets[0].instances[0].instance_type == 'r5.large'
+
+
+@mock.patch('forge.api.create_job.create')
+def test_create_exit(mock_create, config):
+    """Test that an exit of create is raised as a JobError with the logged error."""
+    def _exit(config):
+        logging.getLogger('forge.create').error('No capacity')
+        sys.exit(1)
+    mock_create.side_effect = _exit
+
+    with pytest.raises(JobError) as e:
+        api.create(config)
+
+    assert (e.value.job, e.value.status, str(e.value)) == ('create', 1, 'No capacity')
+
+
+def test_missing_options(config):
+    """Test that a job without its required options is not started."""
+    config.run_cmd = None
+    with pytest.raises(ConfigurationError, match='run_cmd'):
+        api.run(config)
+
+
+@mock.patch('forge.api.destroy_with_cost', return_value=(0, None))
+@mock.patch('forge.api.run_job.run', return_value=2)
+def test_run_check(mock_run, mock_destroy, config):
+    """Test that a failed command raises unless check is off, and is not destroyed after."""
+    config.job_context = api.JobContext()
+    config.job_context.set_fleet(FLEET, [DETAIL])
+    config.destroy_after_success = True
+
+    with pytest.raises(JobError) as e:
+        api.run(config)
+    assert e.value.result.status == 2
+
+    result = api.run(config, check=False)
+    assert result.status == 2
+    assert result.fleets[0].ips == ['10.0.0.1']
+    mock_destroy.assert_not_called()
+
+
+@mock.patch('forge.cost.get_price', return_value=1.5)
+@mock.patch('forge.destroy.boto3')
+@mock.patch('forge.destroy.fleet_destroy', return_value=0)
+def test_destroy(mock_fleet_destroy, mock_boto, mock_price, config):
+    """Test that destroy returns the cost of the running instances, priced once."""
+    config.job_context = api.JobContext()
+    config.job_context.set_fleet(FLEET, [DETAIL])
+
+    result = api.destroy(config)
+
+    mock_fleet_destroy.assert_called_once_with({FLEET: ['fleet-1']}, config)
+    assert mock_price.call_count == 2  # The spot and on-demand prices of the instance
+    assert result.fleets[0].ips == ['10.0.0.1']
+    assert result.cost == pytest.approx(3, rel=0.01)
+    assert result.hours == pytest.approx(2, rel=0.01)
+
+
+def test_load_config_missing(tmp_path):
+    """Test that a missing user YAML raises a ConfigurationError."""
+    with pytest.raises(ConfigurationError, match='not found'):
+        api.load_config(yaml=str(tmp_path / 'missing.yaml'), forge_env='dev')
+
+
+@mock.patch('forge.api.ec2_ip', return_value=[DETAIL])
+@mock.patch('forge.engine.run', return_value=0)
+@mock.patch('forge.engine.find_and_destroy')
+@mock.patch('forge.engine.failed_fleets', return_value=['test-single-basic-spot-single-'])
+@mock.patch('forge.engine.provision')
+@mock.patch('forge.api.SharedClientSession')
+@mock.patch('forge.configuration.Configuration.validate_aws_permissions', return_value=True)
+def test_engine_retry(mock_validate, mock_session, mock_provision, mock_failed_fleets, mock_find_and_destroy,
+                      mock_run, mock_ec2_ip):
+    """Test that a config from load_config is retried by engine like the CLI does."""
+    attempts = iter([True, False])
+    mock_provision.side_effect = lambda config: next(attempts) and common.exit_callback(config, exit=True)
+
+    config = api.load_config(yaml=os.path.join(TEST_DIR, 'data', 'single_basic.yaml'), forge_env='dev',
+                             config_dir=os.path.join(TEST_DIR, 'data', 'admin_configs'), rsync_path='app',
+                             spot_retries=1, destroy_after_success=False)
+    result = api.engine(config)
+
+    assert result.status == 0
+    assert mock_provision.call_count == 2
+    mock_find_and_destroy.assert_called_once_with('test-single-basic-spot-single-', config)
+
+
+@mock.patch('forge.configuration.Configuration.validate_aws_permissions', return_value=True)
+def test_prepare_session(mock_validate):
+    """Test that each job gets its own session instead of replacing the default session."""
+    default = boto3.DEFAULT_SESSION
+    configs = [Configuration(region=region, ec2_amis={}, ec2_key='', forge_env='dev', forge_pem_secret='', name='test',
+                             service='single', aws_role='role') for region in ('us-east-1', 'us-west-2')]
+
+    for config in configs:
+        api._prepare('destroy', config)
+    session = configs[0].aws_session
+    api._prepare('destroy', configs[0])
+
+    assert configs[0].aws_session is session
+    assert [c.aws_session.region_name for c in configs] == ['us-east-1', 'us-west-2']
+    assert boto3.DEFAULT_SESSION is default
+
+    with mock.patch('forge.common.describe_ec2s', return_value=[]):
+        configs[1].aws_session = mock.Mock()
+        configs[1].aws_session.client.return_value.describe_tags.return_value = {'Tags': []}
+        common.ec2_ip('fleet', configs[1])
+    configs[1].aws_session.client.assert_called_once_with('ec2')
@@ -0,0 +1,94 @@
+"""Tests for the batch module of Forge."""
+import json
+import logging
+import os
+from unittest import mock
+
+import pytest
+import yaml
+
+from forge import batch
+
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+CONFIG_DIR = os.path.join(TEST_DIR, 'data', 'admin_configs')
+
+
+def _jobs_file(tmp_path, spec):
+    path = tmp_path / 'jobs.yaml'
+    path.write_text(yaml.safe_dump(spec))
+    return str(path)
+
+
+def test_load_jobs(tmp_path):
+    """Test that defaults are applied and job yaml paths are relative to the jobs file."""
+    path = _jobs_file(tmp_path, {
+        'concurrency': 2,
+        'defaults': {'forge_env': 'dev', 'service': 'single'},
+        'jobs': [{'name': 'a', 'yaml': 'a.yaml'}, {'name': 'b', 'service': 'cluster'}],
+    })
+
+    jobs, concurrency = batch.load_jobs(path, {'forge_env': 'prod', 'config_dir': '/etc/forge'})
+
+    assert concurrency == 2
+    assert jobs == [
+        {'forge_env': 'dev', 'config_dir': '/etc/forge', 'service': 'single', 'name': 'a',
+         'yaml': str(tmp_path / 'a.yaml'), 'job': 'engine'},
+        {'forge_env': 'dev', 'config_dir': '/etc/forge', 'service': 'cluster', 'name': 'b', 'job': 'engine'},
+    ]
+    assert batch.load_jobs(_jobs_file(tmp_path, [{'name': 'c'}]))[0] == [{'name': 'c', 'job': 'engine'}]
+
+    with pytest.raises(ValueError):
+        batch.load_jobs(_jobs_file(tmp_path, {'jobs': 'a'}))
+
+
+@mock.patch('forge.batch.execute')
+@mock.patch('forge.configuration.Configuration.validate_aws_permissions', return_value=True)
+@mock.patch('forge.batch.SharedClientSession')
+def test_batch(mock_session, mock_validate, mock_execute, tmp_path, capsys, caplog):
+    """Test that every job runs once, failures do not stop the others, and a summary is written."""
+    caplog.set_level(logging.INFO)
+    jobs = [{'name': f'job-{i}', 'yaml': os.path.join(TEST_DIR, 'data', 'single_basic.yaml')} for i in range(5)]
+    path = _jobs_file(tmp_path, {'defaults': {'forge_env': 'dev', 'config_dir': CONFIG_DIR}, 'jobs': jobs})
+
+    def execute(config):
+        if config.name == 'job-3':
+            raise SystemExit(2)
+        return 0
+
+    mock_execute.side_effect = execute
+    summary = tmp_path / 'summary.json'
+
+    status = batch.batch({'jobs_file': path, 'batch_concurrency': 3, 'batch_summary': str(summary)})
+
+    assert status == 1
+    assert sorted(c.args[0].name for c in mock_execute.call_args_list) == [f'job-{i}' for i in range(5)]
+    assert {c.args[0].job for c in mock_execute.call_args_list} == {'engine'}
+    mock_validate.assert_called_once()
+    mock_session.assert_called_once_with(profile_name='data-dev', region_name='us-east-1')
+    assert all(c.args[0].aws_session is mock_session.return_value for c in mock_execute.call_args_list)
+    assert [c.args[0] for c in mock_session.return_value.client.call_args_list] == list(batch.WARM_CLIENTS)
+    assert all(c.args[0].run_prefix_output for c in mock_execute.call_args_list)
+
+    result = json.loads(summary.read_text())
+    assert (result['succeeded'], result['failed']) == (4, 1)
+    assert [j['status'] for j in result['jobs']] == [0, 0, 0, 2, 0]
+    assert 'failed (2)' in capsys.readouterr().out
+    assert '4 of 5 job(s) succeeded.' in caplog.text
+
+
+@mock.patch('forge.batch.execute')
+@mock.patch('forge.configuration.Configuration.validate_aws_permissions', return_value=True)
+def test_batch_invalid_job(mock_validate, mock_execute, tmp_path, caplog):
+    """Test that no job starts if one of them is invalid or names repeat."""
+    basic = os.path.join(TEST_DIR, 'data', 'single_basic.yaml')
+    defaults = {'forge_env': 'dev', 'config_dir': CONFIG_DIR}
+
+    path = _jobs_file(tmp_path, {'defaults': defaults, 'jobs': [{'yaml': basic}, {'name': 'x', 'service': 'single'}]})
+    assert batch.batch({'jobs_file': path}) == 1
+
+    path = _jobs_file(tmp_path, {'defaults': defaults, 'jobs': [{'yaml': basic}, {'yaml': basic}]})
+    assert batch.batch({'jobs_file': path}) == 1
+    assert 'Job names must be unique, found test-single-basic more than once' in caplog.text
+
+    mock_execute.assert_not_called()
+    mock_validate.assert_not_called()
@@ -0,0 +1,154 @@
+"""Tests for the config cache of Forge."""
+import copy
+import json
+import logging
+import os
+import shutil
+from unittest import mock
+
+import pytest
+
+from forge import DEFAULT_ARG_VALS, cache
+from forge.configuration import Configuration
+
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+
+
+@pytest.fixture
+def configs(tmp_path):
+    """Copy the user and admin configs so the tests can change them."""
+    shutil.copy(os.path.join(TEST_DIR, 'data', 'single_basic.yaml'), tmp_path / 'single.yaml')
+    shutil.copytree(os.path.join(TEST_DIR, 'data', 'admin_configs'), tmp_path / 'admin_configs')
+    return {'yaml': str(tmp_path / 'single.yaml'), 'config_dir': str(tmp_path / 'admin_configs'),
+            'forge_env': 'dev', 'job': 'destroy', 'log_level': None}
+
+
+def test_load_config_cached(configs, caplog):
+    """Test that a repeat load skips the YAML parsing and logs the same messages."""
+    caplog.set_level(logging.INFO)
+    first = Configuration.load_config(dict(configs))
+    first_logs = caplog.record_tuples
+    caplog.clear()
+
+    with mock.patch('forge.configuration.yaml.load') as mock_load:
+        second = Configuration.load_config(dict(configs))
+
+    mock_load.assert_not_called()
+    assert second == first
+    assert caplog.record_tuples == first_logs
+
+
+@pytest.mark.parametrize('changed', ['yaml', 'env'])
+def test_load_config_changed(configs, changed):
+    """Test that changing the user or environment YAML invalidates the cached config."""
+    Configuration.load_config(dict(configs))
+
+    path = configs['yaml'] if changed == 'yaml' else os.path.join(configs['config_dir'], 'dev', 'dev.yaml')
+    with open(path, 'a') as f:
+        f.write('\nec2_max: 512\n' if changed == 'env' else '\nworkers: 3\n')
+
+    config = Configuration.load_config(dict(configs))
+    assert (config.workers if changed == 'yaml' else config.ec2_max) == (3 if changed == 'yaml' else 512)
+
+
+def test_load_config_cli_changed(configs):
+    """Test that different CLI arguments use different cache entries."""
+    Configuration.load_config(dict(configs))
+    config = Configuration.load_config({**configs, 'market': 'on-demand'})
+    assert config.market == ['on-demand']
+
+
+
+def test_load_config_job_scoped(configs):
+    """Test that loading a config keeps its environment defaults to itself."""
+    defaults = copy.deepcopy(DEFAULT_ARG_VALS)
+    with open(os.path.join(configs['config_dir'], 'dev', 'dev.yaml'), 'a') as f:
+        f.write('\nec2_max: 512\ndefault_ratio: [4, 4]\n')
+
+    config = Configuration.load_config(dict(configs))
+    assert (config.ec2_max, config.default_ratio) == (512, [4, 4])
+    assert DEFAULT_ARG_VALS == defaults
+
+    config.market[0] = 'on-demand'
+    second = Configuration.load_config(dict(configs))
+    assert second.market == DEFAULT_ARG_VALS['market'] == defaults['market']
+
+def test_load_config_cache_disabled(configs, monkeypatch):
+    """Test that the cache can be turned off."""
+    monkeypatch.setenv(cache.CONFIG_CACHE_ENV, '0')
+    Configuration.load_config(dict(configs))
+
+    with mock.patch('forge.configuration.yaml.load', side_effect=RuntimeError('parsed')):
+        with pytest.raises(RuntimeError):
+            Configuration.load_config(dict(configs))
+
+
+def test_config_cache_json(tmp_path):
+    """Test that cache entries are stored as JSON and entries JSON cannot store as they are are skipped."""
+    cache.write_config_cache('abc', {'inputs': [], 'logs': [[20, 'msg']], 'config': {'ram': [[64, 512]]}})
+    with open(os.path.join(cache.get_state_dir(cache.CONFIG_CACHE_DIR), 'abc.json')) as f:
+        assert json.load(f)['config'] == {'ram': [[64, 512]]}
+    assert cache.read_config_cache('abc')['logs'] == [[20, 'msg']]
+
+    cache.write_config_cache('tuple', {'inputs': [], 'logs': [], 'config': {'ram': (64, 512)}})
+    assert cache.read_config_cache('tuple') is None
+
+
+def test_unchanged_touched_file(tmp_path):
+    """Test that a file that was only touched still matches its fingerprint."""
+    path = tmp_path / 'env.yaml'
+    path.write_text('region: us-east-1\n')
+    fingerprint = cache.file_fingerprint(str(path))
+
+    os.utime(path, ns=(fingerprint['mtime_ns'] + 10**9, fingerprint['mtime_ns'] + 10**9))
+    assert cache._unchanged(fingerprint)
+
+    path.write_text('region: us-west-2\n')
+    assert not cache._unchanged(fingerprint)
+    assert cache.file_fingerprint(str(tmp_path / 'missing.yaml')) is None
+
+
+def _validate():
+    config = Configuration(region='us-east-1', ec2_amis={}, ec2_key='', forge_env='dev', forge_pem_secret='',
+                           job='ssh', aws_profile='dev')
+    return config.validate_aws_permissions()
+
+
+@mock.patch('forge.configuration.boto3.session.Session')
+def test_validate_aws_permissions_cached(mock_session, monkeypatch):
+    """Test that STS is only called again for other credentials or once the TTL is over."""
+    session = mock_session.return_value
+    session.get_credentials.return_value.get_frozen_credentials.return_value = mock.Mock(
+        access_key='AKIA1', secret_key='secret', token=None)
+    sts = session.client.return_value
+    sts.get_caller_identity.return_value = {'Account': '123456789012', 'Arn': 'arn:aws:iam::123456789012:user/me'}
+
+    assert _validate()
+    assert _validate()
+    assert sts.get_caller_identity.call_count == 1
+
+    session.get_credentials.return_value.get_frozen_credentials.return_value = mock.Mock(
+        access_key='AKIA2', secret_key='secret', token=None)
+    assert _validate()
+    assert sts.get_caller_identity.call_count == 2
+
+    monkeypatch.setenv(cache.IDENTITY_CACHE_TTL_ENV, '0')
+    assert _validate()
+    assert sts.get_caller_identity.call_count == 3
+
+
+def test_cached_identity_ttl():
+    """Test that cached identities expire after the TTL."""
+    cache.cache_identity('abc', {'Account': '1', 'Arn': 'arn'}, now=1000)
+    assert cache.cached_identity('abc', now=1000 + cache.IDENTITY_CACHE_TTL - 1)['account'] == '1'
+    assert cache.cached_identity('abc', now=1000 + cache.IDENTITY_CACHE_TTL) is None
+    assert cache.cached_identity('other', now=1000) is None
+
+
+@mock.patch('forge.configuration.boto3.session.Session')
+def test_validate_aws_permissions_no_credentials(mock_session, caplog):
+    """Test that missing credentials fail without calling STS."""
+    mock_session.return_value.get_credentials.return_value = None
+    assert not _validate()
+    mock_session.return_value.client.assert_not_called()
+    assert 'Missing AWS credentials to run Forge' in caplog.text
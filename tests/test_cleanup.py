@@ -0,0 +1,217 @@
+"""Tests for the cleanup module of Forge."""
+import logging
+from datetime import datetime, timedelta, timezone
+from fnmatch import fnmatchcase
+from unittest import mock
+
+import pytest
+from botocore.exceptions import ClientError
+
+from forge import cleanup
+from forge.configuration import Configuration
+
+
+BASE_CONFIG = {
+    'region': 'us-east-1',
+    'ec2_amis': {},
+    'ec2_key': '',
+    'forge_env': 'dev',
+    'forge_pem_secret': '',
+    'job': 'cleanup'
+}
+
+NOW = datetime(2024, 3, 15, 10, 30, 0, tzinfo=timezone.utc)
+
+
+@pytest.mark.parametrize('valid_until,match', [
+    ('2019-12-31T23:59:59Z', True),
+    ('2024-02-29T23:00:00Z', True),
+    ('2024-03-14T12:00:00Z', True),
+    ('2024-03-15T09:59:59Z', True),
+    ('2024-03-15T10:45:00Z', True),  # Same hour, checked locally
+    ('2024-03-15T11:00:00Z', False),
+    ('2024-03-16T00:00:00Z', False),
+    ('2025-01-01T00:00:00Z', False),
+])
+def test_expired_patterns(valid_until, match):
+    """Test that the server-side filter matches every past time and no later hour."""
+    patterns = cleanup.expired_patterns(NOW)
+    assert any(fnmatchcase(valid_until, p) for p in patterns) is match
+    assert len(patterns) <= 200
+
+
+def _template(i, valid_until):
+    return {'LaunchTemplateName': f'template-{i}', 'LaunchTemplateId': f'lt-{i}',
+            'Tags': [{'Key': 'valid_until', 'Value': valid_until}]}
+
+
+def _paginators(client, pages):
+    """Return the given pages from the paginator of each operation."""
+    paginators = {}
+
+    def get_paginator(operation):
+        paginator = paginators.setdefault(operation, mock.Mock())
+        paginator.paginate.return_value = pages.get(operation, [])
+        return paginator
+
+    client.get_paginator.side_effect = get_paginator
+    return paginators
+
+
+@mock.patch('forge.cleanup.datetime')
+@mock.patch('forge.cleanup.boto3')
+@pytest.mark.parametrize('dry_run', [None, True])
+def test_cleanup(mock_boto, mock_dt, dry_run, caplog):
+    """Test that only expired templates are deleted, unless it is a dry run."""
+    caplog.set_level(logging.INFO)
+    mock_dt.now.return_value = NOW
+    mock_dt.strptime.side_effect = datetime.strptime
+    client = mock_boto.client.return_value
+    paginators = _paginators(client, {'describe_launch_templates': [
+        {'LaunchTemplates': [_template(1, '2024-01-01T00:00:00Z'), _template(2, '2024-03-15T10:45:00Z')]},
+        {'LaunchTemplates': [_template(3, '2023-05-01T00:00:00Z')]},
+    ]})
+
+    config = Configuration(**{**BASE_CONFIG, 'dry_run': dry_run})
+    assert cleanup.cleanup(config) == 0
+
+    filters = paginators['describe_launch_templates'].paginate.call_args_list[0].kwargs['Filters']
+    assert filters[0]['Name'] == 'tag:valid_until'
+    client.delete_fleets.assert_not_called()
+    client.terminate_instances.assert_not_called()
+    if dry_run:
+        client.delete_launch_template.assert_not_called()
+        assert 'Dry run: 2 expired template(s), 0 orphaned fleet(s) and 0 orphaned instance(s)' in caplog.text
+    else:
+        assert sorted(c.kwargs['LaunchTemplateId'] for c in client.delete_launch_template.call_args_list) == [
+            'lt-1', 'lt-3'
+        ]
+
+
+def _fleet(i, template, state='active', age=120):
+    return {'FleetId': f'fleet-{i}', 'FleetState': state, 'CreateTime': NOW - timedelta(minutes=age),
+            'Tags': [{'Key': 'forge-name', 'Value': f'job-{i}'}],
+            'LaunchTemplateConfigs': [{'LaunchTemplateSpecification': {'LaunchTemplateName': template}}]}
+
+
+def _instance(i, fleet_id=None, age=120):
+    tags = [{'Key': 'forge-name', 'Value': f'job-{i}'}]
+    if fleet_id:
+        tags.append({'Key': 'aws:ec2:fleet-id', 'Value': fleet_id})
+    return {'InstanceId': f'i-{i}', 'LaunchTime': NOW - timedelta(minutes=age), 'Tags': tags}
+
+
+def test_find_orphans():
+    """Test that fleets with missing or expired templates and instances without a live fleet are orphans."""
+    client = mock.Mock()
+    _paginators(client, {
+        'describe_fleets': [{'Fleets': [
+            _fleet(1, 'live'),
+            _fleet(2, 'expired'),
+            _fleet(3, 'missing'),
+            _fleet(4, 'missing', age=30),  # Within the grace period
+            _fleet(5, 'missing', state='deleted_running'),
+            {'FleetId': 'fleet-6', 'FleetState': 'active', 'Tags': []},  # Not created by Forge
+        ]}],
+        'describe_launch_templates': [{'LaunchTemplates': [
+            {'LaunchTemplateName': 'live', 'Tags': [{'Key': 'valid_until', 'Value': '2024-03-15T12:00:00Z'}]},
+            {'LaunchTemplateName': 'expired', 'Tags': [{'Key': 'valid_until', 'Value': '2024-03-15T10:00:00Z'}]},
+        ]}],
+        'describe_instances': [{'Reservations': [{'Instances': [
+            _instance(1, 'fleet-1'),
+            _instance(2, 'fleet-2'),  # Terminated with its fleet
+            _instance(4, 'fleet-4'),
+            _instance(5, 'fleet-5'),
+            _instance(6, 'fleet-9'),  # Fleet no longer exists
+            _instance(7),  # Launched by hand, not by a fleet
+            _instance(8, age=10),  # Within the grace period
+        ]}]}],
+    })
+
+    fleets, instances = cleanup.find_orphans(client, NOW, timedelta(minutes=60))
+
+    assert [f['id'] for f in fleets] == ['fleet-2', 'fleet-3']
+    assert instances == [('i-5', 'job-5'), ('i-6', 'job-6')]
+
+
+def test_sweep_orphans():
+    """Test that orphans are removed in batches and failures are counted."""
+    client = mock.Mock()
+    client.delete_fleets.return_value = {
+        'SuccessfulFleetDeletions': [{'FleetId': f'fleet-{i}'} for i in range(29)],
+        'UnsuccessfulFleetDeletions': [{'FleetId': 'fleet-29', 'Error': {'Message': 'nope'}}],
+    }
+    client.terminate_instances.side_effect = [None, ClientError({'Error': {'Code': 'Oops'}}, 'TerminateInstances')]
+    fleets = [{'id': f'fleet-{i}'} for i in range(30)]
+    instances = [(f'i-{i}', 'job') for i in range(150)]
+
+    assert cleanup.sweep_orphans(client, fleets, instances) == 52
+
+    assert [len(c.kwargs['FleetIds']) for c in client.delete_fleets.call_args_list] == [25, 5]
+    assert all(c.kwargs['TerminateInstances'] for c in client.delete_fleets.call_args_list)
+    assert [len(c.kwargs['InstanceIds']) for c in client.terminate_instances.call_args_list] == [100, 50]
+
+
+def test_delete_template_errors():
+    """Test that missing templates count as deleted and other errors as failures."""
+    client = mock.Mock()
+    client.delete_launch_template.side_effect = [
+        ClientError({'Error': {'Code': 'InvalidLaunchTemplateId.NotFound'}}, 'DeleteLaunchTemplate'),
+        ClientError({'Error': {'Code': 'UnauthorizedOperation'}}, 'DeleteLaunchTemplate'),
+    ]
+    assert cleanup.delete_template(client, 'template-1', 'lt-1')
+    assert not cleanup.delete_template(client, 'template-2', 'lt-2')
+
+
+def test_created_patterns():
+    """Test that the create-time filter covers every hour from the last scan to now."""
+    patterns = cleanup.created_patterns(datetime(2024, 3, 15, 8, 55, tzinfo=timezone.utc), NOW)
+    assert patterns == ['2024-03-15T08:*', '2024-03-15T09:*', '2024-03-15T10:*']
+    assert fnmatchcase('2024-03-15T10:29:59.000Z', patterns[-1])
+
+
+def test_template_index():
+    """Test that the index only lists new templates between full scans and forgets deleted ones."""
+    client = mock.Mock()
+    pages = {'describe_launch_templates': [
+        {'LaunchTemplates': [_template(1, '2024-03-15T09:00:00Z'), _template(2, '2024-03-16T00:00:00Z')]},
+    ]}
+    paginators = _paginators(client, pages)
+    index = cleanup.TemplateIndex()
+
+    index.refresh(client, NOW)
+    assert [t[1] for t in index.expired(NOW)] == ['lt-1']
+    index.discard('lt-1')
+
+    pages['describe_launch_templates'] = [
+        {'LaunchTemplates': [_template(3, '2024-03-15T10:00:00Z')]}
+    ]
+    later = NOW + timedelta(minutes=5)
+    index.refresh(client, later)
+    filters = paginators['describe_launch_templates'].paginate.call_args.kwargs['Filters']
+    assert filters[1] == {'Name': 'create-time', 'Values': ['2024-03-15T10:*']}
+    assert [t[1] for t in index.expired(later)] == ['lt-3']
+    assert set(index.expiry()) == {'template-2', 'template-3'}
+
+    index.refresh(client, NOW + cleanup.FULL_SCAN_INTERVAL)
+    filters = paginators['describe_launch_templates'].paginate.call_args.kwargs['Filters']
+    assert len(filters) == 1
+    assert list(index.templates) == ['lt-3']
+
+
+@mock.patch('forge.cleanup.time.sleep')
+@mock.patch('forge.cleanup.cleanup_pass')
+@mock.patch('forge.cleanup.boto3')
+def test_cleanup_daemon(mock_boto, mock_pass, mock_sleep):
+    """Test that the daemon reuses its client and index, survives AWS errors, and stops when interrupted."""
+    mock_pass.side_effect = [0, ClientError({'Error': {'Code': 'RequestLimitExceeded'}}, 'DescribeFleets'), 0]
+    mock_sleep.side_effect = [None, None, None, KeyboardInterrupt]
+
+    config = Configuration(**{**BASE_CONFIG, 'cleanup_daemon': True, 'cleanup_interval': 100})
+    assert cleanup.cleanup(config) == 0
+
+    mock_boto.client.assert_called_once()
+    assert mock_pass.call_count == 3
+    assert len({id(c.args[2]) for c in mock_pass.call_args_list}) == 1
+    assert mock_sleep.call_args_list[0].args[0] <= 10
+    assert all(90 <= c.args[0] <= 110 for c in mock_sleep.call_args_list[1:])
@@ -1,12 +1,15 @@
 """Tests for the common functions of Forge."""
 import json
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from unittest import mock
 
 import pytest
+from botocore.exceptions import ClientError, WaiterError
 
 from forge import common
 from forge.configuration import Configuration
+from forge.exceptions import ExitHandlerException
 
 
 TEST_DEFAULT_ARG_VALS = {
@@ -36,7 +39,6 @@ DEFAULTS = {
 
 
 @mock.patch.dict('forge.common.DEFAULT_ARG_VALS', TEST_DEFAULT_ARG_VALS, clear=True)
-@mock.patch.object(common, 'ADDITIONAL_KEYS', TEST_ADDITIONAL_KEYS)
 @pytest.mark.parametrize('config,kwargs,expected', [
     # Config with cluster markets and various configs, including one that should
     # not be exposed.
@@ -69,7 +71,7 @@ DEFAULTS = {
 ])
 def test_user_accessible_vars(config, kwargs, expected):
     """Test creating the dict of user-accessible variables."""
-    test_config = Configuration(**BASE_CONFIG)
+    test_config = Configuration(**BASE_CONFIG, additional_keys=TEST_ADDITIONAL_KEYS)
     test_config.update(config)
 
     test_expected = {**DEFAULTS, **BASE_CONFIG, **expected}
@@ -142,3 +144,126 @@ def test_get_ec2_pricing_ondemand(mock_regions, mock_boto):
             {'Field': 'instanceType', 'Value': ec2_type, 'Type': 'TERM_MATCH'}
         ]
     )
+
+
+@mock.patch('forge.common.check_fleet_id')
+@mock.patch('forge.common.boto3')
+def test_ec2_ip(mock_boto, mock_check_fleet_id):
+    """Test that the fleet ID is looked up once for all instances."""
+    mock_check_fleet_id.return_value = ['f-1']
+    mock_client = mock_boto.client.return_value
+    mock_client.get_paginator.return_value.paginate.return_value = [{'Reservations': [{'Instances': [
+        {'PrivateIpAddress': f'10.0.0.{i}', 'InstanceId': f'i-{i}', 'InstanceType': 'r5.large',
+         'State': {'Name': 'running'}, 'LaunchTime': None, 'Placement': {'AvailabilityZone': 'us-east-1a'}}
+        for i in range(3)
+    ]}]}]
+
+    config = Configuration(**BASE_CONFIG)
+    details = common.ec2_ip('fleet', config)
+
+    assert [d['ip'] for d in details] == ['10.0.0.0', '10.0.0.1', '10.0.0.2']
+    assert all(d['fleet_id'] == ['f-1'] for d in details)
+    mock_check_fleet_id.assert_called_once_with('fleet', config, mock_client)
+    mock_client.get_paginator.assert_called_once_with('describe_instances')
+
+
+def test_change_state():
+    """Test that state changes are sent in batches and failed batches are returned."""
+    def stop_instances(InstanceIds, **kwargs):
+        if 'i-1500' in InstanceIds:
+            raise ClientError({'Error': {'Code': 'IncorrectInstanceState'}}, 'StopInstances')
+        return {}
+
+    client = mock.Mock()
+    client.stop_instances.side_effect = stop_instances
+    ec2_ids = [f'i-{i}' for i in range(2001)]
+
+    failed = common.change_state(client, 'stop_instances', ec2_ids, Force=True)
+
+    assert sorted(len(c.kwargs['InstanceIds']) for c in client.stop_instances.call_args_list) == [1, 1000, 1000]
+    assert all(c.kwargs['Force'] for c in client.stop_instances.call_args_list)
+    assert failed == ec2_ids[1000:2000]
+    assert common.change_state(client, 'stop_instances', []) == []
+
+
+@mock.patch('forge.common.describe_ec2s')
+def test_wait_for_state(mock_describe):
+    """Test that the waiter is given the remaining time and stragglers are reported with their IPs."""
+    client = mock.Mock()
+    client.get_waiter.return_value.wait.side_effect = WaiterError('InstanceRunning', 'Max attempts exceeded', {})
+    mock_describe.return_value = [
+        {'id': 'i-1', 'ip': '10.0.0.1', 'state': 'running'},
+        {'id': 'i-2', 'ip': None, 'state': 'pending'},
+    ]
+
+    details, stragglers = common.wait_for_state(client, ['i-1', 'i-2'], 'running', 60)
+
+    client.get_waiter.assert_called_once_with('instance_running')
+    assert client.get_waiter.return_value.wait.call_args.kwargs['WaiterConfig']['MaxAttempts'] <= 4
+    assert details == mock_describe.return_value
+    assert [e['id'] for e in stragglers] == ['i-2']
+    assert common.wait_for_state(client, [], 'running', 60) == ([], [])
+
+
+@mock.patch('forge.destroy.destroy')
+def test_destroy_on_error(mock_destroy):
+    """Test that an unexpected error destroys the instances of the failed job only."""
+    @common.destroy_on_error
+    def job(config):
+        raise RuntimeError('boom')
+
+    config = Configuration(**BASE_CONFIG, name='failed')
+    with pytest.raises(SystemExit) as e:
+        job(config)
+
+    assert e.value.code == 1
+    mock_destroy.assert_called_once_with(config)
+
+    mock_destroy.reset_mock()
+    config.destroy_after_failure = False
+    with pytest.raises(SystemExit):
+        job(config)
+    mock_destroy.assert_not_called()
+
+
+@mock.patch('forge.destroy.destroy')
+def test_destroy_on_error_passes(mock_destroy):
+    """Test that results and engine retries are passed on without destroying."""
+    @common.destroy_on_error
+    def job(config, fail=False):
+        if fail:
+            raise ExitHandlerException
+        return 3
+
+    config = Configuration(**BASE_CONFIG)
+    assert job(config) == 3
+    with pytest.raises(ExitHandlerException):
+        job(config, fail=True)
+    mock_destroy.assert_not_called()
+
+
+@mock.patch('forge.common.boto3')
+def test_setup_default_session(mock_boto):
+    """Test that a matching or warm session is reused instead of creating a new one."""
+    mock_boto.DEFAULT_SESSION = mock.Mock(profile_name='default', region_name='us-east-1')
+    assert common.setup_default_session(None, 'us-east-1') is mock_boto.DEFAULT_SESSION
+    mock_boto.setup_default_session.assert_not_called()
+
+    warm = mock.Mock()
+    with mock.patch.dict(common.WARM_SESSIONS, {('dev', 'us-east-1'): warm}):
+        assert common.setup_default_session('dev', 'us-east-1') is warm
+    mock_boto.setup_default_session.assert_not_called()
+
+    common.setup_default_session('prod', 'us-west-2')
+    mock_boto.setup_default_session.assert_called_once_with(profile_name='prod', region_name='us-west-2')
+
+
+def test_shared_client_session():
+    """Test that threads get the same client of each service from a shared session."""
+    session = common.SharedClientSession(region_name='us-east-1')
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        clients = list(executor.map(lambda _: session.client('ec2'), range(8)))
+
+    assert all(c is clients[0] for c in clients)
+    assert session.client('s3') is not clients[0]
+    assert session.client('ec2', region_name='us-west-2') is not clients[0]
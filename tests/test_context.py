@@ -0,0 +1,74 @@
+"""Tests for the context module of Forge."""
+from forge import context
+from forge.configuration import Configuration
+
+
+BASE_CONFIG = {
+    'region': 'us-east-1',
+    'ec2_amis': {},
+    'ec2_key': '',
+    'forge_env': 'dev',
+    'forge_pem_secret': '',
+    'job': 'engine'
+}
+
+
+def test_job_context():
+    """Test recording, updating and dropping fleet details."""
+    job_context = context.JobContext()
+    assert job_context.details('fleet') is None
+
+    job_context.set_fleet('fleet', [{'ip': None, 'id': None, 'fleet_id': ['f-1'], 'state': None}])
+    job_context.add_instance('fleet', {'ip': '10.0.0.1', 'id': 'i-1', 'fleet_id': ['f-1'], 'state': 'running'})
+    job_context.add_instance('fleet', {'ip': '10.0.0.2', 'id': 'i-2', 'fleet_id': ['f-1'], 'state': 'running'})
+    job_context.add_instance('fleet', {'ip': '10.0.0.3', 'id': 'i-1', 'fleet_id': ['f-1'], 'state': 'running'})
+
+    assert 'fleet' in job_context
+    assert [(d['id'], d['ip']) for d in job_context.details('fleet')] == [('i-2', '10.0.0.2'), ('i-1', '10.0.0.3')]
+    assert job_context.instance_ids() == ['i-2', 'i-1']
+
+    job_context.details('fleet')[0]['ip'] = 'changed'
+    assert job_context.details('fleet')[0]['ip'] == '10.0.0.2'
+
+    job_context.drop('fleet')
+    assert 'fleet' not in job_context
+
+
+def test_context_details():
+    """Test that details are only returned for fleets in the job context."""
+    config = Configuration(**BASE_CONFIG)
+    assert context.context_details('fleet', config) is None
+
+    config.job_context = context.JobContext()
+    assert context.context_details('fleet', config) is None
+
+    config.job_context.set_fleet('fleet', [{'ip': '10.0.0.1', 'id': 'i-1', 'state': 'running'}])
+    assert context.context_details('fleet', config) == [{'ip': '10.0.0.1', 'id': 'i-1', 'state': 'running'}]
+
+
+def test_context_details_partial():
+    """Test that a fleet left before all its workers were initialized is described again."""
+    config = Configuration(**BASE_CONFIG)
+    config.job_context = context.JobContext()
+    config.job_context.add_instance('fleet', {'ip': '10.0.0.1', 'id': 'i-1', 'state': 'running'})
+    config.job_context.set_readiness('fleet', 1, 2)
+    assert config.job_context.is_partial('fleet')
+    assert context.context_details('fleet', config) is None
+
+    config.job_context.set_fleet('fleet', [{'ip': '10.0.0.1', 'id': 'i-1', 'state': 'running'},
+                                           {'ip': '10.0.0.2', 'id': 'i-2', 'state': 'running'}])
+    assert not config.job_context.is_partial('fleet')
+    assert len(context.context_details('fleet', config)) == 2
+
+
+def test_synced_details():
+    """Test that only the synced instances of a fleet are returned as synced."""
+    job_context = context.JobContext()
+    assert job_context.synced_details('fleet') == []
+
+    job_context.add_instance('fleet', {'ip': '10.0.0.1', 'id': 'i-1', 'state': 'running'})
+    job_context.add_instance('fleet', {'ip': '10.0.0.2', 'id': 'i-2', 'state': 'running'})
+    job_context.mark_synced('i-2')
+    job_context.mark_synced('i-3')
+
+    assert job_context.synced_details('fleet') == [{'ip': '10.0.0.2', 'id': 'i-2', 'state': 'running'}]
@@ -0,0 +1,97 @@
+"""Tests for the cost module of Forge."""
+import json
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+import pytest
+from botocore.exceptions import ClientError
+
+from forge import cost
+from forge.configuration import Configuration
+
+
+BASE_CONFIG = {
+    'region': 'us-east-1',
+    'ec2_amis': {},
+    'ec2_key': '',
+    'forge_env': 'dev',
+    'forge_pem_secret': '',
+    'job': 'destroy'
+}
+
+NOW = datetime(2022, 1, 1, 12, 0, 0, tzinfo=timezone.utc)
+PRICES = {
+    ('r5.large', 'us-east-1a', 'spot'): 0.05,
+    ('r5.large', 'us-east-1b', 'spot'): 0.04,
+    ('r5.large', 'us-east-1a', 'on-demand'): 0.1,
+    ('r5.large', 'us-east-1b', 'on-demand'): 0.1,
+    ('r5.xlarge', 'us-east-1a', 'spot'): 0.08,
+    ('r5.xlarge', 'us-east-1a', 'on-demand'): 0.2,
+}
+
+
+@pytest.fixture(autouse=True)
+def clear_prices():
+    cost._PRICES.clear()
+    yield
+    cost._PRICES.clear()
+
+
+def _instance(i, ec2_type, az, hours, state='running'):
+    return {'id': f'i-{i}', 'instance_type': ec2_type, 'az': az, 'state': state,
+            'launch_time': NOW - timedelta(hours=hours)}
+
+
+@mock.patch('forge.cost.get_ec2_pricing')
+def test_fleet_cost(mock_pricing):
+    """Test that each instance is billed for its own run time, type and AZ, with cached prices."""
+    mock_pricing.side_effect = lambda ec2_type, market, config, az: PRICES[(ec2_type, az, market)]
+    config = Configuration(**BASE_CONFIG)
+    detail = [
+        _instance(1, 'r5.large', 'us-east-1a', 2),
+        _instance(2, 'r5.large', 'us-east-1a', 1),
+        _instance(3, 'r5.large', 'us-east-1b', 1),
+        _instance(4, 'r5.xlarge', 'us-east-1a', 0.5),
+        _instance(5, 'r5.xlarge', 'us-east-1a', 3, state='stopped'),
+    ]
+
+    breakdown = cost.fleet_cost('fleet', detail, 'spot', config, NOW)
+
+    assert [i['id'] for i in breakdown['instances']] == ['i-1', 'i-2', 'i-3', 'i-4']
+    assert breakdown['hours'] == pytest.approx(2)
+    assert breakdown['instance_hours'] == pytest.approx(4.5)
+    assert breakdown['cost'] == pytest.approx(0.05 * 2 + 0.05 + 0.04 + 0.08 * 0.5)
+    assert breakdown['on_demand_cost'] == pytest.approx(0.1 * 4 + 0.2 * 0.5)
+    assert mock_pricing.call_count == 6
+
+
+@mock.patch('forge.cost.get_ec2_pricing')
+def test_get_price_failure(mock_pricing, caplog):
+    """Test that a missing price is reported once and left out of the totals."""
+    mock_pricing.side_effect = ClientError({'Error': {'Code': 'AccessDenied'}}, 'GetProducts')
+    config = Configuration(**BASE_CONFIG)
+
+    assert cost.get_price('r5.large', 'us-east-1a', 'on-demand', config) is None
+    assert cost.get_price('r5.large', 'us-east-1a', 'on-demand', config) is None
+    mock_pricing.assert_called_once()
+    assert 'Could not get the on-demand price of r5.large' in caplog.text
+
+    breakdown = cost.fleet_cost('fleet', [_instance(1, 'r5.large', 'us-east-1a', 1)], 'on-demand', config, NOW)
+    assert breakdown['cost'] is None
+
+
+def test_job_cost_export(tmp_path):
+    """Test the job totals and JSON export."""
+    fleets = [
+        {'name': 'master', 'hours': 2, 'cost': 0.1, 'on_demand_cost': 0.2, 'instances': []},
+        {'name': 'worker', 'hours': 1, 'cost': 0.3, 'on_demand_cost': 0.6, 'instances': []},
+    ]
+    breakdown = cost.job_cost(fleets)
+
+    assert breakdown['hours'] == 2
+    assert breakdown['cost'] == pytest.approx(0.4)
+    assert breakdown['savings'] == pytest.approx(50)
+
+    path = tmp_path / 'cost.json'
+    cost.export_cost(breakdown, str(path))
+    assert json.loads(path.read_text())['fleets'][1]['name'] == 'worker'
@@ -9,6 +9,7 @@ from botocore.exceptions import ClientError
 
 from forge import create
 from forge.configuration import Configuration
+from forge.context import JobContext
 
 
 BASE_CONFIG = {
@@ -87,6 +88,17 @@ def test_calc_machine_ranges(in_ram, in_cpu, out_ram, out_cpu,
     assert ratio == out_ratio
 
 
+
+def test_calc_machine_ranges_limits():
+    """Test the RAM and CPU ranges with the default ratio and max RAM of a job."""
+    job_ram, job_cpu, _, ratio = create.calc_machine_ranges(ram=[32, 64], default_ratio=[4, 4])
+    assert job_ram == [32 * 1024, 64 * 1024]
+    assert job_cpu == [8, 16]
+    assert ratio == [4, 4]
+
+    job_ram, _, _, _ = create.calc_machine_ranges(ram=[1024], ec2_max=512)
+    assert job_ram == [128 * 1024, 512 * 1024]
+
 @mock.patch('forge.create.datetime')
 def test_get_fleet_error_no_time(mock_dt):
     """Test getting the error details of a fleet with no create time passed."""
@@ -183,3 +195,135 @@ def test_get_fleet_error(history, exp_details):
     mock_client.describe_fleet_history.assert_called_once_with(
         FleetId=fleet_id, StartTime=start_time
     )
+
+
+@mock.patch('forge.create.create_fleet')
+@mock.patch('forge.create.ec2_ip')
+def test_search_and_create_running_on_ready(mock_ec2_ip, mock_create_fleet):
+    """Test that instances that are already running are reported as ready."""
+    config = Configuration(**{**BASE_CONFIG, 'service': 'single', 'name': 'test', 'ram': [8]})
+    mock_ec2_ip.return_value = [{'ip': '10.0.0.1', 'id': 'i-1', 'state': 'running', 'fleet_id': ['f-1']}]
+    on_ready = mock.Mock()
+
+    create.search_and_create(config, 'single', {}, on_ready=on_ready)
+
+    mock_create_fleet.assert_not_called()
+    on_ready.assert_called_once_with('test-spot-single-', '10.0.0.1', 'i-1')
+
+
+@pytest.mark.parametrize('fraction,workers,target,out', [
+    (0.5, None, 10, 5),
+    (0.75, None, 10, 8),
+    (None, 3, 10, 3),
+    (0.5, 7, 10, 7),
+    (None, 20, 10, 10),
+    (0.01, None, 10, 1),
+])
+def test_min_ready_count(fraction, workers, target, out):
+    """Test the number of workers needed before moving on."""
+    config = Configuration(**{**BASE_CONFIG, 'min_ready_fraction': fraction, 'min_ready_workers': workers})
+    assert create.min_ready_count(config, target) == out
+
+
+def test_get_statuses():
+    """Test that statuses are fetched in batches and unknown instances are checked one by one."""
+    client = mock.Mock()
+    ids = [f'i-{i}' for i in range(150)]
+
+    def _describe(InstanceIds):
+        if 'i-120' in InstanceIds and len(InstanceIds) > 1:
+            raise ClientError({'Error': {'Code': 'InvalidInstanceID.NotFound'}}, 'DescribeInstanceStatus')
+        if InstanceIds == ['i-120']:
+            raise ClientError({'Error': {'Code': 'InvalidInstanceID.NotFound'}}, 'DescribeInstanceStatus')
+        return {'InstanceStatuses': [
+            {'InstanceId': i, 'InstanceStatus': {'Status': 'ok'}} for i in InstanceIds if i != 'i-1'
+        ]}
+
+    client.describe_instance_status.side_effect = _describe
+    statuses = create.get_statuses(client, ids)
+
+    assert statuses['i-0'] == 'ok'
+    assert statuses['i-1'] == 'no-status'
+    assert statuses['i-120'] == 'invalid-instance'
+    assert statuses['i-149'] == 'ok'
+    assert client.describe_instance_status.call_args_list[0] == mock.call(InstanceIds=ids[:100])
+
+
+@mock.patch('forge.create.time.sleep')
+@mock.patch('forge.create.describe_ec2s')
+def test_worker_status_partial(mock_describe_ec2s, mock_sleep):
+    """Test that create moves on once enough workers are initialized."""
+    config = Configuration(**{**BASE_CONFIG, 'workers': 4, 'min_ready_fraction': 0.5, 'job_context': JobContext()})
+    client = mock.Mock()
+    client.describe_fleets.return_value = {'Fleets': [{'ActivityStatus': 'pending_fulfillment'}]}
+    client.describe_fleet_instances.return_value = {'ActiveInstances': [{'InstanceId': f'i-{i}'} for i in range(3)]}
+    client.describe_instance_status.side_effect = [
+        {'InstanceStatuses': [{'InstanceId': 'i-0', 'InstanceStatus': {'Status': 'ok'}}]},
+        {'InstanceStatuses': [{'InstanceId': 'i-2', 'InstanceStatus': {'Status': 'ok'}}]},
+    ]
+    mock_describe_ec2s.side_effect = lambda client, ids, fleet_id: [
+        {'ip': f'10.0.0.{i[-1]}', 'id': i, 'state': 'running', 'fleet_id': fleet_id} for i in ids
+    ]
+    on_ready = mock.Mock()
+
+    create.worker_status('fleet', client, 'f-1', None, config, 10, on_ready)
+
+    on_ready.assert_has_calls([mock.call('fleet', '10.0.0.0', 'i-0'), mock.call('fleet', '10.0.0.2', 'i-2')])
+    assert client.describe_instance_status.call_args_list == [
+        mock.call(InstanceIds=['i-0', 'i-1', 'i-2']), mock.call(InstanceIds=['i-1', 'i-2'])
+    ]
+    mock_sleep.assert_called_once_with(10)
+    assert config.job_context.readiness('fleet') == (2, 4)
+    assert [d['id'] for d in config.job_context.details('fleet')] == ['i-0', 'i-2']
+
+
+@mock.patch('forge.create.time.sleep')
+@mock.patch('forge.create.destroy')
+@pytest.mark.parametrize('create_timeout,polls', [(None, create.WORKER_READY_TIMEOUT // 10), (60, 6)])
+def test_worker_status_timeout(mock_destroy, mock_sleep, create_timeout, polls):
+    """Test that create gives up on workers that never initialize, with or without create_timeout."""
+    config = Configuration(**{**BASE_CONFIG, 'workers': 2, 'min_ready_workers': 1, 'create_timeout': create_timeout})
+    client = mock.Mock()
+    client.describe_fleets.return_value = {'Fleets': [{'ActivityStatus': 'fulfilled'}]}
+    client.describe_fleet_instances.return_value = {'ActiveInstances': [{'InstanceId': 'i-0'}]}
+    client.describe_instance_status.return_value = {
+        'InstanceStatuses': [{'InstanceId': 'i-0', 'InstanceStatus': {'Status': 'impaired'}}]
+    }
+
+    with pytest.raises(SystemExit):
+        create.worker_status('fleet', client, 'f-1', None, config, 10)
+
+    assert mock_sleep.call_count == polls
+    mock_destroy.assert_called_once_with(config)
+
+
+@mock.patch('forge.create.boto3')
+@pytest.mark.parametrize('market, hibernated', [(['on-demand'], True), (['spot'], False)])
+def test_create_template_hibernate(mock_boto, market, hibernated):
+    """Test that on-demand templates are configured for hibernation with an encrypted root volume."""
+    config = Configuration(**{
+        **BASE_CONFIG, 'name': 'test', 'service': 'single', 'market': market, 'hibernate': True,
+        'ami': 'ami-123', 'disk': 200, 'disk_device_name': '/dev/xvda', 'tags': [{'Key': 'team', 'Value': 'data'}],
+    })
+
+    create.create_template('test-single', config, 'single', 64 * 1024)
+
+    data = mock_boto.client.return_value.create_launch_template.call_args.kwargs['LaunchTemplateData']
+    assert ('HibernationOptions' in data) is hibernated
+    assert data['BlockDeviceMappings'][0]['Ebs'].get('Encrypted', False) is hibernated
+
+    # The root volume is grown to hold the RAM only when hibernating
+    create.create_template('test-single', config, 'single', 150 * 1024)
+
+    data = mock_boto.client.return_value.create_launch_template.call_args.kwargs['LaunchTemplateData']
+    assert data['BlockDeviceMappings'][0]['Ebs']['VolumeSize'] == (350 if hibernated else 200)
+
+
+def test_get_instance_details_hibernate():
+    """Test that hibernated instances are limited to the RAM that supports hibernation."""
+    config = Configuration(**{**BASE_CONFIG, 'name': 'test', 'service': 'single', 'market': ['on-demand'],
+                              'ram': [[64, 512]], 'hibernate': True})
+
+    details = create.get_instance_details(config, ['single'])
+
+    assert details['single']['override_instance_stats']['MemoryMiB'] == {'Min': 64 * 1024, 'Max': 150 * 1024}
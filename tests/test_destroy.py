@@ -16,9 +16,9 @@ BASE_CONFIG = {
 }
 
 
-@mock.patch("forge.destroy.find_and_destroy")
+@mock.patch("forge.destroy.teardown")
 @pytest.mark.parametrize("service, market", [("single", ["spot"]), ("cluster", ["spot", "spot"])])
-def test_destroy(mock_find_and_destroy, service, market):
+def test_destroy(mock_teardown, service, market):
     config = Configuration(**{
         **BASE_CONFIG,
         "name": "test-run",
@@ -28,26 +28,26 @@ def test_destroy(mock_find_and_destroy, service, market):
     })
 
     destroy.destroy(config)
-    
+
     if service == 'single':
         n = f'{config["name"]}-{market[0]}-{service}-{config["date"]}'
-        mock_find_and_destroy.assert_called_once_with(n, config)
+        mock_teardown.assert_called_once_with([n], config)
 
     if service == 'cluster':
         n1 = f'{config["name"]}-{market[0]}-{service}-master-{config["date"]}'
         n2 = f'{config["name"]}-{market[-1]}-{service}-worker-{config["date"]}'
-        assert mock_find_and_destroy.call_args_list == [((n1, config),), ((n2, config),)]
+        mock_teardown.assert_called_once_with([n1, n2], config)
 
 
+@mock.patch("forge.destroy.boto3")
 @mock.patch("forge.destroy.ec2_ip")
 @mock.patch("forge.destroy.pricing")
 @mock.patch("forge.destroy.fleet_destroy")
-@pytest.mark.parametrize("service, market", [("single", ["spot"]), ("cluster", ["spot", "spot"])])
-def test_find_and_destroy(mock_fleet_destroy, mock_pricing, mock_ec2_ip, service, market):
-    ip = "123.456.789"
-    fleet_id = "abc-123"
-    ec2_details = [{"ip": ip, "spot_id": ["abc"], "state": None, "fleet_id": fleet_id}]
+@pytest.mark.parametrize("service, market", [("single", ["spot"]), ("cluster", ["spot", "on-demand"])])
+def test_find_and_destroy(mock_fleet_destroy, mock_pricing, mock_ec2_ip, mock_boto, service, market):
+    ec2_details = [{"ip": f"10.0.0.{i}", "state": "running", "fleet_id": ["abc-123"]} for i in range(3)]
     mock_ec2_ip.return_value = ec2_details
+    mock_pricing.return_value = {"hours": 0, "cost": None, "on_demand_cost": None}
 
     config = Configuration(**{
         **BASE_CONFIG,
@@ -59,13 +59,96 @@ def test_find_and_destroy(mock_fleet_destroy, mock_pricing, mock_ec2_ip, service
 
     destroy.destroy(config)
 
+    # The fleets are found from several threads with one client created up front
+    mock_boto.client.assert_called_once_with('ec2')
+    assert all(c[0][2] is mock_boto.client.return_value for c in mock_ec2_ip.call_args_list)
+
     if service == 'single':
         n1 = f'{config["name"]}-{market[0]}-{service}-{config["date"]}'
-        assert mock_fleet_destroy.call_args_list == [((n1, fleet_id, config),)]
+        mock_fleet_destroy.assert_called_once_with({n1: ["abc-123"]}, config)
         assert mock_pricing.call_args_list == [((ec2_details, config, market[0]),)]
 
     if service == 'cluster':
         n2 = f'{config["name"]}-{market[0]}-{service}-master-{config["date"]}'
         n3 = f'{config["name"]}-{market[-1]}-{service}-worker-{config["date"]}'
-        assert mock_fleet_destroy.call_args_list == [((n2, fleet_id, config),), ((n3, fleet_id, config),)]
+        mock_fleet_destroy.assert_called_once_with({n2: ["abc-123"], n3: ["abc-123"]}, config)
         assert mock_pricing.call_args_list == [((ec2_details, config, market[0]),), ((ec2_details, config, market[1]),)]
+
+
+@mock.patch("forge.destroy.boto3")
+def test_fleet_destroy(mock_boto):
+    """Test that fleet IDs are deduplicated and deleted in batches."""
+    client = mock_boto.client.return_value
+    client.delete_fleets.return_value = {'SuccessfulFleetDeletions': [], 'UnsuccessfulFleetDeletions': []}
+    client.delete_launch_template.side_effect = destroy.ClientError({'Error': {}}, 'DeleteLaunchTemplate')
+    fleets = {
+        'master': ['fleet-master'],
+        'worker': [f'fleet-{i}' for i in range(30)] + ['fleet-0', 'fleet-master'],
+    }
+
+    destroy.fleet_destroy(fleets, Configuration(**BASE_CONFIG))
+
+    expected_ids = ['fleet-master'] + [f'fleet-{i}' for i in range(30)]
+    assert client.delete_fleets.call_args_list == [
+        mock.call(FleetIds=expected_ids[:25], TerminateInstances=True),
+        mock.call(FleetIds=expected_ids[25:], TerminateInstances=True),
+    ]
+    assert sorted(c.kwargs['LaunchTemplateName'] for c in client.delete_launch_template.call_args_list) == [
+        'master', 'worker'
+    ]
+
+
+@mock.patch("forge.destroy.wait_for_termination")
+@mock.patch("forge.destroy.fleets_cost")
+@mock.patch("forge.destroy.find_fleets")
+@mock.patch("forge.destroy.fleet_destroy")
+@pytest.mark.parametrize("wait", [None, True])
+def test_teardown_wait(mock_fleet_destroy, mock_find_fleets, mock_fleets_cost, mock_wait, wait):
+    """Test that fleets are deleted before they are priced, and termination is only waited for with destroy_wait."""
+    fleets = {
+        'master': [{'id': 'i-1', 'fleet_id': ['f-1']}],
+        'worker': [{'id': 'i-2', 'fleet_id': ['f-2']}, {'id': 'i-3', 'fleet_id': ['f-2']}],
+    }
+    mock_find_fleets.return_value = fleets
+    order = mock.Mock()
+    order.attach_mock(mock_fleet_destroy, 'fleet_destroy')
+    order.attach_mock(mock_fleets_cost, 'fleets_cost')
+    mock_fleet_destroy.return_value = 0
+    mock_wait.return_value = 1
+
+    config = Configuration(**{**BASE_CONFIG, 'destroy_wait': wait})
+    status, breakdown = destroy.teardown(['master', 'worker'], config)
+
+    assert order.mock_calls == [
+        mock.call.fleet_destroy({'master': ['f-1'], 'worker': ['f-2']}, config),
+        mock.call.fleets_cost(fleets, config),
+    ]
+    assert breakdown is mock_fleets_cost.return_value
+    if wait:
+        mock_wait.assert_called_once_with(['i-1', 'i-2', 'i-3'], config)
+        assert status == 1
+    else:
+        mock_wait.assert_not_called()
+        assert status == 0
+
+
+@mock.patch("forge.destroy.describe_ec2s")
+@mock.patch("forge.destroy.boto3")
+def test_wait_for_termination_stragglers(mock_boto, mock_describe, caplog):
+    """Test that instances that are not terminated in time are reported."""
+    waiter = mock_boto.client.return_value.get_waiter.return_value
+    waiter.wait.side_effect = [None, destroy.WaiterError('InstanceTerminated', 'Max attempts exceeded', {})]
+    mock_describe.return_value = [
+        {'id': 'i-100', 'ip': '10.0.0.1', 'state': 'shutting-down'},
+        {'id': 'i-101', 'ip': '10.0.0.2', 'state': 'terminated'},
+    ]
+    ec2_ids = [f'i-{i}' for i in range(102)]
+
+    config = Configuration(**{**BASE_CONFIG, 'wait_timeout': 60})
+    assert destroy.wait_for_termination(ec2_ids, config) == 1
+
+    mock_boto.client.return_value.get_waiter.assert_called_once_with('instance_terminated')
+    assert waiter.wait.call_args_list[0].kwargs['InstanceIds'] == ec2_ids[:100]
+    mock_describe.assert_called_once_with(mock_boto.client.return_value, ec2_ids[100:], [])
+    assert 'Instance i-100 (10.0.0.1) is still shutting-down.' in caplog.text
+    assert 'i-101' not in caplog.text
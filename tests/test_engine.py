@@ -0,0 +1,192 @@
+"""Tests for the engine module of Forge."""
+import os
+from unittest import mock
+
+import pytest
+
+from forge import engine
+from forge.exceptions import ExitHandlerException
+from forge.configuration import Configuration
+from forge.context import JobContext
+
+
+BASE_CONFIG = {
+    'region': 'us-east-1',
+    'ec2_amis': {},
+    'ec2_key': '',
+    'forge_env': 'dev',
+    'forge_pem_secret': '',
+    'job': 'engine'
+}
+
+
+def _config(**kwargs):
+    return Configuration(**{
+        **BASE_CONFIG,
+        'name': 'test-engine',
+        'service': 'cluster',
+        'rsync_path': 'path/to/dir',
+        **kwargs
+    })
+
+
+@mock.patch('forge.engine.run')
+@mock.patch('forge.engine.rsync_ip')
+@mock.patch('forge.engine.wait_for_ssh')
+@mock.patch('forge.engine.key_file')
+@mock.patch('forge.engine.create')
+@pytest.mark.parametrize('rr_all,synced', [(False, ['10.0.0.1']), (True, ['10.0.0.1', '10.0.0.2', '10.0.0.3'])])
+def test_engine_syncs_each_node_when_ready(mock_create, mock_key_file, mock_wait, mock_rsync_ip, mock_run,
+                                           rr_all, synced):
+    """Test that each instance rsync copies to is synced as it becomes ready and run waits for all of them."""
+    events = []
+
+    def _create(config, on_ready=None):
+        events.append('create-master')
+        on_ready('test-engine-spot-cluster-master-', '10.0.0.1', 'i-1')
+        events.append('create-workers')
+        on_ready('test-engine-spot-cluster-worker-', '10.0.0.2', 'i-2')
+        on_ready('test-engine-spot-cluster-worker-', '10.0.0.3', 'i-3')
+
+    mock_create.side_effect = _create
+    mock_key_file.return_value.__enter__.return_value = '/dummy/key/path'
+    mock_wait.return_value = True
+    mock_rsync_ip.side_effect = lambda config, ip, n, uid, **kwargs: events.append(f'rsync-{ip}') or 0
+    mock_run.side_effect = lambda config: events.append('run') or 0
+
+    config = _config(rr_all=rr_all)
+    assert engine.engine(config) == 0
+
+    calls = [
+        mock.call(config, '10.0.0.1', 'test-engine-spot-cluster-master-', 'i-1', source={}, s3_local_path=None),
+        mock.call(config, '10.0.0.2', 'test-engine-spot-cluster-worker-', 'i-2', source={}, s3_local_path=None),
+        mock.call(config, '10.0.0.3', 'test-engine-spot-cluster-worker-', 'i-3', source={}, s3_local_path=None),
+    ]
+    mock_rsync_ip.assert_has_calls(calls[:len(synced)], any_order=True)
+    assert sorted(e[len('rsync-'):] for e in events if e.startswith('rsync-')) == synced
+    assert events.index('create-master') < events.index('rsync-10.0.0.1')
+    assert events[-1] == 'run'
+
+
+@mock.patch('forge.engine.run')
+@mock.patch('forge.engine.rsync_ip')
+@mock.patch('forge.engine.wait_for_ssh')
+@mock.patch('forge.engine.key_file')
+@mock.patch('forge.engine.create')
+def test_provision_ssh_timeout(mock_create, mock_key_file, mock_wait, mock_rsync_ip, mock_run, caplog):
+    """Test that an instance that never accepts SSH fails the transfer."""
+    mock_create.side_effect = lambda config, on_ready=None: on_ready('test-engine-spot-cluster-master-', '10.0.0.1',
+                                                                     'i-1')
+    mock_key_file.return_value.__enter__.return_value = '/dummy/key/path'
+    mock_wait.return_value = False
+
+    assert engine.provision(_config()) == 1
+    mock_rsync_ip.assert_not_called()
+    assert 'Timed out waiting for SSH on 10.0.0.1' in caplog.text
+
+
+@mock.patch('forge.engine.create')
+def test_provision_no_path(mock_create):
+    """Test that nothing is created without content to copy."""
+    with pytest.raises(SystemExit):
+        engine.provision(_config(rsync_path=None))
+    mock_create.assert_not_called()
+
+
+@mock.patch('forge.rsync.boto3')
+@mock.patch('forge.engine.sync_node', return_value=0)
+@mock.patch('forge.engine.create')
+def test_provision_s3_once(mock_create, mock_sync_node, mock_boto):
+    """Test that the file at s3_path is downloaded once for all the instances and removed after."""
+    def _create(config, on_ready=None):
+        for i in range(1, 4):
+            on_ready('test-engine-spot-cluster-worker-', f'10.0.0.{i}', f'i-{i}')
+
+    mock_create.side_effect = _create
+
+    assert engine.provision(_config(rsync_path=None, s3_path='s3://bucket/path/data.tar', rr_all=True)) == 0
+
+    mock_boto.resource.assert_called_once_with('s3')
+    mock_boto.resource.return_value.Object.assert_called_once_with('bucket', 'path/data.tar')
+    local_paths = {c[0][5] for c in mock_sync_node.call_args_list}
+    assert len(local_paths) == 1 and mock_sync_node.call_count == 3
+    local_path = local_paths.pop()
+    assert os.path.basename(local_path) == 'data.tar' and not os.path.exists(os.path.dirname(local_path))
+
+
+@mock.patch('forge.engine.time.sleep')
+@mock.patch('forge.engine.subprocess.run')
+def test_wait_for_ssh(mock_sub_run, mock_sleep):
+    """Test that SSH is retried until the instance accepts a connection."""
+    mock_sub_run.side_effect = [mock.Mock(returncode=255), mock.Mock(returncode=0)]
+
+    assert engine.wait_for_ssh('10.0.0.1', '/dummy/key/path', timeout=60, interval=5)
+    assert mock_sub_run.call_count == 2
+    mock_sleep.assert_called_once_with(5)
+    assert mock_sub_run.call_args[0][0][-2:] == ['root@10.0.0.1', 'true']
+
+
+@mock.patch('forge.engine.ec2_ip')
+@mock.patch('forge.engine.describe_ec2s')
+@mock.patch('forge.engine.boto3')
+@pytest.mark.parametrize('states,out', [(['running', 'running'], []), (['running', 'terminated'], ['worker'])])
+def test_failed_fleets_job_context(mock_boto, mock_describe, mock_ec2_ip, states, out):
+    """Test that instances in the job context are checked with one describe call."""
+    config = _config(job_context=JobContext())
+    config.job_context.add_instance('master', {'ip': '10.0.0.1', 'id': 'i-1', 'state': 'running'})
+    config.job_context.add_instance('worker', {'ip': '10.0.0.2', 'id': 'i-2', 'state': 'running'})
+    mock_describe.return_value = [{'id': f'i-{i}', 'state': s} for i, s in enumerate(states, 1)]
+
+    assert engine.failed_fleets(config, ['master', 'worker']) == out
+
+    mock_describe.assert_called_once_with(mock_boto.client.return_value, ['i-1', 'i-2'], [])
+    mock_ec2_ip.assert_not_called()
+
+
+@mock.patch('forge.engine.destroy')
+@mock.patch('forge.engine.find_and_destroy')
+@mock.patch('forge.engine.failed_fleets')
+@mock.patch('forge.engine.run')
+@mock.patch('forge.engine.sync_node')
+@mock.patch('forge.engine.create')
+def test_engine_retry_keeps_healthy_master(mock_create, mock_sync_node, mock_run, mock_failed_fleets,
+                                           mock_find_and_destroy, mock_destroy):
+    """Test that a spot retry only replaces the failed fleet and does not copy to the master again."""
+    master = 'test-engine-spot-cluster-master-'
+    worker = 'test-engine-spot-cluster-worker-'
+    attempts = iter(['i-2', 'i-3'])
+
+    def _create(config, on_ready=None):
+        on_ready(master, '10.0.0.1', 'i-1')
+        on_ready(worker, '10.0.0.2', next(attempts))
+
+    mock_create.side_effect = _create
+    mock_sync_node.return_value = 0
+    mock_run.side_effect = [ExitHandlerException, 0]
+    mock_failed_fleets.return_value = [worker]
+
+    config = _config(spot_retries=2, market=['spot', 'spot'], rr_all=True)
+    assert engine.engine(config) == 0
+
+    assert [c[0][3] for c in mock_sync_node.call_args_list] == ['i-1', 'i-2', 'i-3']
+    mock_find_and_destroy.assert_called_once_with(worker, config)
+    mock_destroy.assert_not_called()
+    assert config.spot_retries == 1
+
+
+@mock.patch('forge.engine.destroy')
+@mock.patch('forge.engine.failed_fleets')
+@mock.patch('forge.engine.run')
+@mock.patch('forge.engine.provision')
+def test_engine_retries_exhausted(mock_provision, mock_run, mock_failed_fleets, mock_destroy):
+    """Test that engine gives up and cleans up once the retry budget is spent."""
+    mock_provision.return_value = 0
+    mock_run.side_effect = ExitHandlerException
+    mock_failed_fleets.return_value = ['test-engine-spot-single-']
+
+    config = _config(service='single', spot_retries=1, market=['spot', 'spot'])
+    with mock.patch('forge.engine.find_and_destroy'):
+        assert engine.engine(config) == 4
+
+    assert mock_run.call_count == 2
+    mock_destroy.assert_called_once_with(config)
@@ -0,0 +1,80 @@
+"""Tests for the ledger module of Forge."""
+from datetime import datetime, timezone
+from unittest import mock
+
+import pytest
+
+from forge import ledger
+from forge.configuration import Configuration
+
+
+BASE_CONFIG = {
+    'region': 'us-east-1',
+    'ec2_amis': {},
+    'ec2_key': '',
+    'forge_env': 'dev',
+    'forge_pem_secret': '',
+    'job': 'destroy',
+    'service': 'cluster',
+}
+
+
+def _breakdown(cost, on_demand_cost, types):
+    return {
+        'hours': 2, 'instance_hours': 2 * len(types), 'cost': cost, 'on_demand_cost': on_demand_cost,
+        'instances': [{'instance_type': t} for t in types],
+    }
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'ledger.db')
+
+
+def test_record_and_summarize(path):
+    """Test that destroyed fleets are aggregated by job."""
+    job_a = Configuration(**{**BASE_CONFIG, 'name': 'job-a', 'user': 'alice'})
+    job_b = Configuration(**{**BASE_CONFIG, 'name': 'job-b', 'user': 'bob', 'forge_env': 'prod'})
+
+    ledger.record(job_a, 'create', 'job-a-master', 'spot', ['r5.large'], path=path)
+    ledger.record(job_a, 'destroy', 'job-a-master', 'spot', breakdown=_breakdown(1.0, 2.0, ['r5.large']), path=path)
+    ledger.record(job_a, 'destroy', 'job-a-worker', 'spot',
+                  breakdown=_breakdown(3.0, 6.0, ['r5.xlarge', 'r5.large']), path=path)
+    ledger.record(job_b, 'destroy', 'job-b-single', 'on-demand', breakdown=_breakdown(5.0, 5.0, ['m5.large']),
+                  path=path)
+
+    rows = ledger.summarize(path=path)
+    assert [(r['group'], r['fleets'], r['cost'], r['on_demand_cost']) for r in rows] == [
+        ('job-a', 2, 4.0, 8.0), ('job-b', 1, 5.0, 5.0)
+    ]
+    assert [r['group'] for r in ledger.summarize(by='env', path=path)] == ['dev', 'prod']
+    assert [r['group'] for r in ledger.summarize(user='bob', path=path)] == ['job-b']
+
+    today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+    assert [(r['group'], r['fleets']) for r in ledger.summarize(by='day', path=path)] == [(today, 3)]
+    assert ledger.summarize(until=datetime(2000, 1, 1, tzinfo=timezone.utc), path=path) == []
+
+    table = ledger.format_report(rows)
+    assert 'job-a' in table and '$4.00' in table and '50.0%' in table
+
+    with pytest.raises(ValueError, match='Cannot group jobs by'):
+        ledger.summarize(by='name; DROP TABLE events', path=path)
+
+
+def test_record_error(caplog):
+    """Test that a ledger that cannot be written does not fail the job."""
+    config = Configuration(**{**BASE_CONFIG, 'name': 'job-a'})
+    ledger.record(config, 'create', 'job-a-master', 'spot', ['r5.large'], path='/nonexistent/dir/ledger.db')
+    assert 'Could not record create of job-a-master in the ledger' in caplog.text
+
+
+@mock.patch('forge.ledger.summarize')
+def test_report(mock_summarize, capsys):
+    """Test the report subcommand output."""
+    mock_summarize.return_value = [
+        {'group': 'job-a', 'fleets': 2, 'hours': 2, 'instance_hours': 6, 'cost': 4.0, 'on_demand_cost': 8.0}
+    ]
+    assert ledger.report({'by': 'name', 'name': 'job-a', 'days': None}) == 0
+
+    mock_summarize.assert_called_once_with('name', 'job-a', None, None, None, None)
+    assert 'job-a' in capsys.readouterr().out
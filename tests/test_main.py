@@ -208,3 +208,17 @@ def test_forge_main_errors(mock_aws_validate, mock_boto3, cli_call, exp_error, c
             main.main()
 
     assert caplog.record_tuples == exp_error
+
+
+@pytest.mark.parametrize('job,forwarded', [('stop', True), ('ssh', False), ('configure', False), ('serve', False)])
+def test_forge_main_forward(job, forwarded):
+    """Test that only non-interactive subcommands are forwarded to the forge serve daemon."""
+    with mock.patch('forge.serve.forward_command', return_value=0) as mock_forward, \
+            mock.patch('sys.argv', ['forge', job, '--help']):
+        if forwarded:
+            assert main.main() == 0
+        else:
+            with pytest.raises(SystemExit):
+                main.main()
+
+    assert mock_forward.called == forwarded
@@ -0,0 +1,73 @@
+"""Tests for the manifest module of Forge."""
+import os
+
+import pytest
+
+from forge import manifest
+
+
+@pytest.mark.parametrize('rel_path,is_dir,expected', [
+    ('.git', True, True),
+    ('src/.git', True, True),
+    ('build', True, True),
+    ('build', False, False),
+    ('src/module.pyc', False, True),
+    ('docs/notes.md', False, True),
+    ('src/docs/notes.md', False, False),
+    ('src/module.py', False, False),
+])
+def test_is_ignored(rel_path, is_dir, expected):
+    """Test matching paths against .forgeignore patterns."""
+    patterns = ['.git', 'build/', '*.pyc', '/docs/*.md']
+    assert manifest.is_ignored(rel_path, patterns, is_dir=is_dir) == expected
+
+
+def test_load_ignore(tmp_path):
+    """Test reading a .forgeignore file."""
+    assert manifest.load_ignore(str(tmp_path)) == []
+
+    (tmp_path / '.forgeignore').write_text('# Comment\n\n.venv/\n*.pyc\n')
+    assert manifest.load_ignore(str(tmp_path)) == ['.venv/', '*.pyc']
+
+
+def test_scan(tmp_path):
+    """Test scanning a folder and reusing digests of unchanged files."""
+    (tmp_path / 'run.sh').write_text('echo hi')
+    (tmp_path / '.venv').mkdir()
+    (tmp_path / '.venv' / 'lib.py').write_text('x = 1')
+    (tmp_path / 'src').mkdir()
+    (tmp_path / 'src' / 'main.py').write_text('print(1)')
+
+    files = manifest.scan(str(tmp_path), ['.venv/'])
+    assert sorted(files) == sorted([os.path.join('src', 'main.py'), 'run.sh'])
+    assert files['run.sh'][2] == manifest.file_digest(str(tmp_path / 'run.sh'))
+
+    previous = {k: [*v[:2], 'cached'] for k, v in files.items()}
+    assert all(v[2] == 'cached' for v in manifest.scan(str(tmp_path), ['.venv/'], previous).values())
+
+    assert all(v[2] is None for v in manifest.scan(str(tmp_path), checksum=False).values())
+
+
+def test_changed_files():
+    """Test finding the files that need to be copied."""
+    local = {'a': [1, 1, 'x'], 'b': [1, 1, 'y'], 'c': [1, 1, 'z']}
+    remote = {'a': [1, 1, 'x'], 'b': [1, 2, 'old'], 'd': [1, 1, 'w']}
+    assert manifest.changed_files(local, remote) == ['b', 'c']
+
+
+def test_save_load_manifest(tmp_path, monkeypatch):
+    """Test recording the files copied to instances."""
+    monkeypatch.setenv('FORGE_STATE_DIR', str(tmp_path))
+    n = 'test-spot-cluster-worker-'
+    files = {'run.sh': [7, 1, 'abc']}
+
+    assert manifest.load_manifest(n, 'i-1') == {}
+
+    manifest.save_manifest(n, 'i-1', files)
+    manifest.save_manifest(n, 'i-2', files)
+    assert manifest.load_manifest(n, 'i-1') == files
+
+    manifest.save_manifest(n, 'i-3', files, live_ids=['i-2', 'i-3'])
+    assert manifest.load_manifest(n, 'i-1') == {}
+    assert manifest.load_manifest(n, 'i-2') == files
+    assert os.path.isfile(tmp_path / 'manifests' / f'{n}.json')
@@ -0,0 +1,115 @@
+"""Tests for the monitor module of Forge."""
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import pytest
+
+from forge import monitor, run
+from forge.configuration import Configuration
+
+
+BASE_CONFIG = {
+    'region': 'us-east-1',
+    'ec2_amis': {},
+    'ec2_key': '',
+    'forge_env': 'dev',
+    'forge_pem_secret': '',
+    'job': 'status',
+    'name': 'test-run',
+    'service': 'single',
+}
+
+
+@pytest.mark.parametrize('output,expected', [
+    ('exited 0\n', ('exited', 0)),
+    ('exited 3\n', ('exited', 3)),
+    ('running\n', ('running', None)),
+    ('lost\n', ('lost', None)),
+    ('none\n', ('none', None)),
+    ('', ('unreachable', None)),
+    ('exited\n', ('unreachable', None)),
+])
+def test_parse_state(output, expected):
+    """Test parsing the state of a detached run."""
+    assert monitor.parse_state(output) == expected
+
+
+def test_get_detached_cmd():
+    """Test wrapping run_cmd to run in the background."""
+    cmd = run.get_detached_cmd('run.sh a b')
+    assert cmd.startswith(f'mkdir -p {run.REMOTE_RUN_DIR} && rm -f {run.REMOTE_RUN_DIR}/exit_code && cd /root &&')
+    assert f"nohup sh -c '/root/run.sh a b; echo $? > {run.REMOTE_RUN_DIR}/exit_code'" in cmd
+    assert cmd.endswith(f'echo $! > {run.REMOTE_RUN_DIR}/pid')
+
+
+def test_get_logs_cmd():
+    """Test that following the logs does not depend on a pid file."""
+    log_path = f'{run.REMOTE_RUN_DIR}/output.log'
+    assert monitor.get_logs_cmd(10) == f'tail -n 10 {log_path}'
+
+    cmd = monitor.get_logs_cmd(10, follow=True)
+    assert cmd.startswith(f'if [ -f {run.REMOTE_RUN_DIR}/pid ]; then tail -n 10 -F --pid=')
+    assert cmd.endswith(f'else tail -n 10 -F {log_path}; fi')
+
+
+def _completed(stdout, returncode=0):
+    return subprocess.CompletedProcess([], returncode, stdout=stdout, stderr='')
+
+
+@mock.patch('forge.monitor.subprocess.run')
+@mock.patch('forge.monitor.key_file')
+@mock.patch('forge.monitor.get_ip')
+@mock.patch('forge.monitor.ec2_ip')
+@pytest.mark.parametrize('outputs,exp_status', [
+    (['running', 'exited 0'], 0),
+    (['exited 0', 'exited 2'], 2),
+    (['lost', 'running'], 1),
+])
+def test_show_status(mock_ec2_ip, mock_get_ip, mock_key_file, mock_sub_run, outputs, exp_status):
+    """Test showing the state of a detached run on a cluster."""
+    ips = ['10.0.0.1', '10.0.0.2']
+    mock_get_ip.side_effect = [[(ips[0], 'i-1')], [(ips[1], 'i-2')]]
+    mock_key_file.return_value.__enter__.return_value = '/dummy/key/path'
+    by_ip = dict(zip(ips, outputs))
+    mock_sub_run.side_effect = lambda cmd, **kwargs: _completed(by_ip[cmd[-2].split('@')[1]])
+
+    config = Configuration(**{**BASE_CONFIG, 'service': 'cluster', 'rr_all': True, 'run_concurrency': 1})
+
+    with mock.patch('forge.monitor.ThreadPoolExecutor', wraps=ThreadPoolExecutor) as mock_executor:
+        assert monitor.show_status(config) == exp_status
+    mock_executor.assert_called_once_with(max_workers=1)
+    assert mock_sub_run.call_count == 2
+    assert mock_sub_run.call_args[0][0][-1] == monitor.STATUS_CMD
+
+
+@mock.patch('forge.monitor.time.sleep')
+@mock.patch('forge.monitor.subprocess.run')
+@mock.patch('forge.monitor.key_file')
+@mock.patch('forge.monitor.get_ip')
+@mock.patch('forge.monitor.ec2_ip')
+def test_wait_for_run_reconnects(mock_ec2_ip, mock_get_ip, mock_key_file, mock_sub_run, mock_sleep, caplog):
+    """Test waiting for a detached run when the SSH connection drops."""
+    ip = '10.0.0.1'
+    mock_get_ip.return_value = [(ip, 'i-1')]
+    mock_key_file.return_value.__enter__.return_value = '/dummy/key/path'
+    mock_sub_run.side_effect = [_completed('', 255), _completed('exited 4\n')]
+
+    config = Configuration(**{**BASE_CONFIG, 'job': 'wait', 'poll_interval': 5})
+
+    assert monitor.wait_for_run(config) == 4
+    assert mock_sub_run.call_count == 2
+    mock_sleep.assert_called_once_with(5)
+    assert 'sleep 5; done' in mock_sub_run.call_args[0][0][-1]
+    assert f'{ip}: lost connection while waiting, retrying in 5s' in caplog.text
+
+
+@mock.patch('forge.monitor.get_ip')
+@mock.patch('forge.monitor.ec2_ip')
+def test_show_logs_no_instances(mock_ec2_ip, mock_get_ip):
+    """Test showing logs when there are no running instances."""
+    mock_get_ip.return_value = []
+    config = Configuration(**{**BASE_CONFIG, 'job': 'logs'})
+
+    with pytest.raises(SystemExit):
+        monitor.show_logs(config)
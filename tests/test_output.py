@@ -0,0 +1,44 @@
+"""Tests for the output module of Forge."""
+import gzip
+import io
+import threading
+
+from forge import output
+
+
+def test_node_output_console_and_tail():
+    """Test the console limit and the buffer of last lines."""
+    console = io.StringIO()
+    node_output = output.NodeOutput('10.0.0.1', threading.Lock(), tail_lines=2, console_max_lines=2)
+
+    node_output.pump(io.StringIO('one\ntwo\nthree\nfour'), console)
+
+    assert console.getvalue() == (
+        '[10.0.0.1] one\n[10.0.0.1] two\n[10.0.0.1] Console output limit reached\n'
+    )
+    assert list(node_output.tail) == ['three\n', 'four']
+
+
+def test_node_output_rotating_log(tmp_path):
+    """Test saving output to compressed rotating log files."""
+    log_path = tmp_path / 'logs' / 'job-10.0.0.1.log'
+    console = io.StringIO()
+    node_output = output.NodeOutput('10.0.0.1', threading.Lock(), str(log_path), max_bytes=10, backups=2,
+                                    compress=True, console_max_lines=0)
+
+    for i in range(5):
+        node_output.write(f'line {i}\n', console)
+    node_output.close()
+
+    assert console.getvalue() == f'[10.0.0.1] Console output limit reached, see {log_path}\n'
+    assert log_path.read_text() == 'line 4\n'
+    with gzip.open(f'{log_path}.1.gz', 'rt') as f:
+        assert f.read() == 'line 3\n'
+    assert (tmp_path / 'logs' / 'job-10.0.0.1.log.2.gz').exists()
+    assert not (tmp_path / 'logs' / 'job-10.0.0.1.log.3.gz').exists()
+
+
+def test_read_lines_splits_long_lines(monkeypatch):
+    """Test that long lines are read in bounded chunks."""
+    monkeypatch.setattr(output, 'MAX_LINE', 4)
+    assert list(output.read_lines(io.StringIO('abcdefg\nhi\n'))) == ['abcd', 'efg\n', 'hi\n']
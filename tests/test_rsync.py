@@ -6,6 +6,7 @@ import pytest
 
 from forge import rsync
 from forge.configuration import Configuration
+from forge.context import JobContext
 
 
 BASE_CONFIG = {
@@ -300,3 +301,222 @@ def test_rsync_no_instances(mock_ec2_ip, mock_get_ip, targets, caplog):
     )
     mock_get_ip.assert_called_once_with(ec2_details, ('running',))
     assert 'Could not find any valid instances to rsync to' in caplog.text
+
+
+@pytest.mark.parametrize('file_count,file_size,method,expected', [
+    # Few files, default method
+    (10, 10, None, 'rsync'),
+    # Many small files, default method
+    (1000, 10, None, 'tar'),
+    # Many small files, auto method
+    (1000, 10, 'auto', 'tar'),
+    # Many small files, rsync requested explicitly
+    (1000, 10, 'rsync', 'rsync'),
+    # Few files, tar requested explicitly
+    (1, 10, 'tar', 'tar'),
+])
+def test_get_transfer_method(tmp_path, file_count, file_size, method, expected):
+    """Test picking the transfer method of a folder."""
+    for i in range(file_count):
+        (tmp_path / f'{i}.txt').write_bytes(b'0' * file_size)
+
+    assert rsync.get_transfer_method(str(tmp_path), method) == expected
+
+
+@mock.patch('forge.rsync.shutil.which')
+@pytest.mark.parametrize('compression,zstd_path,compress,decompress', [
+    (None, None, 'gzip -c', 'gzip -d -c'),
+    ('gzip', '/usr/bin/zstd', 'gzip -c', 'gzip -d -c'),
+    ('zstd', '/usr/bin/zstd', 'zstd -q -T0 -c', 'zstd -q -d -c'),
+    ('zstd', None, 'gzip -c', 'gzip -d -c'),
+])
+def test_get_tar_cmd(mock_which, compression, zstd_path, compress, decompress, tmp_path):
+    """Test building the tar-over-SSH pipeline."""
+    mock_which.return_value = zstd_path
+    ip = '123.456.789'
+    key_path = '/dummy/key/path'
+    rsync_path = tmp_path / 'my dir'
+    rsync_path.mkdir()
+    for name in ['run.sh', 'my data', '.git']:
+        (rsync_path / name).mkdir()
+
+    expected_cmd = f'set -o pipefail; tar -C \'{rsync_path}\' -cf - -- \'my data\' run.sh | {compress}'
+    expected_cmd += f' | ssh -o UserKnownHostsFile=/dev/null -o StrictHostKeyChecking=no -i {key_path} root@{ip}'
+    expected_cmd += f' "{decompress} | tar -xf - -C /root/"'
+
+    assert rsync.get_tar_cmd(str(rsync_path), ip, key_path, compression) == expected_cmd
+
+    expected_cmd = expected_cmd.replace("-- 'my data' run.sh", '-T /tmp/files.txt')
+    assert rsync.get_tar_cmd(str(rsync_path), ip, key_path, compression, '/tmp/files.txt') == expected_cmd
+
+
+@mock.patch('forge.rsync.os.listdir', return_value=['run.sh', '.git'])
+@mock.patch('forge.rsync.get_transfer_method')
+@mock.patch('forge.rsync.os.path')
+@mock.patch('forge.rsync.subprocess.check_output')
+@mock.patch('forge.rsync.key_file')
+@mock.patch('forge.rsync.get_ip')
+@mock.patch('forge.rsync.ec2_ip')
+def test_rsync_dir_tar(mock_ec2_ip, mock_get_ip, mock_key_file, mock_sub_chk,
+                       mock_os_path, mock_method, mock_listdir, caplog):
+    """Test a successful execution of the 'rsync' sub-command for a folder streamed with tar."""
+    ip = '123.456.789'
+    mock_ec2_ip.return_value = [{'ip': ip, 'spot_id': ['abc'], 'state': None}]
+    mock_get_ip.return_value = [(ip, None)]
+    key_path = '/dummy/key/path'
+    rsync_path = 'path/to/rsync/dir'
+    mock_key_file.return_value.__enter__.return_value = key_path
+    mock_os_path.isdir.return_value = True
+    mock_method.return_value = 'tar'
+
+    config = Configuration(**{
+        **BASE_CONFIG,
+        'name': 'test-rsync',
+        'date': '2021-02-01',
+        'service': 'single',
+        'rsync_path': rsync_path,
+        'transfer_method': 'tar',
+    })
+
+    assert rsync.rsync(config) == 0
+
+    mock_method.assert_called_once_with(rsync_path, 'tar')
+    cmd = mock_sub_chk.call_args[0][0]
+    assert cmd.startswith(f'set -o pipefail; tar -C {rsync_path} -cf - -- run.sh |')
+    assert f'root@{ip} "gzip -d -c | tar -xf - -C /root/"' in cmd
+    assert 'Streaming folder over SSH with tar.' in caplog.text
+
+
+@mock.patch('forge.rsync.subprocess.check_output')
+@mock.patch('forge.rsync.key_file')
+@mock.patch('forge.rsync.get_ip')
+@mock.patch('forge.rsync.ec2_ip')
+def test_rsync_incremental(mock_ec2_ip, mock_get_ip, mock_key_file, mock_sub_chk,
+                           tmp_path, monkeypatch, caplog):
+    """Test that incremental rsyncs only send changed files that are not ignored."""
+    monkeypatch.setenv('FORGE_STATE_DIR', str(tmp_path / 'state'))
+    rsync_path = tmp_path / 'app'
+    rsync_path.mkdir()
+    (rsync_path / '.forgeignore').write_text('*.log\n')
+    (rsync_path / 'run.sh').write_text('echo run')
+    (rsync_path / 'debug.log').write_text('noise')
+
+    ip = '123.456.789'
+    mock_ec2_ip.return_value = [{'ip': ip, 'id': 'i-abc', 'state': 'running'}]
+    mock_get_ip.return_value = [(ip, 'i-abc')]
+    mock_key_file.return_value.__enter__.return_value = '/dummy/key/path'
+    sent = []
+    mock_sub_chk.side_effect = lambda cmd, **kwargs: sent.append(
+        open(cmd.split('--files-from=')[1].split()[0]).read().split()
+    ) or ''
+
+    config = Configuration(**{
+        **BASE_CONFIG,
+        'name': 'test-rsync',
+        'service': 'single',
+        'rsync_path': str(rsync_path),
+        'incremental_rsync': True,
+        'transfer_method': 'rsync',
+    })
+
+    assert rsync.rsync(config) == 0
+    assert sent == [['.forgeignore', 'run.sh']]
+
+    assert rsync.rsync(config) == 0
+    assert len(sent) == 1
+    assert f'No changed files to copy to {ip}.' in caplog.text
+
+    (rsync_path / 'run.sh').write_text('echo changed')
+    assert rsync.rsync(config) == 0
+    assert sent[-1] == ['run.sh']
+
+
+@mock.patch('forge.rsync.rsync_ip')
+@mock.patch('forge.rsync.ec2_ip')
+def test_rsync_job_context(mock_ec2_ip, mock_rsync_ip):
+    """Test that instances in the job context are not discovered again."""
+    config = Configuration(**{
+        **BASE_CONFIG,
+        'name': 'test-rsync',
+        'service': 'single',
+        'rsync_path': 'path/to/rsync/file.txt',
+        'job_context': JobContext(),
+    })
+    n = 'test-rsync-spot-single-'
+    config.job_context.set_fleet(n, [{'ip': '10.0.0.1', 'id': 'i-1', 'state': 'running'}])
+    mock_rsync_ip.return_value = 0
+
+    assert rsync.rsync(config) == 0
+
+    mock_ec2_ip.assert_not_called()
+    mock_rsync_ip.assert_called_once_with(config, '10.0.0.1', n, 'i-1', ['i-1'], {})
+
+
+@mock.patch('forge.rsync.os.listdir', return_value=['run.sh'])
+@mock.patch('forge.rsync.remote_has')
+@mock.patch('forge.rsync.shutil.which', return_value='/usr/bin/zstd')
+@mock.patch('forge.rsync.get_transfer_method', return_value='tar')
+@mock.patch('forge.rsync.os.path')
+@mock.patch('forge.rsync.subprocess.check_output')
+@mock.patch('forge.rsync.key_file')
+@mock.patch('forge.rsync.get_ip')
+@mock.patch('forge.rsync.ec2_ip')
+def test_rsync_tar_zstd(mock_ec2_ip, mock_get_ip, mock_key_file, mock_sub_chk, mock_os_path, mock_method,
+                        mock_which, mock_remote_has, mock_listdir, caplog):
+    """Test that the method is picked once per rsync and zstd is only used on instances that have it."""
+    ips = ['10.0.0.1', '10.0.0.2']
+    mock_ec2_ip.return_value = [{'ip': ip, 'id': f'i-{ip}', 'state': 'running'} for ip in ips]
+    mock_get_ip.return_value = [(ip, f'i-{ip}') for ip in ips]
+    mock_key_file.return_value.__enter__.return_value = '/dummy/key/path'
+    mock_os_path.isdir.return_value = True
+    mock_remote_has.side_effect = [True, False]
+
+    config = Configuration(**{
+        **BASE_CONFIG,
+        'name': 'test-rsync',
+        'service': 'single',
+        'rsync_path': 'path/to/rsync/dir',
+        'transfer_compression': 'zstd',
+    })
+
+    assert rsync.rsync(config) == 0
+
+    mock_method.assert_called_once_with('path/to/rsync/dir', None)
+    cmds = [c[0][0] for c in mock_sub_chk.call_args_list]
+    assert '| zstd -q -T0 -c |' in cmds[0]
+    assert '| gzip -c |' in cmds[1]
+    assert all(c[1]['executable'] == '/bin/bash' for c in mock_sub_chk.call_args_list)
+    assert 'zstd not found on 10.0.0.2, falling back to gzip compression' in caplog.text
+
+
+@mock.patch('forge.rsync.scan', wraps=rsync.scan)
+@mock.patch('forge.rsync.subprocess.check_output')
+@mock.patch('forge.rsync.key_file')
+@mock.patch('forge.rsync.get_ip')
+@mock.patch('forge.rsync.ec2_ip')
+def test_rsync_scan_once(mock_ec2_ip, mock_get_ip, mock_key_file, mock_sub_chk, mock_scan, tmp_path):
+    """Test that the folder is scanned once for all the instances it is copied to."""
+    rsync_path = tmp_path / 'app'
+    rsync_path.mkdir()
+    (rsync_path / '.forgeignore').write_text('*.log\n')
+    (rsync_path / 'run.sh').write_text('echo run')
+
+    ips = ['10.0.0.1', '10.0.0.2', '10.0.0.3']
+    mock_ec2_ip.return_value = [{'ip': ip, 'id': f'i-{ip}', 'state': 'running'} for ip in ips]
+    mock_get_ip.return_value = [(ip, f'i-{ip}') for ip in ips]
+    mock_key_file.return_value.__enter__.return_value = '/dummy/key/path'
+    mock_sub_chk.return_value = ''
+
+    config = Configuration(**{
+        **BASE_CONFIG,
+        'name': 'test-rsync',
+        'service': 'single',
+        'rsync_path': str(rsync_path),
+        'incremental_rsync': True,
+        'transfer_method': 'rsync',
+    })
+
+    assert rsync.rsync(config) == 0
+
+    mock_scan.assert_called_once()
+    assert mock_sub_chk.call_count == len(ips)
@@ -1,4 +1,5 @@
 """Tests for the run module of Forge."""
+import io
 import logging
 import subprocess
 from unittest import mock
@@ -7,6 +8,7 @@ import pytest
 
 from forge import run
 from forge.configuration import Configuration
+from forge.context import JobContext
 
 
 BASE_CONFIG = {
@@ -121,3 +123,86 @@ def test_run_error(mock_ec2_ip, mock_get_ip, mock_key_file, mock_sub_run, caplog
         ('forge.run', logging.ERROR, f'EC2 command failed with error code 123: {expected_cmd}'),
         ('forge.run', logging.ERROR, f'Run command raised error: Run command unsuccessful, ending attempts.')
     ]
+
+
+@mock.patch('forge.run.destroy')
+@mock.patch('forge.run.subprocess.Popen')
+@mock.patch('forge.run.key_file')
+@mock.patch('forge.run.get_ip')
+@mock.patch('forge.run.ec2_ip')
+@pytest.mark.parametrize('returncodes,exp_status', [([0, 0, 0], 0), ([0, 7, 9], 7)])
+def test_run_all_parallel(mock_ec2_ip, mock_get_ip, mock_key_file, mock_popen, mock_destroy,
+                          returncodes, exp_status, capsys):
+    """Test running the command on all the instances of a cluster at once."""
+    master_ip, worker_ips = '10.0.0.1', ['10.0.0.2', '10.0.0.3']
+    mock_ec2_ip.return_value = []
+    mock_get_ip.side_effect = [[(master_ip, 'i-1')], [(ip, f'i-{ip}') for ip in worker_ips]]
+    key_path = '/dummy/key/path'
+    mock_key_file.return_value.__enter__.return_value = key_path
+
+    codes = dict(zip([master_ip, *worker_ips], returncodes))
+
+    def _popen(cmd, **kwargs):
+        ip = cmd[-3].split('@')[1]
+        proc = mock.Mock()
+        proc.stdout = io.StringIO(f'hello from {cmd[-1]}\n')
+        proc.stderr = io.StringIO('warning\n')
+        proc.wait.return_value = codes[ip]
+        return proc
+
+    mock_popen.side_effect = _popen
+
+    config = Configuration(**{
+        **BASE_CONFIG,
+        'name': 'test-run',
+        'service': 'cluster',
+        'market': ['on-demand', 'spot'],
+        'run_cmd': 'dummy.sh {task}',
+        'rr_all': True,
+        'run_concurrency': 2,
+        'destroy_after_failure': False,
+    })
+
+    assert run.run(config) == exp_status
+
+    mock_key_file.assert_called_once()
+    assert mock_popen.call_count == 3
+    cmd = mock_popen.call_args_list[0][0][0]
+    assert cmd[:2] == ['ssh', '-o']
+    assert '-t' not in cmd
+
+    out, err = capsys.readouterr()
+    assert f'[{master_ip}] hello from cluster-master' in out
+    for ip in worker_ips:
+        assert f'[{ip}] hello from cluster-worker' in out
+        assert f'[{ip}] warning' in err
+    mock_destroy.assert_not_called()
+
+
+@mock.patch('forge.run.subprocess.Popen')
+@mock.patch('forge.run.key_file')
+@mock.patch('forge.run.ec2_ip')
+def test_run_synced_only(mock_ec2_ip, mock_key_file, mock_popen):
+    """Test that engine only runs on the workers of a partial fleet that have the user content."""
+    master, worker = 'test-run-spot-cluster-master-', 'test-run-spot-cluster-worker-'
+    config = Configuration(**{
+        **BASE_CONFIG,
+        'job': 'engine',
+        'name': 'test-run',
+        'service': 'cluster',
+        'run_cmd': 'dummy.sh',
+        'rr_all': True,
+        'job_context': JobContext(),
+    })
+    for n, uid, ip in [(master, 'i-1', '10.0.0.1'), (worker, 'i-2', '10.0.0.2')]:
+        config.job_context.add_instance(n, {'ip': ip, 'id': uid, 'state': 'running'})
+        config.job_context.mark_synced(uid)
+    config.job_context.set_readiness(worker, 1, 2)
+    mock_key_file.return_value.__enter__.return_value = '/dummy/key/path'
+    mock_popen.side_effect = lambda cmd, **kwargs: mock.Mock(stdout=io.StringIO(), stderr=io.StringIO(),
+                                                             **{'wait.return_value': 0})
+
+    assert run.run(config) == 0
+
+    mock_ec2_ip.assert_not_called()
+    assert sorted(c[0][0][-2] for c in mock_popen.call_args_list) == ['root@10.0.0.1', 'root@10.0.0.2']
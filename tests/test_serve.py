@@ -0,0 +1,92 @@
+"""Tests for the forge serve daemon."""
+import os
+import threading
+from unittest import mock
+
+import pytest
+
+from forge import __version__, common, cost, serve
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    """A daemon serving on a socket in tmp_path, in a background thread."""
+    monkeypatch.setattr(serve, 'POLL_INTERVAL', 0.05)
+    monkeypatch.setenv(serve.SOCKET_ENV, str(tmp_path / 'serve.sock'))
+    server = serve.ForgeServer(str(tmp_path / 'serve.sock'))
+    server.listen()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    thread.join()
+    server.close()
+
+
+def test_forward_no_daemon(monkeypatch, tmp_path):
+    """Test that commands run locally without a daemon or when forwarding is disabled."""
+    monkeypatch.setenv(serve.SOCKET_ENV, str(tmp_path / 'missing.sock'))
+    assert serve.forward_command(['stop']) is None
+
+    (tmp_path / 'stale.sock').touch()
+    monkeypatch.setenv(serve.SOCKET_ENV, str(tmp_path / 'stale.sock'))
+    assert serve.forward_command(['stop']) is None
+
+    monkeypatch.setenv(serve.DAEMON_ENV, '0')
+    with mock.patch('forge.serve.socket.socket') as mock_socket:
+        assert serve.forward_command(['stop']) is None
+    mock_socket.assert_not_called()
+
+
+def test_forward_command(server, capfd):
+    """Test that a forwarded command writes to the terminal of the CLI and returns its status."""
+    assert serve.forward_command(['--version']) == 0
+    assert f'Forge v{__version__}' in capfd.readouterr().out
+
+    assert serve.forward_command(['not-a-command']) == 2
+    assert 'invalid choice' in capfd.readouterr().err
+
+
+def test_listen_in_use(server):
+    """Test that a second daemon does not take over the socket of a running one."""
+    with pytest.raises(RuntimeError, match='already listening'):
+        serve.ForgeServer(server.path).listen()
+
+
+@mock.patch.object(serve.ForgeServer, 'warm')
+def test_merge(mock_warm, tmp_path, monkeypatch):
+    """Test that the daemon keeps the prices, keys and session a command sent back."""
+    monkeypatch.setattr(cost, '_PRICES', {})
+    monkeypatch.setattr(common, 'PEM_KEYS', {})
+    server = serve.ForgeServer(str(tmp_path / 'serve.sock'))
+
+    server.merge({'prices': [['us-east-1', 'r5.large', 'us-east-1a', 'spot', 0.05]],
+                  'keys': [['pem', 'us-east-1', None, 'KEY']],
+                  'session': [None, 'us-east-1']})
+
+    assert cost._PRICES == {('us-east-1', 'r5.large', 'us-east-1a', 'spot'): 0.05}
+    assert common.PEM_KEYS == {('pem', 'us-east-1', None): 'KEY'}
+    mock_warm.assert_called_once_with(None, 'us-east-1')
+
+    with mock.patch.object(serve, 'PRICE_TTL', -1):
+        server._expire()
+    assert cost._PRICES == {}
+
+
+def test_share_warm_state(monkeypatch):
+    """Test that commands with other AWS credentials than the daemon do not get its sessions, keys and prices."""
+    monkeypatch.setattr(cost, '_PRICES', {('us-east-1', 'r5.large', 'us-east-1a', 'spot'): 0.05})
+    monkeypatch.setattr(common, 'PEM_KEYS', {('pem', 'us-east-1', None): 'KEY'})
+    monkeypatch.setattr(common, 'WARM_SESSIONS', {(None, 'us-east-1'): object()})
+    monkeypatch.setenv('AWS_PROFILE', 'dev')
+
+    assert serve._share_warm_state({**os.environ, 'HOME': '/other'})
+    assert cost._PRICES and common.PEM_KEYS and common.WARM_SESSIONS
+
+    assert not serve._share_warm_state({**os.environ, 'AWS_PROFILE': 'prod'})
+    assert not cost._PRICES and not common.PEM_KEYS and not common.WARM_SESSIONS
+
+
+def test_socket_permissions(server):
+    """Test that only the user can connect to the daemon."""
+    assert os.stat(server.path).st_mode & 0o777 == 0o600
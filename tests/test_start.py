@@ -77,3 +77,48 @@ def test_start_error_in_spot_instance(mock_start_fleet, caplog, service, markets
     with caplog.at_level(logging.ERROR):
         start.start(config)
     assert error_msg in caplog.text
+
+
+@mock.patch('forge.start.wait_for_state')
+@mock.patch('forge.start.ec2_ip')
+@mock.patch('forge.start.boto3')
+@pytest.mark.parametrize('wait', [None, True])
+def test_start_fleet(mock_boto, mock_ec2_ip, mock_wait, caplog, wait):
+    """Test that all fleets are started in one request and, when waiting, the new IPs are reported."""
+    mock_ec2_ip.side_effect = lambda n, config, client: [
+        {'ip': None, 'id': f'{n}-{i}', 'state': 'stopped'} for i in range(2)
+    ]
+    mock_wait.return_value = (
+        [{'id': 'master-0', 'ip': '10.0.0.1', 'state': 'running'}, {'id': 'worker-1', 'ip': None, 'state': 'pending'}],
+        [{'id': 'worker-1', 'ip': None, 'state': 'pending'}],
+    )
+    config = Configuration(**{**BASE_CONFIG, 'start_wait': wait})
+
+    with caplog.at_level(logging.INFO):
+        status = start.start_fleet(['master', 'worker'], config)
+
+    client = mock_boto.client.return_value
+    mock_boto.client.assert_called_once_with('ec2')
+    assert all(c[0][2] is client for c in mock_ec2_ip.call_args_list)
+    client.start_instances.assert_called_once_with(InstanceIds=['master-0', 'master-1', 'worker-0', 'worker-1'])
+    if wait:
+        assert status == 1
+        assert 'master instance master-0 is running at 10.0.0.1' in caplog.text
+        assert 'Instance worker-1 (None) is still pending.' in caplog.text
+    else:
+        assert status == 0
+        mock_wait.assert_not_called()
+
+
+@mock.patch('forge.start.wait_for_state')
+@mock.patch('forge.start.ec2_ip')
+@mock.patch('forge.start.boto3')
+def test_start_fleet_hibernate(mock_boto, mock_ec2_ip, mock_wait):
+    """Test that resuming from hibernation waits for the instances to pass their status checks."""
+    mock_ec2_ip.return_value = [{'ip': None, 'id': 'i-1', 'state': 'stopped'}]
+    mock_wait.return_value = ([{'id': 'i-1', 'ip': '10.0.0.2', 'state': 'running'}], [])
+    config = Configuration(**{**BASE_CONFIG, 'hibernate': True})
+
+    assert start.start_fleet(['single'], config) == 0
+
+    mock_wait.assert_called_once_with(mock_boto.client.return_value, ['i-1'], 'running', 600, status_ok=True)
@@ -0,0 +1,55 @@
+"""Tests for the startup time of the Forge CLI."""
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import forge
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.realpath(forge.__file__)))
+
+# Runs main with the given arguments and prints the Forge modules loaded, and if boto3 was
+LOADED_MODULES = '''
+import json, sys
+sys.argv = ['forge'] + sys.argv[1:]
+from forge import main
+try:
+    main.main()
+except SystemExit:
+    pass
+print(json.dumps({'boto3': 'boto3' in sys.modules,
+                  'forge': sorted(m for m in sys.modules if m.startswith('forge.'))}))
+'''
+
+
+def _python(*args):
+    env = {**os.environ, 'PYTHONPATH': os.pathsep.join(filter(None, [SRC_DIR, os.environ.get('PYTHONPATH')]))}
+    return subprocess.run([sys.executable, *args], capture_output=True, text=True, env=env, check=True)
+
+
+def _loaded(*args):
+    return json.loads(_python('-c', LOADED_MODULES, *args).stdout.strip().splitlines()[-1])
+
+
+@pytest.mark.parametrize('args', [['--version'], ['--help'], []])
+def test_no_subcommand_imports(args):
+    """Test that no subcommand module nor boto3 is imported without a subcommand."""
+    loaded = _loaded(*args)
+    assert not loaded['boto3']
+    assert loaded['forge'] == ['forge.main']
+
+
+def test_subcommand_imports_only_its_module():
+    """Test that only the selected subcommand module and its dependencies are imported."""
+    loaded = _loaded('stop', '--help')
+    assert 'forge.stop' in loaded['forge']
+    assert not {'forge.create', 'forge.engine', 'forge.run', 'forge.rsync', 'forge.cleanup'} & set(loaded['forge'])
+
+
+def test_import_main_no_aws():
+    """Test that importing the CLI entrypoint does not import boto3 or botocore, which make up most of the startup."""
+    loaded = json.loads(_python('-c', 'import json, sys; import forge.main; print(json.dumps(sorted(sys.modules)))')
+                        .stdout)
+    assert not {'boto3', 'botocore'} & set(loaded)
@@ -0,0 +1,55 @@
+import logging
+from unittest import mock
+
+import pytest
+from botocore.exceptions import ClientError
+
+from forge import stop
+from forge.configuration import Configuration
+
+
+BASE_CONFIG = {
+    'region': 'us-east-1',
+    'ec2_amis': {},
+    'ec2_key': '',
+    'forge_env': 'dev',
+    'forge_pem_secret': '',
+    'job': 'stop'
+}
+
+
+@mock.patch('forge.stop.ec2_ip')
+@mock.patch('forge.stop.boto3')
+@pytest.mark.parametrize('hibernate', [None, True])
+def test_stop_fleet(mock_boto, mock_ec2_ip, hibernate):
+    """Test that all fleets are stopped in one request, hibernating them when asked."""
+    mock_ec2_ip.side_effect = lambda n, config, client: [{'ip': '10.0.0.1', 'id': f'{n}-0', 'state': 'running'}]
+    config = Configuration(**{**BASE_CONFIG, 'hibernate': hibernate})
+
+    assert stop.stop_fleet(['master', 'worker'], config) == 0
+
+    mock_boto.client.assert_called_once_with('ec2')
+    assert all(c[0][2] is mock_boto.client.return_value for c in mock_ec2_ip.call_args_list)
+    expected = {'Hibernate': True} if hibernate else {}
+    mock_boto.client.return_value.stop_instances.assert_called_once_with(InstanceIds=['master-0', 'worker-0'],
+                                                                         **expected)
+
+
+@mock.patch('forge.stop.ec2_ip')
+@mock.patch('forge.stop.boto3')
+def test_stop_fleet_hibernate_fallback(mock_boto, mock_ec2_ip, caplog):
+    """Test that instances that cannot hibernate are stopped instead."""
+    mock_ec2_ip.return_value = [{'ip': '10.0.0.1', 'id': 'i-1', 'state': 'running'}]
+    client = mock_boto.client.return_value
+    client.stop_instances.side_effect = [
+        ClientError({'Error': {'Code': 'UnsupportedHibernationConfiguration'}}, 'StopInstances'), {}
+    ]
+    config = Configuration(**{**BASE_CONFIG, 'hibernate': True})
+
+    with caplog.at_level(logging.WARNING):
+        assert stop.stop_fleet(['single'], config) == 0
+
+    assert client.stop_instances.call_args_list == [
+        mock.call(InstanceIds=['i-1'], Hibernate=True), mock.call(InstanceIds=['i-1'])
+    ]
+    assert 'Could not hibernate i-1, stopping them instead.' in caplog.text